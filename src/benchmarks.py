@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from units import CatalogStorage, DatabaseManager, Errors, SQLiteDatabaseManager, get_db_backend, get_db_credentials
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# depth levels of fanout subdirectories, every directory holding files_per_directory small files
+SHAPES = {
+    "wide": {"depth": 1, "fanout": 200, "files_per_directory": 50},
+    "deep": {"depth": 60, "fanout": 1, "files_per_directory": 20},
+    "bushy": {"depth": 4, "fanout": 6, "files_per_directory": 25},
+}
+SEARCHES = ["file_00001", "dir_0", "f", "txt", "file dir", "no_such_entry"]
+SORTS = ["id", "-size", "name"]
+
+
+def build_tree(root: str, depth: int, fanout: int, files_per_directory: int, seed: int = 0):
+    """ Creates a synthetic tree of small files under root, the same for the same arguments.
+    Returns the number of catalog rows it makes, root included """
+    rng = random.Random(seed)
+    rows = 1
+    pending = [(root, 0)]
+    while pending:
+        directory, level = pending.pop()
+        for f in range(files_per_directory):
+            with open(os.path.join(directory, f"file_{f:05d}.txt"), "w") as out:
+                out.write("x" * rng.randrange(4096))
+        rows += files_per_directory
+        if level < depth:
+            for d in range(fanout):
+                child = os.path.join(directory, f"dir_{d:05d}")
+                os.mkdir(child)
+                pending.append((child, level + 1))
+            rows += fanout
+    return rows
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes on Linux
+
+
+def latencies(samples: list):
+    """ Percentiles in milliseconds of a list of durations in seconds """
+    if not samples:
+        return {}
+    ms = sorted(sample * 1000 for sample in samples)
+    cuts = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {"count": len(ms), "p50": cuts[49], "p90": cuts[89], "p99": cuts[98], "max": ms[-1]}
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def throughput(rows: int, seconds: float):
+    return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0,
+            "peak_rss_bytes": peak_rss_bytes()}
+
+
+def bench_import(db: CatalogStorage, tree: str, batch_size, rows: int, scan_workers: int = 0):
+    stats, seconds = timed(db._insert_directory_to_db, tree, batch_size=batch_size, scan_workers=scan_workers)
+    result = throughput(rows, seconds)
+    if stats is not None:
+        result["hash_index"] = stats["hash_index"]
+    return result
+
+
+def bench_listing(db: CatalogStorage):
+    db.cache.invalidate()
+    files, seconds = timed(db.fetch_all_files)
+    return throughput(len(files), seconds)
+
+
+def bench_search(db: CatalogStorage, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        for keywords in SEARCHES:
+            db.cache.invalidate()
+            samples.append(timed(db.search_with_keywords, keywords)[1])
+    return latencies(samples)
+
+
+def bench_pages(db: CatalogStorage, pages: int, page_size: int):
+    """ What refresh_list_view waits for: every page of the walk and its count, for each sort order """
+    results = {}
+    for sort in SORTS:
+        samples = []
+        after_key = None
+        for _ in range(pages):
+            db.cache.invalidate()
+            started = time.perf_counter()
+            _, after_key = db.fetch_page(after_key, page_size, sort)
+            db.approximate_count()
+            samples.append(time.perf_counter() - started)
+            if after_key is None:
+                break
+        results[sort] = latencies(samples)
+    return results
+
+
+def bench_delete(db: CatalogStorage, tree: str, rows: int):
+    stats, seconds = timed(db._delete_directory, db.find_id(tree))
+    return throughput(stats["rows"], seconds)
+
+
+def bench_shape(db: CatalogStorage, shape: dict, args):
+    tree = tempfile.mkdtemp(prefix="catalog_bench_")
+    try:
+        rows, seconds = timed(build_tree, tree, shape["depth"], shape["fanout"],
+                              shape["files_per_directory"] * args.scale, args.seed)
+        return {
+            "shape": shape,
+            "rows": rows,
+            "generate_seconds": seconds,
+            "import": bench_import(db, tree, args.batch_size, rows, args.scan_workers),
+            "fetch_all_files": bench_listing(db),
+            "search_with_keywords": bench_search(db, args.repeat),
+            "pages": bench_pages(db, args.pages, args.page_size),
+            "delete": bench_delete(db, tree, rows),
+        }
+    finally:
+        db._delete_directory(db.find_id(tree))
+        shutil.rmtree(tree, ignore_errors=True)
+
+
+def compare_imports(db: CatalogStorage, args):
+    """ Row by row, batched and pipelined imports of the same wide tree """
+    tree = tempfile.mkdtemp(prefix="catalog_bench_")
+    try:
+        shape = SHAPES["wide"]
+        rows = build_tree(tree, shape["depth"], shape["fanout"], shape["files_per_directory"], args.seed)
+        results = {}
+        for name, batch_size, scan_workers in (("row_by_row", None, 0), ("bulk", args.batch_size, 0),
+                                               ("pipeline", args.batch_size, args.scan_workers)):
+            results[name] = bench_import(db, tree, batch_size, rows, scan_workers)
+            db._delete_directory(db.find_id(tree))
+        results["speedup"] = results["bulk"]["rows_per_sec"] / results["row_by_row"]["rows_per_sec"]
+        return results
+    finally:
+        shutil.rmtree(tree, ignore_errors=True)
+
+
+def key_index_bytes(cursor, table: str, sqlite: bool):
+    """ Size of the unique index on path_key of a scratch table, None when the server does not tell """
+    try:
+        if sqlite:
+            cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", (f"sqlite_autoindex_{table}_1",))
+        else:
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+            cursor.execute(
+                """SELECT stat_value * @@innodb_page_size FROM mysql.innodb_index_stats
+                   WHERE database_name = DATABASE() AND table_name = %s AND index_name = 'path_key'
+                   AND stat_name = 'size'""",
+                (table,)
+            )
+        row = cursor.fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+    except Exception as e:  # dbstat not compiled in, or no access to the mysql schema
+        print(f"⚠️ Could not measure the index of {table}: {e}", file=sys.stderr)
+        return None
+
+
+def bench_path_keys(db: CatalogStorage, count: int, lookups: int, seed: int):
+    """ Index size, hashing rate and point lookup latency of the old hex SHA-256 path hash
+    against the binary BLAKE2b path key, each in a scratch table of count synthetic paths """
+    sqlite = isinstance(db, SQLiteDatabaseManager)
+    variants = {
+        "hex_sha256": ("TEXT" if sqlite else "VARCHAR(64)", db.hash_path),
+        "blake2b_128": ("BLOB" if sqlite else "BINARY(16)", db.path_key),
+    }
+    paths = [f"/bench/dir_{i // 1000:05d}/file_{i:08d}.txt" for i in range(count)]
+    probes = random.Random(seed).sample(paths, min(lookups, count))
+    results = {}
+    with db._cursor() as cursor:
+        for name, (column_type, key) in variants.items():
+            table = f"bench_keys_{name}"
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY{'' if sqlite else ' AUTO_INCREMENT'}, "
+                           f"path_key {column_type} NOT NULL UNIQUE)")
+            try:
+                keys, hash_seconds = timed(lambda: [key(path) for path in paths])
+                for start in range(0, count, db.BULK_BATCH_SIZE):
+                    cursor.executemany(f"INSERT INTO {table} (path_key) VALUES (%s)",
+                                       [(path_key,) for path_key in keys[start:start + db.BULK_BATCH_SIZE]])
+                cursor.connection.commit()
+
+                samples = []
+                for path in probes:
+                    started = time.perf_counter()
+                    cursor.execute(f"SELECT id FROM {table} WHERE path_key = %s", (key(path),))
+                    cursor.fetchone()
+                    samples.append(time.perf_counter() - started)
+                results[name] = {"index_bytes": key_index_bytes(cursor, table, sqlite),
+                                 "keys_per_sec": count / hash_seconds if hash_seconds else 0.0,
+                                 "lookup": latencies(samples)}
+            finally:
+                cursor.execute(f"DROP TABLE {table}")
+                cursor.connection.commit()
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "started": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times imports, listings, searches, page walks and deletes "
+                                                 "on synthetic trees and prints the results as JSON")
+    parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the files per directory of every shape")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=DatabaseManager.BULK_BATCH_SIZE)
+    parser.add_argument("--scan-workers", type=int, default=DatabaseManager.SCAN_WORKERS)
+    parser.add_argument("--repeat", type=int, default=3, help="rounds of the search queries")
+    parser.add_argument("--pages", type=int, default=20, help="pages walked per sort order")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--compare-imports", action="store_true", help="also compare the import strategies")
+    parser.add_argument("--path-keys", type=int, default=0, metavar="COUNT",
+                        help="also compare hex and binary path key indexes of COUNT rows")
+    parser.add_argument("--lookups", type=int, default=2000, help="point lookups per path key index")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"], default=None,
+                        help="defaults to the backend of configuration.json")
+    parser.add_argument("--sqlite-path", default=None, help="catalog file, a fresh temporary one by default")
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--output", default=None, help="also write the JSON to this file")
+    args = parser.parse_args()
+
+    scratch = tempfile.TemporaryDirectory()
+    args.backend = args.backend or get_db_backend()[0]
+    if args.backend == "sqlite":
+        db = SQLiteDatabaseManager(args.sqlite_path or os.path.join(scratch.name, "catalog.sqlite3"))
+    else:
+        host, port, user, password, database = get_db_credentials()
+        db = DatabaseManager(host=host, port=port, user=user, passwd=args.password or password, database=database)
+    if db.error_code != Errors.EVERYTHING_IS_FINE:
+        raise SystemExit(f"⚠️ Could not connect to the database: {db.error_code.value}")
+
+    try:
+        results = {"environment": environment(), "arguments": vars(args), "shapes": {}}
+        results["arguments"].pop("password")
+        for name in args.shapes:
+            results["shapes"][name] = bench_shape(db, SHAPES[name], args)
+        if args.compare_imports:
+            results["import_modes"] = compare_imports(db, args)
+        if args.path_keys:
+            results["path_keys"] = bench_path_keys(db, args.path_keys, args.lookups, args.seed)
+        results["peak_rss_bytes"] = peak_rss_bytes()
+    finally:
+        db.close()
+        scratch.cleanup()
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from metrics import metrics
+import transfer
+from units import CatalogStorage, FileType, get_metrics_settings, open_catalog
+
+# Columns of search and export output
+ENTRY_FIELDS = ("id", "name", "type", "path", "parent_id", "size", "total_size", "file_count")
+EXIT_FAILED = 1
+EXIT_INTERRUPTED = 130
+
+
+def entry_record(entry):
+    return {"id": entry.id, "name": entry.name, "type": entry.type.value, "path": entry.abs_path,
+            "parent_id": entry.parent_id, "size": entry.size, "total_size": entry.total_size,
+            "file_count": entry.file_count}
+
+
+def write_entries(entries, output_format: str, out):
+    """ Writes entries to out as paths, CSV with a header row or newline delimited JSON, returns how many """
+    written = 0
+    if output_format == "csv":
+        writer = csv.DictWriter(out, ENTRY_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        for entry in entries:
+            writer.writerow(entry_record(entry))
+            written += 1
+    elif output_format in ("json", "ndjson"):
+        for entry in entries:
+            out.write(json.dumps(entry_record(entry), ensure_ascii=False) + "\n")
+            written += 1
+    else:
+        for entry in entries:
+            out.write(entry.abs_path + ("/" if entry.type == FileType.DIRECTORY else "") + "\n")
+            written += 1
+    return written
+
+
+def warn(message: str):
+    print(f"⚠️ {message}", file=sys.stderr)
+
+
+class ScanProgress:
+    """ Rows imported per root, reported to stderr every interval seconds from a daemon thread """
+
+    def __init__(self, roots: list, interval: float):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.jobs = {}  # root -> ImportJob, roots that are rescanned report only when they finish
+        self.finished = {root: None for root in roots}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._report_loop, name="scan-progress", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def rows(self):
+        return sum(job.rows for job in list(self.jobs.values()))
+
+    def line(self):
+        seconds = time.perf_counter() - self.started
+        rows = self.rows()
+        roots = []
+        for root, result in list(self.finished.items()):
+            job = self.jobs.get(root)
+            if result is not None:
+                roots.append(f"{root}: done")
+            elif job is not None:
+                roots.append(f"{root}: {job.rows} rows, {job.completed_dirs} dirs")
+            else:
+                roots.append(f"{root}: scanning")
+        return (f"[{seconds:7.1f}s] {rows} rows, {rows / seconds if seconds else 0:.0f} rows/s | "
+                + " | ".join(roots))
+
+    def _report_loop(self):
+        while not self._stop.wait(self.interval):
+            print(self.line(), file=sys.stderr, flush=True)
+
+
+def scan_root(db: CatalogStorage, root: str, full: bool, progress: ScanProgress):
+    """ Imports root as a resumable job, or rescans it when it is catalogued already """
+    started = time.perf_counter()
+    job = db.open_import_job(root)
+    if job is None:
+        stats = db._rescan_directory(root, full)
+        result = {"root": root, "mode": "rescan", "rows": stats["added"], "removed": stats["removed"],
+                  "updated": stats["updated"], "status": "done"}
+    else:
+        progress.jobs[root] = job
+        db._run_import_job(job)
+        result = {"root": root, "mode": "import", "rows": job.rows, "removed": 0, "updated": 0,
+                  "status": job.status.value}
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    result["rows_per_sec"] = round(result["rows"] / result["seconds"]) if result["seconds"] else 0
+    progress.finished[root] = result
+    return result
+
+
+def command_scan(db: CatalogStorage, args):
+    roots = []
+    for root in args.roots:
+        root = os.path.abspath(root)
+        if not os.path.isdir(root):
+            warn(f"{root} is not a directory")
+            return EXIT_FAILED
+        if root not in roots:
+            roots.append(root)
+
+    progress = ScanProgress(roots, 0 if args.quiet else args.progress)
+    progress.start()
+    exit_code = 0
+    with ThreadPoolExecutor(max_workers=args.parallel, thread_name_prefix="scan") as executor:
+        futures = {executor.submit(scan_root, db, root, args.full, progress): root for root in roots}
+        try:
+            pending = set(futures)
+            while pending:
+                # A short timeout keeps the main thread able to take Ctrl-C
+                done, pending = wait(pending, timeout=0.5)
+        except KeyboardInterrupt:
+            warn("Interrupted, cancelling the imports at their next directory, scan again to resume them")
+            for future in futures:
+                future.cancel()
+            for job in list(progress.jobs.values()):
+                job.cancel()
+            exit_code = EXIT_INTERRUPTED
+    progress.stop()
+
+    for future, root in futures.items():
+        if future.cancelled():
+            continue
+        error = future.exception()
+        if error is not None:
+            warn(f"Scan of {root} failed: {error}")
+            exit_code = exit_code or EXIT_FAILED
+            continue
+        result = future.result()
+        if result["status"] != "done":
+            exit_code = exit_code or EXIT_INTERRUPTED
+        if args.json:
+            print(json.dumps(result, ensure_ascii=False))
+        else:
+            print(f"{root}: {result['mode']} {result['status']}, {result['rows']} added, {result['removed']} removed, "
+                  f"{result['updated']} updated in {result['seconds']:.1f}s ({result['rows_per_sec']} rows/s)")
+    if not args.json and not args.quiet:
+        seconds = time.perf_counter() - progress.started
+        total = sum(result["rows"] for result in progress.finished.values() if result is not None)
+        print(f"{total} rows in {seconds:.1f}s ({total / seconds if seconds else 0:.0f} rows/s)", file=sys.stderr)
+    return exit_code
+
+
+def command_search(db: CatalogStorage, args):
+    keywords = " ".join(args.keywords)
+    written = write_entries(db.iter_files(keywords, args.all, limit=args.limit), args.format, sys.stdout)
+    return 0 if written else EXIT_FAILED  # like grep, nothing found is a failure for scripts
+
+
+@contextmanager
+def output_file(path: str):
+    """ stdout for None or -, otherwise path compressed as its extension says. It is written next to the target
+    and renamed, so a reader never sees half a file """
+    if path in (None, "-"):
+        yield sys.stdout
+        return
+    partial = path + ".part"
+    try:
+        with transfer.open_text(partial, "w", transfer.file_kind(path)[1]) as out:
+            yield out
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def command_export(db: CatalogStorage, args):
+    keywords = " ".join(args.keywords) or None
+    with output_file(args.output) as out:
+        written = write_entries(db.iter_files(keywords, args.all), args.format, out)
+    if not args.quiet:
+        print(f"{written} entries exported", file=sys.stderr)
+    return 0
+
+
+def command_dump(db: CatalogStorage, args):
+    output_format = args.format or transfer.file_kind(args.output or "")[0] or "ndjson"
+    root = os.path.abspath(args.root) if args.root else None
+    if root is not None and db.find_id(root) is None:
+        warn(f"{root} is not in the catalog")
+        return EXIT_FAILED
+    with output_file(args.output) as out:
+        written = transfer.write_dump(db.dump_rows(root), output_format, out)
+    if not args.quiet:
+        print(f"{written} entries dumped", file=sys.stderr)
+    return 0
+
+
+def command_load(db: CatalogStorage, args):
+    last_report = [time.perf_counter()]
+
+    def progress(step: str, rows: int):
+        if not args.quiet and time.perf_counter() - last_report[0] >= args.progress:
+            last_report[0] = time.perf_counter()
+            print(f"{rows} rows {step}", file=sys.stderr, flush=True)
+
+    for path in args.files:
+        input_format, compression = transfer.file_kind(path)
+        input_format = args.format or input_format
+        if input_format is None:
+            warn(f"Cannot tell the format of {path} from its name, give it with --format")
+            return EXIT_FAILED
+        if path == "-":
+            records = transfer.read_dump(sys.stdin, input_format)
+            stats = db.bulk_load(records, progress=progress)
+        else:
+            with transfer.open_text(path, "r", compression) as lines:
+                stats = db.bulk_load(transfer.read_dump(lines, input_format), progress=progress)
+        print(f"{path}: {stats['rows']} of {stats['staged']} entries added in {stats['seconds']:.1f}s "
+              f"({stats['rows_per_sec']:.0f} rows/s)")
+    return 0
+
+
+def command_delete(db: CatalogStorage, args):
+    exit_code = 0
+    for path in args.paths:
+        path = os.path.abspath(path)
+        entry_id = db.find_id(path)
+        if entry_id is None:
+            warn(f"{path} is not in the catalog")
+            exit_code = EXIT_FAILED
+            continue
+        stats = db._delete_directory(entry_id)
+        if not args.quiet:
+            print(f"{path}: {stats['rows']} entries removed from the catalog")
+    return exit_code
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Scans, searches and exports the file catalog without the UI")
+    parser.add_argument("--config", default="configuration.json",
+                        help="configuration file, relative to this script (default: %(default)s)")
+    parser.add_argument("--password", default=None, help="MySQL password, instead of the one in the configuration")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress or summary on stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="import new roots and rescan catalogued ones")
+    scan.add_argument("roots", nargs="+", metavar="ROOT")
+    scan.add_argument("--parallel", type=int, default=4, help="roots scanned at the same time (default: %(default)s)")
+    scan.add_argument("--full", action="store_true", help="rescan unchanged directories for file size changes")
+    scan.add_argument("--progress", type=float, default=2.0, metavar="SECONDS",
+                      help="seconds between progress lines on stderr, 0 for none (default: %(default)s)")
+    scan.add_argument("--json", action="store_true", help="one JSON summary line per root on stdout")
+    scan.set_defaults(run=command_scan)
+
+    search = commands.add_parser("search", help="print the entries matching keywords, best matches first")
+    search.add_argument("keywords", nargs="+", metavar="KEYWORD")
+    search.add_argument("--all", action="store_true", help="match every keyword instead of any")
+    search.add_argument("--limit", type=int, default=100, help="entries to print (default: %(default)s)")
+    search.add_argument("--format", choices=("text", "json", "csv"), default="text")
+    search.set_defaults(run=command_search)
+
+    export = commands.add_parser("export", help="stream the catalog, or the matches of keywords, to a file")
+    export.add_argument("keywords", nargs="*", metavar="KEYWORD")
+    export.add_argument("--all", action="store_true", help="match every keyword instead of any")
+    export.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    export.add_argument("-o", "--output", default=None,
+                        help="file to write, gzip or zstd compressed when it ends in .gz or .zst, stdout when left out")
+    export.set_defaults(run=command_export)
+
+    dump = commands.add_parser("dump", help="write the catalog, or the subtree of ROOT, to a file load can read")
+    dump.add_argument("root", nargs="?", metavar="ROOT")
+    dump.add_argument("--format", choices=("ndjson", "csv"), default=None,
+                      help="default: from the name of the output file, ndjson otherwise")
+    dump.add_argument("-o", "--output", default=None,
+                      help="file to write, gzip or zstd compressed when it ends in .gz or .zst, stdout when left out")
+    dump.set_defaults(run=command_dump)
+
+    load = commands.add_parser("load", help="add the entries of dumps or find listings to the catalog in bulk")
+    load.add_argument("files", nargs="+", metavar="FILE",
+                      help="a dump, or a listing written by find -L \"$PWD\" -printf '%%p\\t%%y\\t%%s\\t%%T@\\t%%i\\n' "
+                           "into a .tsv file, - for stdin")
+    load.add_argument("--format", choices=("ndjson", "csv", "tsv"), default=None,
+                      help="default: from the file name, .gz and .zst files are decompressed")
+    load.add_argument("--progress", type=float, default=2.0, metavar="SECONDS",
+                      help="seconds between progress lines on stderr (default: %(default)s)")
+    load.set_defaults(run=command_load)
+
+    delete = commands.add_parser("delete", help="remove entries and everything below them from the catalog, "
+                                                "files on disk are left alone")
+    delete.add_argument("paths", nargs="+", metavar="PATH")
+    delete.set_defaults(run=command_delete)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics_settings = get_metrics_settings(args.config)
+    if metrics_settings is not None:
+        metrics.configure(metrics_settings)
+    try:
+        db = open_catalog(args.password, args.config)
+    except ConnectionError as e:
+        warn(str(e))
+        return EXIT_FAILED
+    try:
+        return args.run(db, args)
+    except BrokenPipeError:
+        # The reader went away, like head does, which is not an error of the command
+        sys.stdout = open(os.devnull, "w")
+        return 0
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        db.close()
+        if metrics_settings is not None and metrics_settings.get("export_path"):
+            metrics.write(metrics_settings["export_path"])  # a short run may end before the first periodic export
+        metrics.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
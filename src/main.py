@@ -1,34 +1,23 @@
-import json
+import asyncio
 import os
 import platform
 import subprocess
+import time
+from collections import deque
 from functools import partial
 import flet as ft
 import flet_lottie as fl
 
-from units import DatabaseManager, FileEntry, encode_animation
+from metrics import metrics
+from units import (DatabaseManager, Errors, FileEntry, FileType, JobStatus, SQLiteDatabaseManager,
+                   encode_animation, get_db_backend, get_db_credentials, get_metrics_settings)
+from watcher import CatalogWatcher
 
 current_page = 0
 files_per_page = 500
-
-
-def get_db_credentials(filepath="configuration.json"):
-    try:
-        absolute_path = os.path.join(os.path.dirname(__file__), filepath)
-        with open(absolute_path, "r") as f:
-            configuration = json.load(f)
-            host = configuration.get("host")
-            port = configuration.get("port")
-            user = configuration.get("user")
-            password = configuration.get("password")
-            database = configuration.get("database")
-            return host, port, user, password, database
-    except FileNotFoundError:
-        return None, None, None, None, None
-    except json.JSONDecodeError:
-        return None, None, None, None, None
-    except TypeError:  # added type error handling
-        return None, None, None, None, None
+SEARCH_DEBOUNCE = 0.3  # seconds without a keystroke before the search runs
+last_render_ms = 0.0
+render_times_ms = deque(maxlen=100)  # (milliseconds, rows that changed) of the latest page renders
 
 
 def setPageZero():
@@ -47,50 +36,93 @@ async def main(page: ft.Page):
         global password_is_correct
         page.horizontal_alignment = ft.CrossAxisAlignment.CENTER
         header_text_style = ft.TextStyle(weight=ft.FontWeight.BOLD, size=20)
-        host, port, user, password, database = get_db_credentials()
-
-        if host is None or port is None or user is None or database is None:
-            display_credential_error()
-            return
-
-        if credential is None:
-            if password is None:
-                display_password_ask()
+        backend, sqlite_path = get_db_backend()
+        if backend == "sqlite":
+            # A local catalog file needs neither credentials nor a password
+            db = SQLiteDatabaseManager(sqlite_path)
+            if db.error_code != Errors.EVERYTHING_IS_FINE:
+                display_credential_error()
                 return
         else:
-            password = credential
-            password_is_correct = True
+            host, port, user, password, database = get_db_credentials()
 
-        db = DatabaseManager(host=host, port=port, user=user, passwd=password, database=database)
-        try:
-            db.ensure_connection()
-        except Exception:
-            if password is None:
-                password_is_correct = False
-                display_password_ask()
-                return
-            if credential is not None:
-                password_is_correct = False
-                display_password_ask()
+            if host is None or port is None or user is None or database is None:
+                display_credential_error()
                 return
+
+            if credential is None:
+                if password is None:
+                    display_password_ask()
+                    return
             else:
-                display_auth_error()
-                return
-        result_list = db.fetch_all_files()
+                password = credential
+                password_is_correct = True
+
+            db = DatabaseManager(host=host, port=port, user=user, passwd=password, database=database)
+            try:
+                db.ensure_connection()
+            except Exception:
+                if password is None:
+                    password_is_correct = False
+                    display_password_ask()
+                    return
+                if credential is not None:
+                    password_is_correct = False
+                    display_password_ask()
+                    return
+                else:
+                    display_auth_error()
+                    return
+        sort_key = "id"
+        search_filter = None
+        page_keys = [None]  # keyset of the first entry of every visited page
+        next_key = None
 
         paging_tv = ft.Text()
 
+        search_task = None  # pending search-as-you-type, cancelled by newer input
+
+        def superseded(task):
+            # A search that a newer keystroke replaced while its query ran must not show its results
+            return task is not None and task is not search_task
+
+        async def load_page():
+            nonlocal next_key
+            search = asyncio.current_task() if asyncio.current_task() is search_task else None
+            # The page is shown as soon as it is ready, the count follows
+            entries, key = await db.run_cancellable(
+                db.fetch_page, page_keys[current_page], files_per_page, sort_key, search_filter
+            )
+            if superseded(search):
+                return
+            next_key = key
+            await refresh_list_view(list_view, entries, page, db, paging_tv, None, reload_first_page)
+            total = await db.run_cancellable(db.approximate_count, search_filter)
+            if superseded(search):
+                return
+            paging_tv.value = paging_text(len(entries), total)
+            page.update()
+
+        async def reload_first_page():
+            nonlocal page_keys
+            page_keys = [None]
+            setPageZero()
+            await load_page()
+            list_view.scroll_to(0)
+
         async def go_left(e):
             global current_page
             if current_page > 0:
                 current_page -= 1
-                await refresh_list_view(list_view, result_list, page, db, paging_tv)
+                await load_page()
 
         async def go_right(e):
             global current_page
-            if (current_page + 1) * files_per_page < len(result_list):
+            nonlocal page_keys
+            if next_key is not None:
+                page_keys = page_keys[:current_page + 1] + [next_key]
                 current_page += 1
-                await refresh_list_view(list_view, result_list, page, db, paging_tv)
+                await load_page()
 
         left_button = ft.ElevatedButton("⬅️", on_click=go_left)
         right_button = ft.ElevatedButton("➡️", on_click=go_right)
@@ -102,51 +134,82 @@ async def main(page: ft.Page):
 
         search_field = ft.TextField(hint_text="Search...", expand=3, border_width=3)
 
+        def cancel_search():
+            nonlocal search_task
+            # The running search keeps its place, so that the next keystroke can still cancel it
+            if search_task is not None and search_task is not asyncio.current_task():
+                search_task.cancel()
+                search_task = None
+
         async def update_list_search(e):
+            cancel_search()
             title_tv.value = "Title"
             size_tv.value = "Size"
-            nonlocal result_list
-            result_list = db.search_with_keywords(search_field.value)
-            setPageZero()
-            await refresh_list_view(list_view, result_list, page, db, paging_tv)
+            nonlocal sort_key, search_filter
+            sort_key = "-relevance"
+            search_filter = search_field.value
+            await reload_first_page()
             page.update()
-            list_view.scroll_to(0)
+
+        async def debounced_search():
+            await asyncio.sleep(SEARCH_DEBOUNCE)
+            await update_list_search(None)
+
+        async def search_on_change(e):
+            nonlocal search_task
+            # A newer keystroke abandons the pending search and interrupts its query if it is already running
+            cancel_search()
+            search_task = asyncio.create_task(debounced_search())
 
         search_field.on_submit = update_list_search
+        search_field.on_change = search_on_change
         reset_filter = ft.IconButton(icon=ft.Icons.CANCEL, icon_color="red", icon_size=30, expand=1)
         search_btn = ft.IconButton(icon=ft.Icons.SEARCH, icon_color=ft.Colors.GREY_50, icon_size=30, expand=1)
         search_btn.on_click = update_list_search
+
+        watcher = None
+
+        async def live_sync_on_change(e):
+            nonlocal watcher
+            if live_sync_switch.value:
+                roots = await asyncio.to_thread(db.root_directories)
+                # Changes are applied on the watcher thread, the current page is reloaded on the page's loop
+                watcher = CatalogWatcher(db, roots, on_change=lambda counts: page.run_task(load_page))
+                await asyncio.to_thread(watcher.start)
+            elif watcher is not None:
+                await asyncio.to_thread(watcher.stop)
+                watcher = None
+
+        live_sync_switch = ft.Switch(label="Live sync", value=False, on_change=live_sync_on_change)
+
+        async def storage_on_click(e):
+            await open_storage_dialog(page, db)
+
+        storage_btn = ft.IconButton(icon=ft.Icons.PIE_CHART, icon_color=ft.Colors.GREY_50, icon_size=30, expand=1,
+                                    tooltip="Storage by extension and size", on_click=storage_on_click)
         search_container = ft.Container(
             content=ft.Row(
                 controls=[
                     reset_filter,
                     search_field,
                     search_btn,
+                    storage_btn,
+                    live_sync_switch,
                 ]
             )
         )
 
-        list_view = ft.ListView(expand=True)
+        list_view = ft.ListView(expand=True, item_extent=70)  # fixed row extent lets flet lay out only visible rows
 
         title_tv = ft.Text(value="Title", style=header_text_style)
         containing_folder_tv = ft.Text(value="Located in", style=header_text_style)
         size_tv = ft.Text(value="Size", style=header_text_style)
 
         async def sort(by: str, isAscending: bool):
-            nonlocal result_list
-            if isAscending:
-                if by == "S":
-                    result_list.sort(key=lambda x: x.size if x.size is not None else 0)
-                elif by == "T":
-                    result_list.sort(key=lambda x: x.name if x.name is not None else "")
-            else:
-                if by == "S":
-                    result_list.sort(key=lambda x: x.size if x.size is not None else 0, reverse=True)
-                elif by == "T":
-                    result_list.sort(key=lambda x: x.name if x.name is not None else "", reverse=True)
-            setPageZero()
-            await refresh_list_view(list_view, result_list, page, db, paging_tv)
-            list_view.scroll_to(0)
+            nonlocal sort_key
+            column = "total_size" if by == "S" else "name"  # directories sort by the size of their contents
+            sort_key = column if isAscending else f"-{column}"
+            await reload_first_page()
 
         async def update_filters(w):
             if w == "S":
@@ -167,15 +230,14 @@ async def main(page: ft.Page):
                     title_tv.value = "Title ⬆️"
                     await sort(w, False)
             elif w == "reset":
-                nonlocal result_list
+                nonlocal sort_key, search_filter
+                cancel_search()
                 size_tv.value = "Size"
                 title_tv.value = "Title"
                 search_field.value = ""
-                db.ensure_connection()
-                result_list = db.fetch_all_files()
-                setPageZero()
-                await refresh_list_view(list_view, result_list, page, db, paging_tv)
-                list_view.scroll_to(0)
+                sort_key = "id"
+                search_filter = None
+                await reload_first_page()
 
             page.update()
 
@@ -208,7 +270,7 @@ async def main(page: ft.Page):
         )
 
         setPageZero()
-        await refresh_list_view(list_view, result_list, page, db, paging_tv)
+        await load_page()
 
         page.update()
 
@@ -262,16 +324,31 @@ async def main(page: ft.Page):
 
                 )
 
+            job = await asyncio.to_thread(db.open_import_job, value)
+            if job is not None:
+                # A new root, or one whose import stopped, is imported as a job that can be cancelled and resumed
+                delete_dialog.content.content.controls[2] = ft.TextButton("Cancel import",
+                                                                          on_click=lambda e: job.cancel())
             delete_dialog.update()
             page.update()
-            await db.insert_directory_to_db(value)
-            db.ensure_connection()
+            if job is None:
+                await db.rescan_directory(value)
+            else:
+                await db.run_import_job(job)
+                if job.status == JobStatus.CANCELLED:
+                    print(f"⚠️ Import of {value} cancelled after {job.rows} entries, submit it again to resume")
+            if watcher is not None and value in await asyncio.to_thread(db.root_directories):
+                await asyncio.to_thread(watcher.add_root, value)
             page.close(delete_dialog)
             page.update()
 
         delete_dialog.content.content.controls[1].on_submit = directory_on_submit
 
-        def open_dialog(e):
+        async def open_dialog(e):
+            unfinished = await asyncio.to_thread(db.import_jobs)
+            if unfinished:
+                # Offers the latest import that was cancelled or cut short by a crash, submitting it resumes it
+                directory_tf.value = unfinished[0].root_path
             page.add(delete_dialog)
             delete_dialog.open = True
             page.update()
@@ -377,15 +454,68 @@ async def main(page: ft.Page):
     await refresh()
 
 
-async def refresh_list_view(list_view: ft.ListView, list_file_entry: list, page: ft.Page, db, paging: ft.Text,
-                      page_number=None):
-    list_view.controls.clear()
-    global current_page
-    global files_per_page
+class EntryRow:
+    """ A list row that is rebound to another entry on every page instead of being rebuilt """
+
+    def __init__(self):
+        self.entry = None
+        self.key = None
+        self.on_open = None
+        self.icon = ft.Icon(ft.Icons.INSERT_DRIVE_FILE, size=20)
+        self.name_tv = ft.Text(expand=1, max_lines=2, size=14)
+        self.parent_tv = ft.Text(expand=30, size=14, max_lines=2)
+        self.size_tv = ft.Text(expand=10)
+        self.container = ft.Container(
+            content=ft.Row(
+                controls=[
+                    ft.Container(content=ft.Row(controls=[self.icon, self.name_tv]), expand=15),
+                    self.parent_tv,
+                    self.size_tv,
+                ]
+            ),
+            bgcolor="#000010",
+            height=60,
+            margin=5,
+            padding=ft.Padding(left=15, right=15, bottom=10, top=10),
+            border_radius=12,
+            on_click=lambda e: self.on_open(self.entry),
+        )
+
+    def bind(self, entry: FileEntry):
+        """ Shows entry in this row, returns False when the row already showed the same values """
+        self.entry = entry
+        self.container.visible = True
+        key = (entry.id, entry.name, entry.type, entry.parent_path, entry.size, entry.total_size, entry.file_count)
+        if key == self.key:
+            return False
+        self.key = key
+        if entry.type == FileType.DIRECTORY:
+            self.icon.name, self.icon.color = ft.Icons.FOLDER, "#4060F0"
+        else:
+            self.icon.name, self.icon.color = ft.Icons.INSERT_DRIVE_FILE, "#BFAFA0"
+        self.name_tv.value = entry.name
+        self.parent_tv.value = entry.parent_path if entry.parent_path else "Root Directory"
+        if entry.type == FileType.DIRECTORY:
+            self.size_tv.value = (f"{FileEntry.format_bytes(entry.total_size)} in {entry.file_count} files"
+                                  if entry.total_size is not None else "Folder")
+        else:
+            self.size_tv.value = f"{FileEntry.format_bytes(entry.size)}" if entry.size else "Folder"
+        return True
+
+    def hide(self):
+        self.entry = None
+        self.key = None
+        self.container.visible = False
 
-    start_index = current_page * files_per_page
 
-    displayed_entries = 0
+async def refresh_list_view(list_view: ft.ListView, page_entries: list, page: ft.Page, db, paging: ft.Text,
+                            total: tuple, reload):
+    """ Renders one page of entries, total is the (count, capped) pair of DatabaseManager.approximate_count or None
+    and reload re-runs the current query after an entry was renamed or deleted """
+    global current_page
+    global files_per_page
+    global last_render_ms
+    started = time.perf_counter()
 
     def open_containing_folder(e, file_path):
         if not os.path.exists(file_path):
@@ -409,7 +539,6 @@ async def refresh_list_view(list_view: ft.ListView, list_file_entry: list, page:
             print(f"⚠️ Error opening folder: {e}")
 
     async def delete_file(e, file_id, dialog,page):
-        db.ensure_connection()
         anim_loading = encode_animation("anim/anim_loading.json")
         dialog.content.content.controls[7]=fl.Lottie(
                 src_base64=anim_loading,
@@ -429,17 +558,10 @@ async def refresh_list_view(list_view: ft.ListView, list_file_entry: list, page:
         page.update()
 
     async def refresh_list():
-        db.ensure_connection()
-        new_list = db.fetch_all_files()
-        setPageZero()
-        await refresh_list_view(list_view, new_list, page, db, paging)
-        list_view.scroll_to(0)
-
-    for entry in list_file_entry[start_index:]:
-        if displayed_entries >= files_per_page:
-            break
-        displayed_entries += 1
+        await reload()
 
+    def open_entry_dialog(entry: FileEntry):
+        """ The entry info dialog is only built for the row that was clicked """
         title_text_field = ft.TextField(value=entry.name, border_color="yellow")
 
         def updateFN(e, entry_id, text_field):
@@ -480,69 +602,144 @@ async def refresh_list_view(list_view: ft.ListView, list_file_entry: list, page:
 
         dialog_show_parameters.content.content.controls.append(delete_button)
 
-        def open_dialog(e, d=dialog_show_parameters):
-            d.open = True
-            page.add(d)
-            page.update()
-        # icon =
-        # if entry.type == FileType.FILE else ft.Icons.FOLDER
-        # partial(ft.Text,)
+        dialog_show_parameters.open = True
+        page.add(dialog_show_parameters)
+        page.update()
 
-        def getEntryIcon(type) -> ft.Icon:
-            if type=='file':
-                return ft.Icon(ft.Icons.INSERT_DRIVE_FILE , color="#BFAFA0",size=20)
-            elif type=='directory':
-                return ft.Icon(ft.Icons.FOLDER , color="#4060F0",size=20)
+    # Row controls are kept on the list view and reused, the last control is the end of list marker
+    rows = list_view.data if list_view.data is not None else []
+    while len(rows) < len(page_entries):
+        rows.append(EntryRow())
+    list_view.data = rows
+
+    changed_rows = 0
+    for row, entry in zip(rows, page_entries):
+        row.on_open = open_entry_dialog
+        changed_rows += row.bind(entry)
+    for row in rows[len(page_entries):]:
+        row.hide()
+
+    if len(list_view.controls) != len(rows) + 1:
+        list_view.controls = [row.container for row in rows] + [
+            ft.Container(
+                content=ft.Text(value="You reached the end", expand=1),
+                bgcolor="black",
+                padding=10,
+                margin=10,
+                border_radius=8,
+            )
+        ]
 
-        item = ft.Container(
-            content=ft.Row(
-                controls=[
-                    ft.Container(
-                        content=ft.Row(
-                            controls=[
-                                getEntryIcon(entry.type.value),
-                                ft.Text(value=entry.name, expand=1,max_lines=2,size=14),
-                            ]
-                        ),
-                        expand=15,
-                    ),
-                    ft.Text(value=entry.parent_path if entry.parent_path else "Root Directory", expand=30,size=14,max_lines=2),
-                    ft.Text(value=f"{FileEntry.format_bytes(entry.size)}" if entry.size else "Folder", expand=10),
-                ]
-            ),
-            bgcolor="#000010",
-            height=60,
-            margin=5,
-            padding=ft.Padding(left=15, right=15, bottom=10, top=10),
-            border_radius=12,
-            on_click=partial(open_dialog, d=dialog_show_parameters)
+    page.update()
+    last_render_ms = (time.perf_counter() - started) * 1000
+    render_times_ms.append((last_render_ms, changed_rows))
+    if metrics.enabled:
+        metrics.observe("ui_refresh_list_view_seconds", last_render_ms / 1000)
+        metrics.count("ui_rows_rebound_total", value=changed_rows)
+    # Set once the render is timed, so the status line reports this page and not the one before it
+    paging.value = paging_text(len(page_entries), total)
+    paging.update()
+
+
+async def open_storage_dialog(page: ft.Page, db):
+    """ Dashboard of where the bytes are, per root or for the whole catalog.
+    Everything comes from the summaries kept at import, so it opens instantly on any catalog size """
+    roots = await asyncio.to_thread(db.root_stats)
+    root_picker = ft.Dropdown(
+        label="Root", value="all", width=500,
+        options=[ft.dropdown.Option("all", "Whole catalog")] + [
+            ft.dropdown.Option(str(root_id), f"{path} ({FileEntry.format_bytes(total_size or 0)})")
+            for root_id, path, total_size, _ in roots
+        ],
+    )
+    extensions_column = ft.Column(tight=True)
+    sizes_column = ft.Column(tight=True)
+    largest_column = ft.Column(tight=True)
+
+    def share_row(label: str, files: int, size: int, total: int):
+        return ft.Row(controls=[
+            ft.Text(value=label, width=140),
+            ft.ProgressBar(value=size / total if total else 0, width=200, color=ft.Colors.TEAL),
+            ft.Text(value=f"{FileEntry.format_bytes(size)} in {files} files", size=12),
+        ])
+
+    async def load_stats():
+        root_id = None if root_picker.value == "all" else int(root_picker.value)
+        extensions, histogram, largest = await asyncio.gather(
+            asyncio.to_thread(db.extension_stats, root_id, 10),
+            asyncio.to_thread(db.size_histogram, root_id),
+            asyncio.to_thread(db.largest_files, root_id, 10),
         )
+        total = sum(size for _, _, size in histogram)
+        extensions_column.controls = [share_row(f".{extension}" if extension else "(none)", files, size, total)
+                                      for extension, files, size in extensions]
+        bounds = [bound for bound, _, _ in histogram[1:]] + [None]
+        sizes_column.controls = [
+            share_row("empty" if not bound else f"< {FileEntry.format_bytes(upper)}" if upper
+                      else f">= {FileEntry.format_bytes(bound)}", files, size, total)
+            for (bound, files, size), upper in zip(histogram, bounds)
+        ]
+        largest_column.controls = [ft.Text(value=f"{FileEntry.format_bytes(entry.size)}  {entry.abs_path}", size=12)
+                                   for entry in largest]
+        page.update()
 
-        list_view.controls.append(item)
+    async def on_root_change(e):
+        await load_stats()
 
-    list_view.controls.append(
-        ft.Container(
-            content=ft.Text(value="You reached the end", expand=1),
-            bgcolor="black",
-            padding=10,
-            margin=10,
-            border_radius=8,
-        )
-    )
-
-    remainder = 0
-    if len(list_file_entry) % 500 > 0:
-        remainder = 1
+    root_picker.on_change = on_root_change
 
-    paging.value = f"{displayed_entries} out of {len(list_file_entry)} entries | Page {current_page + 1} / {len(list_file_entry) // 500 + remainder}"
+    def on_close(e):
+        page.close(storage_dialog)
+        page.update()
 
+    section_style = ft.TextStyle(weight=ft.FontWeight.BOLD)
+    storage_dialog = ft.AlertDialog(
+        content=ft.Container(
+            border_radius=12,
+            bgcolor="#101020",
+            padding=20,
+            width=700,
+            content=ft.Column(
+                scroll=ft.ScrollMode.AUTO,
+                controls=[
+                    root_picker,
+                    ft.Text(value="By extension", style=section_style),
+                    extensions_column,
+                    ft.Text(value="By size", style=section_style),
+                    sizes_column,
+                    ft.Text(value="Largest files", style=section_style),
+                    largest_column,
+                    ft.IconButton(icon=ft.Icons.CLOSE_ROUNDED, icon_size=15, on_click=on_close),
+                ]
+            )
+        ),
+        content_padding=0, actions_padding=0, bgcolor="transparent"
+    )
+    await load_stats()
+    storage_dialog.open = True
+    page.add(storage_dialog)
     page.update()
 
 
+def paging_text(page_length: int, total):
+    """ total is the (count, capped) pair of DatabaseManager.approximate_count, None while it is being counted """
+    if total is None:
+        return f"{page_length} entries | Page {current_page + 1} | counting... | {last_render_ms:.0f} ms"
+    count, capped = total
+    more = "+" if capped else ""
+    pages = max(1, -(-count // files_per_page))
+    return (f"{page_length} out of {count}{more} entries | Page {current_page + 1} / {pages}{more}"
+            f" | {last_render_ms:.0f} ms")
+
+
 def header_text_view(text_view: ft.Text, icon, expand) -> ft.Container:
     return ft.Container(
         content=ft.Row(controls=[ft.Icon(icon), text_view]), expand=expand, on_click=text_view.on_tap
     )
 
 if __name__ == "__main__":
+    metrics_settings = get_metrics_settings()
+    if metrics_settings is not None:
+        # Before the catalog is opened, so that its connections record their statements
+        metrics.configure(metrics_settings)
     ft.app(target=main)
@@ -0,0 +1,301 @@
+import inspect
+import json
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import lru_cache, wraps
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float):
+        """ Upper bound of the bucket holding the q quantile, None when nothing was observed """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """ Process wide counters, latency histograms and slow statement log.
+    Everything is a no-op while disabled: instrumented code checks enabled before it reads the clock """
+    SLOW_LOG_SIZE = 200
+    STATEMENT_LENGTH = 1000  # characters of a statement kept in the slow log
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_threshold = None  # seconds, None keeps no slow log
+        self.slow_log = deque(maxlen=self.SLOW_LOG_SIZE)
+        self.slow_log_path = None
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._server = None
+        self._exporter = None
+        self._stop_export = threading.Event()
+
+    def enable(self, slow_threshold: float = None, slow_log_path: str = None):
+        self.slow_threshold = slow_threshold
+        self.slow_log_path = slow_log_path
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def configure(self, settings: dict):
+        """ Applies the "metrics" object of configuration.json, see get_metrics_settings """
+        slow_ms = settings.get("slow_query_ms")
+        self.enable(slow_ms / 1000 if slow_ms is not None else None, settings.get("slow_query_log"))
+        if settings.get("port"):
+            self.serve(settings["port"], settings.get("host", "127.0.0.1"))
+        if settings.get("export_path"):
+            self.export_every(settings["export_path"], settings.get("export_interval", 60.0))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.slow_log.clear()
+
+    def count(self, name: str, labels: tuple = (), value: int = 1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: tuple = ()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def statement(self, query: str, seconds: float, params=None, rows: int = None):
+        """ Records one SQL statement, and logs it when it took slow_threshold or longer """
+        self.observe("sql_statement_seconds", seconds, (("statement", statement_label(query)),))
+        if self.slow_threshold is None or seconds < self.slow_threshold:
+            return
+        self.count("sql_slow_statements_total")
+        record = {"time": time.time(), "seconds": round(seconds, 6),
+                  "statement": " ".join(query.split())[:self.STATEMENT_LENGTH],
+                  "params": repr(params)[:self.STATEMENT_LENGTH] if params is not None else None, "rows": rows}
+        self.slow_log.append(record)
+        if self.slow_log_path:
+            try:
+                with open(self.slow_log_path, "a") as log:
+                    log.write(json.dumps(record) + "\n")
+            except OSError as e:
+                print(f"⚠️ Could not write the slow query log {self.slow_log_path}: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "count": histogram.count, "sum": histogram.sum,
+                           "p50": histogram.quantile(0.5), "p99": histogram.quantile(0.99),
+                           "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], histogram.counts))}
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+            return {"time": time.time(), "counters": counters, "histograms": histograms,
+                    "slow_statements": list(self.slow_log)}
+
+    def prometheus_text(self):
+        """ Prometheus text exposition format, version 0.0.4 """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.count, h.sum)) for key, h in self._histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (counts, count, total) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket in zip([repr(bound) for bound in BUCKETS] + ["+Inf"], counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """ Writes a JSON snapshot when path ends in .json, the Prometheus text format otherwise """
+        content = json.dumps(self.snapshot(), indent=2) if path.endswith(".json") else self.prometheus_text()
+        with open(path, "w") as out:
+            out.write(content)
+
+    def export_every(self, path: str, interval: float):
+        """ Rewrites path every interval seconds from a daemon thread """
+        def export():
+            while not self._stop_export.wait(interval):
+                try:
+                    self.write(path)
+                except OSError as e:
+                    print(f"⚠️ Could not export metrics to {path}: {e}")
+
+        self._exporter = threading.Thread(target=export, name="metrics-export", daemon=True)
+        self._exporter.start()
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """ Serves GET /metrics in the Prometheus text format from a daemon thread """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # only paid for when serving
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return self._server
+
+    def close(self):
+        self._stop_export.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics = Metrics()
+
+
+def _labels(labels: tuple):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@lru_cache(maxsize=1024)
+def statement_label(query: str):
+    """ Statement text as a histogram label: whitespace collapsed, placeholder lists of any length folded """
+    label = " ".join(query.split())
+    label = re.sub(r"%s(?:, %s)+", "%s, ...", label)
+    label = re.sub(r"(WHEN %s THEN %s ?)+", "WHEN %s THEN %s ... ", label)
+    return label[:160]
+
+
+def timed(name: str, function):
+    """ Wraps function, or a coroutine function, to record its latency and failures under method=name """
+    labels = (("method", name),)
+
+    if inspect.iscoroutinefunction(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return await function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                metrics.count("catalog_method_errors_total", labels)
+                raise
+            finally:
+                metrics.observe("catalog_method_seconds", time.perf_counter() - started, labels)
+        return wrapper
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            metrics.count("catalog_method_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("catalog_method_seconds", time.perf_counter() - started, labels)
+    return wrapper
+
+
+def instrument_methods(cls):
+    """ Class decorator timing the public methods a class defines itself.
+    Generators, static and class methods are left alone """
+    for name, value in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(value) or inspect.isgeneratorfunction(value):
+            continue
+        if getattr(value, "__isabstractmethod__", False):
+            continue
+        setattr(cls, name, timed(f"{cls.__name__}.{name}", value))
+    return cls
+
+
+class InstrumentedConnection:
+    """ DB-API connection whose cursors record every statement """
+
+    def __init__(self, connection):
+        self.raw_connection = connection
+
+    def cursor(self, *args):
+        return InstrumentedCursor(self.raw_connection.cursor(*args), self)
+
+    def __getattr__(self, name):
+        return getattr(self.raw_connection, name)
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, connection: InstrumentedConnection):
+        self.raw_cursor = cursor
+        self.connection = connection
+
+    def execute(self, query: str, params=None):
+        if not metrics.enabled:
+            return self.raw_cursor.execute(query, params)
+        started = time.perf_counter()
+        try:
+            return self.raw_cursor.execute(query, params)
+        finally:
+            metrics.statement(query, time.perf_counter() - started, params)
+
+    def executemany(self, query: str, rows):
+        if not metrics.enabled:
+            return self.raw_cursor.executemany(query, rows)
+        rows = rows if isinstance(rows, list) else list(rows)
+        started = time.perf_counter()
+        try:
+            return self.raw_cursor.executemany(query, rows)
+        finally:
+            metrics.statement(query, time.perf_counter() - started, rows=len(rows))
+
+    def __getattr__(self, name):
+        return getattr(self.raw_cursor, name)
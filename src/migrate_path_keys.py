@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import pymysql
+
+from units import (CatalogStorage, DatabaseManager, Errors, SQLiteDatabaseManager, _SQLiteConnection, get_db_backend,
+                   get_db_credentials)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moves a catalog keyed by hex path hashes to binary path keys. "
+                                                 "Keys are filled in small committed chunks while the catalog stays "
+                                                 "in use, the app does the same on its first start otherwise")
+    parser.add_argument("--chunk", type=int, default=CatalogStorage.PATH_KEY_CHUNK, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="seconds to wait between chunks")
+    parser.add_argument("--backfill-only", action="store_true",
+                        help="only fill the keys, older versions of the app can keep running meanwhile")
+    parser.add_argument("--password", default=None)
+    args = parser.parse_args()
+
+    backend, sqlite_path = get_db_backend()
+    if backend == "sqlite":
+        storage, connection = SQLiteDatabaseManager, _SQLiteConnection(sqlite_path)
+    else:
+        host, port, user, password, database = get_db_credentials()
+        password = args.password or password
+        storage = DatabaseManager
+        connection = pymysql.connect(host=host, port=port, user=user, passwd=password, db=database)
+
+    started = time.perf_counter()
+
+    def report(filled: int, last_id: int, max_id: int):
+        seconds = time.perf_counter() - started
+        print(f"{filled} keys filled, up to id {last_id} of {max_id}, {filled / seconds if seconds else 0:.0f} rows/s")
+
+    cursor = connection.cursor()
+    try:
+        filled = storage.migrate_path_keys(cursor, args.chunk, args.pause, not args.backfill_only, report)
+    finally:
+        cursor.close()
+        connection.close()
+    if filled is None:
+        print("The catalog is keyed by path_key already")
+        return
+    if args.backfill_only:
+        print(f"{filled} keys filled, run again without --backfill-only once older versions are stopped")
+        return
+
+    # Opening the catalog recreates what the migration dropped with the old table or column
+    db = SQLiteDatabaseManager(sqlite_path) if backend == "sqlite" else DatabaseManager(
+        host=host, port=port, user=user, passwd=password, database=database)
+    if db.error_code != Errors.EVERYTHING_IS_FINE:
+        raise SystemExit(f"⚠️ Could not open the migrated catalog: {db.error_code.value}")
+    db.close()
+    print(f"Migrated {filled} rows in {time.perf_counter() - started:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
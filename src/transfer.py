@@ -0,0 +1,100 @@
+import csv
+import gzip
+import io
+import json
+
+try:
+    import zstandard
+except ImportError:  # optional, only .zst files need it
+    zstandard = None
+
+from units import CatalogStorage
+
+FIELDS = CatalogStorage.DUMP_FIELDS
+FORMATS = {".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv", ".tsv": "tsv", ".txt": "tsv"}
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+# Text read and written as UTF-8, paths that are not valid UTF-8 survive through surrogate escapes
+ENCODING = {"encoding": "utf-8", "errors": "surrogateescape", "newline": ""}
+
+
+def file_kind(path: str):
+    """ (format, compression) named by the extensions of path, None for those it does not name """
+    compression = None
+    for suffix, name in COMPRESSIONS.items():
+        if path.endswith(suffix):
+            compression, path = name, path[:-len(suffix)]
+    for suffix, name in FORMATS.items():
+        if path.endswith(suffix):
+            return name, compression
+    return None, compression
+
+
+def open_text(path: str, mode: str, compression: str = None):
+    """ Text file opened for "r" or "w", through gzip or zstd when compression is given """
+    if compression == "gzip":
+        # A low level keeps up with the catalog stream, a dump is made of highly repetitive paths anyway
+        return gzip.open(path, mode + "t", compresslevel=3, **ENCODING)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd files need the zstandard package: pip install zstandard")
+        raw = open(path, mode + "b")
+        if mode == "r":
+            binary = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            binary = zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(binary, **ENCODING)
+    return open(path, mode, **ENCODING)
+
+
+def write_dump(batches, output_format: str, out):
+    """ Writes lists of rows in the order of FIELDS as NDJSON or CSV with a header row, returns how many """
+    written = 0
+    if output_format == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(FIELDS)
+        for rows in batches:
+            writer.writerows(rows)
+            written += len(rows)
+    elif output_format == "ndjson":
+        for rows in batches:
+            out.write("".join(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n" for row in rows))
+            written += len(rows)
+    else:
+        raise ValueError(f"A catalog is dumped as ndjson or csv, not {output_format}")
+    return written
+
+
+def read_dump(lines, input_format: str):
+    """ Records in the order of FIELDS from NDJSON, CSV with a header row, or tab separated columns
+    path, type, size, mtime and inode, as written by find -L ROOT -printf '%p\\t%y\\t%s\\t%T@\\t%i\\n' """
+    if input_format == "ndjson":
+        for line in lines:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(field) for field in FIELDS)
+        return
+    if input_format == "csv":
+        rows = csv.reader(lines)
+        header = next(rows, None) or []
+        positions = [header.index(field) if field in header else None for field in FIELDS]
+        if positions[0] is None:
+            raise ValueError("The CSV header has no path column")
+        for row in rows:
+            if row:
+                yield _typed([row[i] if i is not None and i < len(row) else "" for i in positions])
+        return
+    if input_format == "tsv":
+        for line in lines:
+            line = line.rstrip("\n")
+            if line:
+                row = line.split("\t")
+                yield _typed((row + [""] * len(FIELDS))[:len(FIELDS)])
+        return
+    raise ValueError(f"A catalog is loaded from ndjson, csv or tsv, not {input_format}")
+
+
+def _typed(row: list):
+    """ Text columns of a CSV or TSV row as the values of a record, an empty column is NULL """
+    path, entry_type, size, mtime, inode, content_hash = row
+    return (path, entry_type, int(size) if size else None, float(mtime) if mtime else None,
+            int(inode) if inode else None, content_hash or None)
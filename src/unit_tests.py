@@ -1,6 +1,19 @@
+import asyncio
+import contextlib
 import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import cli
+import metrics
 import units
+import watcher
 
 
 class TestDataBase(unittest.TestCase):
@@ -8,6 +21,11 @@ class TestDataBase(unittest.TestCase):
     INCORRECT_PASSWORD = "<PASSWORD>"
     TEST_FILE_NAME = "test_file.txt"
     TEST_FILE_ABS_PATH = "/tmp/test_file.txt"
+    SLOW_QUERY = "SELECT SLEEP(10)"
+
+    def open_database(self):
+        return units.DatabaseManager(host='localhost', port=3306, user='root', passwd=self.CORRECT_PASSWORD,
+                                     database='test')
 
     def test_connection_incorrect_password(self):
         dbm = units.DatabaseManager(host='localhost', port=3306, user='root', passwd=self.INCORRECT_PASSWORD,
@@ -20,15 +38,13 @@ class TestDataBase(unittest.TestCase):
         self.assertEqual(dbm.error_code, units.Errors.EVERYTHING_IS_FINE)
 
     def test_path_hash_consistency(self):
-        dbm = units.DatabaseManager(host='localhost', port=3306, user='root', passwd=self.CORRECT_PASSWORD,
-                                    database='test')
+        dbm = self.open_database()
         path = self.TEST_FILE_ABS_PATH
         hash1 = dbm.hash_path(path)
         self.assertEqual(hash1, hashlib.sha256(path.encode()).hexdigest())
 
     def test_insert_and_fetch(self):
-        dbm = units.DatabaseManager(host='localhost', port=3306, user='root', passwd=self.CORRECT_PASSWORD,
-                                    database='test')
+        dbm = self.open_database()
 
         test_entry = units.FileEntry(
             name=self.TEST_FILE_NAME,
@@ -46,8 +62,7 @@ class TestDataBase(unittest.TestCase):
         self.assertTrue(result_check)
 
     def test_search_with_keyword(self):
-        dbm = units.DatabaseManager(host='localhost', port=3306, user='root', passwd=self.CORRECT_PASSWORD,
-                                    database='test')
+        dbm = self.open_database()
 
         keyword = 'test_file'
         results = dbm.search_with_keywords(keyword)
@@ -57,11 +72,587 @@ class TestDataBase(unittest.TestCase):
         check = any(keyword in file.name for file in results)
         self.assertTrue(check)
 
-        dbm.cursor.execute(
-            "DELETE FROM Files_And_Directories WHERE absolute_path_hash = %s",
-            [dbm.hash_path(self.TEST_FILE_ABS_PATH)]
-        )
-        dbm.connection.commit()
+        dbm.delete(units.FileEntry(id=dbm.find_id(self.TEST_FILE_ABS_PATH)))
+
+    def test_bulk_insert_directory(self):
+        dbm = self.open_database()
+
+        with tempfile.TemporaryDirectory() as tree:
+            os.makedirs(os.path.join(tree, "sub", "deeper"))
+            for name in ("a.txt", os.path.join("sub", "b.txt"), os.path.join("sub", "deeper", "c.txt")):
+                with open(os.path.join(tree, name), "w") as f:
+                    f.write("data")
+
+            stats = dbm._insert_directory_to_db(tree, batch_size=2)
+            self.assertEqual(stats["rows"], 5)
+
+            catalogued = {file.abs_path for file in dbm.fetch_all_files()}
+            self.assertIn(os.path.join(tree, "sub", "deeper", "c.txt"), catalogued)
+
+            self.assertEqual(dbm._delete_directory(dbm.find_id(tree))["rows"], 6)
+
+    def test_rescan_directory_applies_diffs(self):
+        dbm = self.open_database()
+
+        with tempfile.TemporaryDirectory() as tree:
+            os.makedirs(os.path.join(tree, "sub"))
+            for name in ("keep.txt", "gone.txt"):
+                with open(os.path.join(tree, "sub", name), "w") as f:
+                    f.write("data")
+            dbm._rescan_directory(tree)
+
+            os.remove(os.path.join(tree, "sub", "gone.txt"))
+            with open(os.path.join(tree, "sub", "new.txt"), "w") as f:
+                f.write("data")
+            stats = dbm._rescan_directory(tree)
+            self.assertEqual((stats["added"], stats["removed"]), (1, 1))
+
+            unchanged = dbm._rescan_directory(tree)
+            self.assertEqual(unchanged["scanned_dirs"], 0)
+
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_fetch_page_walks_every_entry_once(self):
+        dbm = self.open_database()
+
+        for sort in ("id", "-name", "size"):
+            paged_ids, key = [], None
+            while True:
+                entries, key = dbm.fetch_page(key, limit=3, sort=sort)
+                paged_ids += [entry.id for entry in entries]
+                if key is None:
+                    break
+            self.assertEqual(sorted(paged_ids), sorted(file.id for file in dbm.fetch_all_files()))
+
+    def test_fetch_page_sorted_by_size_descending(self):
+        dbm = self.open_database()
+
+        entries, _ = dbm.fetch_page(limit=50, sort="-size")
+        sizes = [entry.size for entry in entries if entry.size is not None]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+
+    def test_iter_files_streams_batches_up_to_limit(self):
+        dbm = self.open_database()
+
+        batches = list(dbm.iter_files(batch_size=2, limit=3))
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+        self.assertLessEqual(sum(len(batch) for batch in batches), 3)
+
+    def test_find_duplicates_hashes_only_size_collisions(self):
+        dbm = self.open_database()
+        dbm.HASH_SAMPLE_BYTES = 4  # small enough that the 20 byte files are sampled before the full hash
+        with tempfile.TemporaryDirectory() as tree:
+            contents = {"a.bin": "same content 0123456", "b.bin": "same content 0123456",
+                        "c.bin": "same head 0123456789", "d.bin": "unique size"}
+            for name, content in contents.items():
+                with open(os.path.join(tree, name), "w") as f:
+                    f.write(content)
+            dbm._insert_directory_to_db(tree, batch_size=10)
+
+            stats = dbm._find_duplicates(workers=2)
+            self.assertGreaterEqual(stats["reclaimable"], 20)
+            groups = [group for group in dbm.duplicate_groups()
+                      if any(entry.parent_path == tree for entry in group["entries"])]
+            self.assertEqual(len(groups), 1)
+            self.assertEqual(sorted(entry.name for entry in groups[0]["entries"]), ["a.bin", "b.bin"])
+            self.assertEqual(groups[0]["reclaimable"], 20)
+            with dbm._cursor() as cursor:
+                cursor.execute("SELECT content_hash FROM Files_And_Directories WHERE id = %s",
+                               (dbm.find_id(os.path.join(tree, "a.bin")),))
+                self.assertEqual(len(cursor.fetchone()[0]), 64)  # the width of the content_hash column
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_import_skips_a_root_catalogued_below_it(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            inner = os.path.join(tree, "inner")
+            os.makedirs(os.path.join(inner, "deeper"))
+            for name in ("a.txt", os.path.join("inner", "b.txt"), os.path.join("inner", "deeper", "c.txt")):
+                with open(os.path.join(tree, name), "w") as f:
+                    f.write("data")
+            self.assertEqual(dbm._insert_directory_to_db(inner, batch_size=2)["rows"], 3)
+
+            stats = dbm._insert_directory_to_db(tree, batch_size=2)
+            self.assertEqual(stats["rows"], 1)  # a.txt, everything below inner is catalogued already
+            self.assertEqual(stats["hash_index"]["entries"], 5)  # tree and the subtree of inner
+            dbm._delete_directory(dbm.find_id(inner))
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_directory_rollups_follow_imports_and_deletes(self):
+        dbm = self.open_database()
+
+        def rollup(path):
+            with dbm._cursor() as cursor:
+                cursor.execute("SELECT total_size, file_count FROM Files_And_Directories WHERE id = %s",
+                               (dbm.find_id(path),))
+                return tuple(cursor.fetchone())
+
+        with tempfile.TemporaryDirectory() as tree:
+            nested = os.path.join(tree, "nested")
+            os.makedirs(os.path.join(nested, "deeper"))
+            for directory, size in ((tree, 10), (nested, 20), (os.path.join(nested, "deeper"), 30)):
+                with open(os.path.join(directory, "data.bin"), "wb") as f:
+                    f.write(b"x" * size)
+            dbm._insert_directory_to_db(tree, batch_size=2)
+            self.assertEqual(rollup(tree), (60, 3))
+            self.assertEqual(rollup(nested), (50, 2))
+
+            with open(os.path.join(nested, "more.bin"), "wb") as f:
+                f.write(b"x" * 5)
+            os.makedirs(os.path.join(nested, "new", "inner"))
+            with open(os.path.join(nested, "new", "inner", "data.bin"), "wb") as f:
+                f.write(b"x" * 7)
+            dbm._rescan_directory(tree)
+            self.assertEqual(rollup(tree), (72, 5))
+            self.assertEqual(rollup(os.path.join(nested, "new")), (7, 1))
+            dbm._rescan_directory(tree, full=True)
+            self.assertEqual(rollup(tree), (72, 5))
+
+            dbm._delete_directory(dbm.find_id(os.path.join(nested, "deeper")))
+            self.assertEqual(rollup(nested), (32, 3))
+            self.assertEqual(rollup(tree), (42, 4))
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_root_summaries_follow_imports_renames_and_deletes(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            os.makedirs(os.path.join(tree, "photos"))
+            for name, size in (("notes.TXT", 10), ("todo.txt", 5000), ("README", 0), ("photos/a.jpg", 70000),
+                               ("photos/b.jpg", 3)):
+                with open(os.path.join(tree, name), "wb") as f:
+                    f.write(b"x" * size)
+            dbm._insert_directory_to_db(tree, batch_size=2)
+            root_id = dbm.find_id(tree)
+            self.assertIn((root_id, tree, 75013, 5), dbm.root_stats())
+            self.assertEqual(dbm.extension_stats(root_id), [("jpg", 2, 70003), ("txt", 2, 5010), ("", 1, 0)])
+            histogram = dbm.size_histogram(root_id)
+            self.assertEqual(histogram[0], (0, 1, 0))
+            self.assertEqual(histogram[dbm.size_bucket(5000)], (4096, 1, 5000))
+            self.assertEqual(sum(files for _, files, _ in histogram), 5)
+            self.assertEqual([entry.name for entry in dbm.largest_files(root_id, limit=2)], ["a.jpg", "todo.txt"])
+            self.assertEqual([entry.name for entry in dbm.largest_files(root_id, extension=".JPG")], ["a.jpg", "b.jpg"])
+
+            todo = dbm.largest_files(root_id, extension="txt")[0]
+            dbm.update(units.FileEntry(id=todo.id, name="todo.md"))
+            dbm._delete_directory(dbm.find_id(os.path.join(tree, "photos")))
+            self.assertEqual(dbm.extension_stats(root_id), [("md", 1, 5000), ("txt", 1, 10), ("", 1, 0)])
+            self.assertEqual(sum(files for _, files, _ in dbm.size_histogram(root_id)), 3)
+            dbm._delete_directory(root_id)
+            self.assertEqual(dbm.extension_stats(root_id), [])
+
+    def test_root_summaries_count_only_inserted_rows(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            inner = os.path.join(tree, "inner")
+            os.makedirs(inner)
+            for name in ("a.txt", os.path.join("inner", "b.txt"), os.path.join("inner", "c.txt")):
+                with open(os.path.join(tree, name), "wb") as f:
+                    f.write(b"x" * 10)
+            dbm._insert_directory_to_db(inner, batch_size=2)
+            dbm._insert_directory_to_db(tree, batch_size=2)
+            self.assertEqual(dbm.extension_stats(dbm.find_id(inner)), [("txt", 2, 20)])
+            self.assertEqual(dbm.extension_stats(dbm.find_id(tree)), [("txt", 1, 10)])
+
+            # Rows another writer catalogued after the duplicate check, which an empty index stands in for
+            with dbm._cursor() as cursor:
+                rows = [dbm._scan_row(entry, dbm.find_id(inner)) for entry in os.scandir(inner)]
+                empty = units.PathHashIndex(0, dbm.HASH_INDEX_MEMORY_CAP)
+                self.assertEqual(dbm._write_batch(cursor, rows, empty), (0, []))
+            self.assertEqual(dbm.extension_stats(dbm.find_id(inner)), [("txt", 2, 20)])
+            dbm._delete_directory(dbm.find_id(inner))
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_cancelled_import_job_resumes_from_its_frontier(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            for d in range(6):
+                os.makedirs(os.path.join(tree, f"dir_{d}", "sub"))
+                for f in range(3):
+                    open(os.path.join(tree, f"dir_{d}", f"file_{f}.txt"), "w").close()
+
+            listed = []
+            scan_directory = dbm._scan_directory
+
+            def scan_and_cancel(path):
+                listed.append(path)
+                if len(listed) == 4:
+                    job.cancel()
+                return scan_directory(path)
+
+            dbm._scan_directory = scan_and_cancel
+            try:
+                for scan_workers in (0, 2):
+                    job = dbm.create_import_job(tree)
+                    listed.clear()
+                    dbm._run_import_job(job, batch_size=2, scan_workers=scan_workers)
+                    self.assertEqual(job.status, units.JobStatus.CANCELLED)
+                    with dbm._cursor() as cursor:
+                        frontier = {path for path, _ in dbm._job_frontier(cursor, job)}
+                    finished = set(listed) - frontier
+                    self.assertTrue(finished)
+
+                    resumed = dbm.open_import_job(tree)
+                    self.assertEqual(resumed.id, job.id)
+                    listed.clear()
+                    dbm._run_import_job(resumed, batch_size=2, scan_workers=scan_workers)
+                    self.assertEqual(resumed.status, units.JobStatus.DONE)
+                    self.assertFalse(finished & set(listed))
+                    self.assertEqual(resumed.rows, 6 * 5)  # everything below the root, written once
+                    with dbm._cursor() as cursor:
+                        cursor.execute(f"{dbm.SUBTREE_QUERY} SELECT COUNT(*) FROM subtree", (dbm.find_id(tree),))
+                        self.assertEqual(cursor.fetchone()[0], 1 + 6 * 5)
+                    self.assertNotIn(job.id, [unfinished.id for unfinished in dbm.import_jobs()])
+                    dbm._delete_directory(dbm.find_id(tree))
+            finally:
+                del dbm._scan_directory
+
+    def test_import_job_of_a_deleted_root_starts_over(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            for d in range(4):
+                os.makedirs(os.path.join(tree, f"dir_{d}"))
+                for f in range(4):
+                    open(os.path.join(tree, f"dir_{d}", f"file_{f}.txt"), "w").close()
+
+            def count_subtree():
+                with dbm._cursor() as cursor:
+                    cursor.execute(f"{dbm.SUBTREE_QUERY} SELECT COUNT(*) FROM subtree", (dbm.find_id(tree),))
+                    return cursor.fetchone()[0]
+
+            job = dbm.create_import_job(tree)
+            job.cancel()
+            dbm._run_import_job(job, batch_size=2, scan_workers=0)
+            dbm._delete_directory(dbm.find_id(tree))
+            self.assertNotIn(job.id, [unfinished.id for unfinished in dbm.import_jobs()])
+
+            added = dbm.open_import_job(tree)
+            self.assertNotEqual(added.id, job.id)
+            dbm._run_import_job(added, batch_size=2, scan_workers=0)
+            self.assertEqual(count_subtree(), 1 + 4 * 5)
+
+            # A job loaded before its root was deleted is seeded again from the root it catalogs anew
+            stale = units.ImportJob(job.id, tree, root_id=job.root_id)
+            dbm._delete_directory(dbm.find_id(tree))
+            dbm._run_import_job(stale, batch_size=2, scan_workers=0)
+            self.assertEqual(stale.status, units.JobStatus.DONE)
+            self.assertEqual(count_subtree(), 1 + 4 * 5)
+            dbm._delete_directory(dbm.find_id(tree))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_watcher_applies_changes_in_batches(self):
+        dbm = self.open_database()
+        applied = threading.Event()
+        with tempfile.TemporaryDirectory() as tree:
+            dbm._insert_directory_to_db(tree, batch_size=10)
+            catalog_watcher = watcher.CatalogWatcher(dbm, [tree], on_change=lambda counts: applied.set(), window=0.2)
+            catalog_watcher.start()
+            try:
+                self.assertFalse(catalog_watcher.polling)
+                os.makedirs(os.path.join(tree, "new", "inner"))
+                with open(os.path.join(tree, "new", "inner", "file.txt"), "w") as f:
+                    f.write("content")
+                new_file = os.path.join(tree, "new", "inner", "file.txt")
+                deadline = time.monotonic() + 10
+                while dbm.find_id(new_file) is None and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                self.assertIsNotNone(dbm.find_id(new_file))
+                self.assertTrue(applied.wait(10))  # called once the batch is committed, so it can lag the row
+            finally:
+                catalog_watcher.stop()
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_cancelled_query_is_interrupted(self):
+        dbm = self.open_database()
+
+        def slow_query():
+            with dbm._cursor() as cursor:
+                cursor.execute(self.SLOW_QUERY)
+                return cursor.fetchone()[0]
+
+        async def cancel_after_start():
+            task = asyncio.create_task(dbm.run_cancellable(slow_query))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        started = time.perf_counter()
+        asyncio.run(cancel_after_start())  # waits for the worker thread, which returns once its query is killed
+        self.assertLess(time.perf_counter() - started, 5)
+
+
+class TestSQLiteDataBase(TestDataBase):
+    """ The same catalog tests on an SQLite file, they need no server """
+    SLOW_QUERY = """WITH RECURSIVE counter (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < 1000000000)
+                    SELECT MAX(n) FROM counter"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, "catalog.sqlite3")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def open_database(self):
+        return units.SQLiteDatabaseManager(self.path)
+
+    def test_connection_incorrect_password(self):
+        self.skipTest("an SQLite catalog has no password")
+
+    def test_connection_correct_password(self):
+        self.assertEqual(self.open_database().error_code, units.Errors.EVERYTHING_IS_FINE)
+
+    def test_search_short_keywords(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            open(os.path.join(tree, "ab.txt"), "w").close()
+            open(os.path.join(tree, "notes.md"), "w").close()
+            dbm._insert_directory_to_db(tree, batch_size=10)
+
+            names = [entry.name for entry in dbm.search_with_keywords("ab")]
+            self.assertIn("ab.txt", names)
+            self.assertNotIn("notes.md", names)
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_bulk_load_links_and_rolls_up_under_catalogued_directories(self):
+        dbm = self.open_database()
+        with tempfile.TemporaryDirectory() as tree:
+            dbm._insert_directory_to_db(tree, batch_size=10)
+            # Unordered, and the new subtree hangs below a directory that is catalogued already
+            records = [(os.path.join(tree, "loaded", "b.txt"), "f", 5, 1.0, 11, None),
+                       (os.path.join(tree, "loaded") + os.sep, "d", 4096, 1.0, 10, None),
+                       (os.path.join(tree, "top.txt"), "file", 7, 1.0, 12, None),
+                       (tree, "directory", None, 1.0, 9, None)]
+            stats = dbm.bulk_load(records, batch_size=2)
+
+            self.assertEqual((stats["rows"], stats["staged"]), (3, 4))
+            loaded_id = dbm.find_id(os.path.join(tree, "loaded"))
+            self.assertIsNotNone(loaded_id)
+            with dbm._cursor() as cursor:
+                cursor.execute("SELECT parent_id, size, total_size, file_count FROM Files_And_Directories WHERE id = %s",
+                               (loaded_id,))
+                self.assertEqual(cursor.fetchone(), (dbm.find_id(tree), None, 5, 1))
+                cursor.execute("SELECT total_size, file_count FROM Files_And_Directories WHERE id = %s",
+                               (dbm.find_id(tree),))
+                self.assertEqual(cursor.fetchone(), (12, 2))
+                cursor.execute("SELECT COUNT(*) FROM Load_Staging")
+                self.assertEqual(cursor.fetchone()[0], 0)
+            dbm._delete_directory(dbm.find_id(tree))
+
+    def test_legacy_catalog_moves_to_path_keys(self):
+        path = os.path.join(self.directory.name, "legacy.sqlite3")
+        legacy = units._SQLiteConnection(path)
+        cursor = legacy.cursor()
+        cursor.execute(units.SQLiteDatabaseManager.SCHEMA[0].replace("path_key BLOB", "absolute_path_hash TEXT"))
+        for statement in units.SQLiteDatabaseManager.SCHEMA[1:]:
+            cursor.execute(statement)
+        rows = [("legacy", "directory", None, "/legacy"), ("keyed_file.txt", "file", 1, "/legacy/keyed_file.txt")]
+        for name, entry_type, parent_id, abs_path in rows:
+            cursor.execute("""INSERT INTO Files_And_Directories (name, type, parent_id, absolute_path, absolute_path_hash)
+                              VALUES (%s, %s, %s, %s, %s)""",
+                           (name, entry_type, parent_id, abs_path, hashlib.sha256(abs_path.encode()).hexdigest()))
+        legacy.commit()
+        legacy.close()
+
+        dbm = units.SQLiteDatabaseManager(path)
+        self.assertEqual(dbm.error_code, units.Errors.EVERYTHING_IS_FINE)
+        with dbm._cursor() as cursor:
+            self.assertNotIn("absolute_path_hash", dbm._table_columns(cursor))
+        self.assertEqual(dbm.find_id("/legacy/keyed_file.txt"), 2)
+        self.assertEqual([entry.id for entry in dbm.search_with_keywords("keyed_file")], [2])
+        dbm.close()
+
+
+class TestFileEntryColumns(unittest.TestCase):
+    def test_entries_are_rebuilt_from_columns(self):
+        path_hash = hashlib.sha256(b"/tmp/a.txt").hexdigest()
+        columns = units.FileEntryColumns([
+            (1, "tmp", "directory", "/tmp", None, None, None, None),
+            (2, "a.txt", "file", "/tmp/a.txt", 1, 0, "/tmp", path_hash),
+        ])
+
+        self.assertEqual(len(columns), 2)
+        self.assertEqual(columns[-1].abs_path_hash, path_hash)
+        self.assertEqual(columns[1].size, 0)
+        self.assertIsNone(columns[0].parent_id)
+        self.assertEqual([entry.type for entry in columns[0:2]], [units.FileType.DIRECTORY, units.FileType.FILE])
+
+
+class TestMetrics(unittest.TestCase):
+    def tearDown(self):
+        metrics.metrics.disable()
+        metrics.metrics.reset()
+
+    def open_database(self, directory: str):
+        return units.SQLiteDatabaseManager(os.path.join(directory, "catalog.sqlite3"))
+
+    def test_methods_statements_and_slow_log_are_recorded(self):
+        metrics.metrics.enable(slow_threshold=0.0)
+        with tempfile.TemporaryDirectory() as directory:
+            dbm = self.open_database(directory)
+            self.assertIsNone(dbm.find_id("/nowhere"))
+            dbm.close()
+
+        histograms = metrics.metrics.snapshot()["histograms"]
+        self.assertIn({"method": "CatalogStorage.find_id"},
+                      [histogram["labels"] for histogram in histograms if histogram["name"] == "catalog_method_seconds"])
+        self.assertIn("SELECT id FROM Files_And_Directories WHERE path_key = %s",
+                      [histogram["labels"].get("statement") for histogram in histograms])
+        self.assertTrue(metrics.metrics.slow_log)
+        self.assertIn('catalog_method_seconds_bucket{method="CatalogStorage.find_id",le="+Inf"} 1',
+                      metrics.metrics.prometheus_text())
+
+    def test_nothing_is_recorded_while_disabled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            dbm = self.open_database(directory)
+            dbm.find_id("/nowhere")
+            dbm.close()
+        snapshot = metrics.metrics.snapshot()
+        self.assertEqual((snapshot["counters"], snapshot["histograms"]), ([], []))
+
+
+class TestCommandLine(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.directory.name, "configuration.json")
+        with open(self.config, "w") as f:
+            json.dump({"backend": "sqlite", "sqlite_path": "catalog.sqlite3"}, f)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_cli(self, *argv):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+            code = cli.main(["--config", self.config, *argv])
+        return code, out.getvalue()
+
+    def test_scan_search_export_and_delete(self):
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            open(os.path.join(first, "report_cli.txt"), "w").close()
+            os.mkdir(os.path.join(second, "nested"))
+            open(os.path.join(second, "nested", "notes_cli.md"), "w").close()
+
+            code, out = self.run_cli("scan", first, second, "--json")
+            self.assertEqual(code, 0)
+            self.assertEqual(sorted(json.loads(line)["rows"] for line in out.splitlines()), [1, 2])
+            self.assertEqual(json.loads(self.run_cli("scan", first, "--json")[1])["mode"], "rescan")
+
+            self.assertEqual(self.run_cli("search", "notes_cli"),
+                             (0, os.path.join(second, "nested", "notes_cli.md") + "\n"))
+            self.assertEqual(self.run_cli("search", "missing_cli")[0], cli.EXIT_FAILED)
+
+            export = os.path.join(self.directory.name, "catalog.csv")
+            self.assertEqual(self.run_cli("export", "-o", export)[0], 0)
+            with open(export) as f:
+                self.assertEqual(len(f.readlines()), 6)  # header, two roots, nested and two files
+
+            self.assertEqual(self.run_cli("delete", second)[0], 0)
+            self.assertEqual(self.run_cli("search", "notes_cli")[0], cli.EXIT_FAILED)
+
+    def test_dump_loads_into_another_catalog(self):
+        with tempfile.TemporaryDirectory() as tree:
+            os.mkdir(os.path.join(tree, "nested"))
+            with open(os.path.join(tree, "nested", "dumped_cli.bin"), "wb") as f:
+                f.write(b"0" * 10)
+            self.run_cli("scan", tree)
+            dump = os.path.join(self.directory.name, "catalog.ndjson.gz")
+            self.assertEqual(self.run_cli("dump", "-o", dump)[0], 0)
+
+            with open(self.config, "w") as f:
+                json.dump({"backend": "sqlite", "sqlite_path": "loaded.sqlite3"}, f)
+            self.assertEqual(self.run_cli("load", dump)[0], 0)
+            dbm = units.open_catalog(filepath=self.config)
+            nested_id = dbm.find_id(os.path.join(tree, "nested"))
+            entries = {entry.name: entry for entry in dbm.iter_files("dumped_cli")}
+            root = dbm.fetch_page(limit=1)[0][0]
+            dbm.close()
+        self.assertEqual(entries["dumped_cli.bin"].parent_id, nested_id)
+        self.assertEqual((root.abs_path, root.total_size, root.file_count), (tree, 10, 1))
+
+
+class TestConnectionPool(unittest.TestCase):
+    class FakeConnection:
+        def __init__(self):
+            self.closed = False
+
+        def ping(self, reconnect=False):
+            if self.closed:
+                raise ConnectionError()
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
+    def test_connections_are_reused_and_evicted(self):
+        pool = units.ConnectionPool(self.FakeConnection, max_size=2, idle_timeout=60)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            self.assertIs(first, second)
+
+        pool.idle_timeout = -1
+        with pool.connection() as third:
+            self.assertIsNot(first, third)
+        self.assertTrue(first.closed)
+
+    def test_checkout_sees_rows_committed_on_another_connection(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def connect():
+                connection = sqlite3.connect(os.path.join(directory, "pool.sqlite3"), isolation_level=None)
+                connection.execute("PRAGMA journal_mode = WAL")
+                return connection
+
+            pool = units.ConnectionPool(connect, max_size=2)
+            with pool.connection() as reader:
+                reader.execute("CREATE TABLE t (x INTEGER)")
+                reader.execute("BEGIN")
+                self.assertEqual(reader.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+                with pool.connection() as writer:
+                    writer.execute("INSERT INTO t VALUES (1)")
+            with pool.connection() as reader_again:
+                self.assertIs(reader_again, reader)
+                self.assertEqual(reader_again.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1)
+            pool.close()
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_results_are_reused_until_a_write(self):
+        cache = units.QueryCache(max_rows=3, ttl=60)
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            return [value] * 2
+
+        self.assertEqual(cache.get_or_compute("a", lambda: compute("a"), len), ["a", "a"])
+        self.assertEqual(cache.get_or_compute("a", lambda: compute("a"), len), ["a", "a"])
+        self.assertEqual(calls, ["a"])
+
+        cache.get_or_compute("b", lambda: compute("b"), len)  # 4 rows exceed max_rows, "a" is evicted
+        cache.get_or_compute("a", lambda: compute("a"), len)
+        self.assertEqual(calls, ["a", "b", "a"])
+
+        cache.invalidate()
+        cache.get_or_compute("a", lambda: compute("a"), len)
+        self.assertEqual(calls, ["a", "b", "a", "a"])
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (1, 4))
+
+    def test_invalidating_a_kind_keeps_the_others(self):
+        cache = units.QueryCache(max_rows=10, ttl=60)
+        calls = []
+        for key in (("page", 1), ("count", None), ("page", 1), ("count", None)):
+            cache.get_or_compute(key, lambda: calls.append(key))
+        self.assertEqual(len(calls), 2)
+
+        cache.invalidate("page")
+        cache.get_or_compute(("page", 1), lambda: calls.append("page"))
+        cache.get_or_compute(("count", None), lambda: calls.append("count"))
+        self.assertEqual(calls[2:], ["page"])
 
 
 if __name__ == '__main__':
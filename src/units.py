@@ -1,11 +1,30 @@
 import base64
+import contextvars
 import hashlib
+import json
+import math
 import os
+import queue
+import sqlite3
+import sys
+import tempfile
 import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
 from enum import Enum
+from itertools import islice
 import asyncio
 import pymysql
 
+from metrics import InstrumentedConnection, instrument_methods, metrics
+
 
 class FileType(Enum):
     FILE = "file"
@@ -20,9 +39,13 @@ class Errors(Enum):
 
 
 class FileEntry:
+    __slots__ = ("_id", "_name", "_abs_path", "_type", "_parent_id", "_parent_path", "_size", "_abs_path_hash",
+                 "_mtime", "_inode", "_total_size", "_file_count")
+
     def __init__(
         self, id: int = None, name: str = None, abs_path: str = None,abs_path_hash:str = None, type: FileType = None,
-        parent_id: int = None, parent_path: str = None, size: int = None
+        parent_id: int = None, parent_path: str = None, size: int = None, mtime: float = None, inode: int = None,
+        total_size: int = None, file_count: int = None
     ):
         self._id = id
         self._name = name
@@ -32,6 +55,10 @@ class FileEntry:
         self._parent_path = parent_path
         self._size = size
         self._abs_path_hash = abs_path_hash
+        self._mtime = mtime
+        self._inode = inode
+        self._total_size = total_size
+        self._file_count = file_count
 
     def __str__(self):
         return (
@@ -63,6 +90,9 @@ class FileEntry:
 
     @property
     def abs_path_hash(self):
+        """ Hex SHA-256 of the path, derived from it when not given. The catalog itself is keyed by path_key """
+        if self._abs_path_hash is None and self._abs_path is not None:
+            self._abs_path_hash = hashlib.sha256(self._abs_path.encode()).hexdigest()
         return self._abs_path_hash
 
     @property
@@ -81,85 +111,511 @@ class FileEntry:
     def size(self):
         return self._size
 
+    @property
+    def mtime(self):
+        return self._mtime
 
-class DatabaseManager:
-    def __init__(self, host: str, port: int, user: str, passwd: str, database: str):
-        self.host = host
-        self.port = port
-        self.user = user
-        self.passwd =passwd
-        self.database = database
-        self.error_code = Errors.EVERYTHING_IS_FINE
+    @property
+    def inode(self):
+        return self._inode
+
+    @property
+    def total_size(self):
+        """ Bytes of all files below a directory, the size of a file """
+        return self._total_size
+
+    @property
+    def file_count(self):
+        """ Number of files below a directory, 1 for a file """
+        return self._file_count
+
+
+class FileEntryColumns(Sequence):
+    """ Column-wise result set: ids, parent ids, sizes and types live in arrays and parent paths are shared between
+    siblings. FileEntry objects are only built when an item is accessed, they derive the path hash from the path """
+    __slots__ = ("_ids", "_parent_ids", "_sizes", "_totals", "_counts", "_types", "_names", "_paths",
+                 "_parent_paths", "_interned")
+    NONE = -1  # ids and sizes are never negative
+    TYPES = (FileType.FILE, FileType.DIRECTORY)
+
+    def __init__(self, rows=()):
+        self._ids = array("q")
+        self._parent_ids = array("q")
+        self._sizes = array("q")
+        self._totals = array("q")
+        self._counts = array("q")
+        self._types = bytearray()
+        self._names = []
+        self._paths = []
+        self._parent_paths = []
+        self._interned = {}
+        self.extend(rows)
+
+    def append(self, id, name, type, abs_path, parent_id, size, parent_path, abs_path_hash=None, total_size=None,
+               file_count=None):
+        """ abs_path_hash only keeps the column order of the rows, it is not stored """
+        self._ids.append(id)
+        self._parent_ids.append(self.NONE if parent_id is None else parent_id)
+        self._sizes.append(self.NONE if size is None else size)
+        self._totals.append(self.NONE if total_size is None else total_size)
+        self._counts.append(self.NONE if file_count is None else file_count)
+        self._types.append(self.TYPES.index(FileType(type)))
+        self._names.append(name)
+        self._paths.append(abs_path)
+        self._parent_paths.append(self._interned.setdefault(parent_path, parent_path))
+
+    def extend(self, rows):
+        """ Appends rows in the column order of append """
+        for row in rows:
+            self.append(*row)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("FileEntryColumns index out of range")
+        return self._entry(index)
+
+    def _entry(self, i: int):
+        parent_id, size = self._parent_ids[i], self._sizes[i]
+        total_size, file_count = self._totals[i], self._counts[i]
+        return FileEntry(
+            id=self._ids[i], name=self._names[i], type=self.TYPES[self._types[i]], abs_path=self._paths[i],
+            parent_id=None if parent_id == self.NONE else parent_id, size=None if size == self.NONE else size,
+            parent_path=self._parent_paths[i],
+            total_size=None if total_size == self.NONE else total_size,
+            file_count=None if file_count == self.NONE else file_count
+        )
+
+
+class QueryCancelled(Exception):
+    """ Raised inside a query run by CatalogStorage.run_cancellable once its caller gave up on it """
+
+
+class _RunningQuery:
+    """ The connection a cancellable operation currently uses, so another thread can interrupt it """
+
+    def __init__(self):
         self.lock = threading.Lock()
+        self.connection = None
+        self.cancelled = False
+
+    def attach(self, connection):
+        with self.lock:
+            if self.cancelled:
+                raise QueryCancelled()
+            self.connection = connection
+
+    def detach(self):
+        with self.lock:
+            self.connection = None
+
+
+_running_query = contextvars.ContextVar("running_query", default=None)
+
+
+class JobStatus(Enum):
+    RUNNING = "running"  # also what a job interrupted by a crash or a closed app is left in
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+    DONE = "done"
+
+
+class ImportJob:
+    """ A resumable import of root_path. Import_Frontier holds the directories whose listing is not written
+    completely yet. A directory enters it in the transaction that inserts it and leaves it in the one that
+    writes the last entries of its listing, so a resumed job lists only the frontier and walks no finished subtree """
+
+    def __init__(self, id: int, root_path: str, parent_id: int = None, root_id: int = None,
+                 status: JobStatus = JobStatus.RUNNING, rows: int = 0, completed_dirs: int = 0, error: str = None):
+        self.id = id
+        self.root_path = root_path
+        self.parent_id = parent_id
+        self.root_id = root_id
+        self.status = status
+        self.rows = rows
+        self.completed_dirs = completed_dirs
+        self.error = error
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._finished = []  # directories listed completely, leave the frontier with the next checkpoint
+
+    def cancel(self):
+        """ Stops the import at the next directory, safe to call from any thread """
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _finish_directory(self, directory_id: int):
+        with self._lock:
+            self._finished.append(directory_id)
+
+    def _forget_finished(self):
+        with self._lock:
+            self._finished = []
+
+    def _checkpoint(self, cursor, new_dirs: list, inserted: int):
+        """ Records the progress of a batch inside its transaction, before it is committed """
+        with self._lock:
+            finished, self._finished = self._finished, []
+        if new_dirs:
+            cursor.executemany("INSERT INTO Import_Frontier (job_id, directory_id, absolute_path) VALUES (%s, %s, %s)",
+                               [(self.id, dir_id, path) for path, dir_id in new_dirs])
+        for start in range(0, len(finished), CatalogStorage.IN_QUERY_CHUNK):
+            chunk = finished[start:start + CatalogStorage.IN_QUERY_CHUNK]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"DELETE FROM Import_Frontier WHERE job_id = %s AND directory_id IN ({placeholders})",
+                           [self.id, *chunk])
+        cursor.execute(
+            """UPDATE Import_Jobs SET rows_inserted = rows_inserted + %s, completed_dirs = completed_dirs + %s,
+                   updated = %s WHERE id = %s""",
+            (inserted, len(finished), time.time(), self.id)
+        )
+        self.rows += inserted
+        self.completed_dirs += len(finished)
+
+
+@instrument_methods
+class CatalogStorage(ABC):
+    """ Catalog operations shared by the storage backends, written against the pymysql DB-API calls.
+    A backend provides its connections, its keyword search and a way to interrupt a running statement """
+    BULK_BATCH_SIZE = 1000
+    SCAN_WORKERS = 4
+    WRITE_WORKERS = 1
+    SCAN_QUEUE_DEPTH = 16
+    HASH_INDEX_MEMORY_CAP = 256 * 1024 * 1024
+    POOL_SIZE = 8
+    CACHE_MAX_ROWS = 200000
+    CACHE_TTL = 30.0
+    IN_QUERY_CHUNK = 1000
+    HASH_WORKERS = os.cpu_count() or 1
+    HASH_SAMPLE_BYTES = 64 * 1024
+    HASH_BATCH = 1000
+    CONTENT_HASH_SIZE = 32  # bytes of the BLAKE2b content digest, its hex fills the CHAR(64) content_hash
+    IMPORT_RETRIES = 3
+    SCANDIR_BATCH = 1000
+    PATH_KEY_SIZE = 16
+    PATH_KEY_TYPE = None  # column type of path_key
+    PATH_KEY_CHUNK = 5000  # rows per committed step of migrate_path_keys
+    IMPORT_RETRY_DELAY = 5.0
+    CONNECTION_ERRORS = ()  # errors of a dropped connection, after which an import job resumes
+    # Columns added after the first release, created on existing catalogs by selfcheck
+    SCHEMA_COLUMNS = {
+        "mtime": "DOUBLE DEFAULT NULL",
+        "inode": "BIGINT UNSIGNED DEFAULT NULL",
+        "content_hash": "CHAR(64) DEFAULT NULL",  # BLAKE2b of the file content, filled by find_duplicates
+        # Bytes and number of files below a directory, the file's own size and 1 for a file
+        "total_size": "BIGINT DEFAULT NULL",
+        "file_count": "BIGINT DEFAULT NULL",
+        # Lower case file extension without the dot, "" for none, NULL for a directory
+        "extension": "VARCHAR(32) DEFAULT NULL",
+        "root_id": "INT DEFAULT NULL",  # the root directory the entry was imported under, its own id for a root
+    }
+    INSERT_ROWS_QUERY = None  # INSERT ignoring duplicate path hashes, columns in the order of _scan_row
+    # abs_path_hash is not stored, FileEntry derives it from the path when it is asked for
+    ENTRY_COLUMNS = """f.id, f.name, f.type, f.absolute_path, f.parent_id, f.size, p.absolute_path, NULL,
+                       f.total_size, f.file_count"""
+
+    def __init__(self):
+        self.error_code = Errors.EVERYTHING_IS_FINE
+        self.pool = ConnectionPool(self._open_connection, self.POOL_SIZE)
+        self.cache = QueryCache(self.CACHE_MAX_ROWS, self.CACHE_TTL)
+
+    def _open_connection(self, **options):
+        """ Connections opened while metrics are enabled record every statement """
+        connection = self._connect(**options)
+        return InstrumentedConnection(connection) if metrics.enabled else connection
+
+    @contextmanager
+    def _cursor(self, cursor_class=None):
+        """ Cursor on a pooled connection, reachable as cursor.connection for commits """
+        with self.pool.connection() as connection, self._attached(connection):
+            cursor = connection.cursor(cursor_class) if cursor_class else connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def _load_cursor(self):
+        """ Cursor bulk_load stages and inserts with, on a pooled connection unless the backend needs another """
+        with self._cursor() as cursor:
+            yield cursor
 
+    @contextmanager
+    def _attached(self, connection):
+        """ Lets run_cancellable interrupt the statements sent on connection by the current operation """
+        running = _running_query.get()
+        if running is None:
+            yield
+            return
+        running.attach(connection)
         try:
-            self.selfcheck(host, port, user, passwd, database)
-            self.connection = pymysql.connect(host=host, port=port, user=user, passwd=passwd, db=database)
-            self.cursor = self.connection.cursor()
-        except pymysql.err.OperationalError as e:
-            if e.args[0] == 1045:
-                self.error_code = Errors.AUTH_ERROR
+            yield
+        finally:
+            running.detach()
 
-            elif e.args[0] == 2003:
-                self.error_code = Errors.CONNECTION_ERROR
+    async def run_cancellable(self, function, *args):
+        """ Runs a read such as fetch_page off the event loop. Cancelling the awaiting task abandons the result
+        and interrupts the statement still running for it """
+        running = _RunningQuery()
+        context = contextvars.copy_context()
+        context.run(_running_query.set, running)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, context.run, function, *args)
+        except asyncio.CancelledError:
+            with running.lock:
+                running.cancelled = True
+                attached = running.connection is not None
+            if attached:
+                loop.run_in_executor(None, self._kill_query, running)
+            raise
 
-            else:
-                self.error_code = Errors.SOMETHING_WENT_WRONG
-        except Exception as e:
-            if e.args[0] == 1045:
-                self.error_code = Errors.AUTH_ERROR
-            else:
-                self.error_code = Errors.SOMETHING_WENT_WRONG
+    def _kill_query(self, running: _RunningQuery):
+        # Holding the lock keeps the connection checked out until it is interrupted, so no other query is hit
+        with running.lock:
+            if running.connection is not None:
+                self._interrupt(running.connection)
 
+    @abstractmethod
+    def _interrupt(self, connection):
+        """ Stops the statement running on connection, called from another thread """
+
+    def find_id(self, abs_path: str):
+        with self._cursor() as cursor:
+            cursor.execute("SELECT id FROM Files_And_Directories WHERE path_key = %s", (self.path_key(abs_path),))
+            row = cursor.fetchone()
+        return row[0] if row else None
 
     def fetch_all_files(self):
-        query = """SELECT f.id, f.name, f.type, f.absolute_path, f.parent_id, f.size, p.absolute_path, f.absolute_path_hash AS parent_path 
-                   FROM Files_And_Directories f 
-                   LEFT JOIN Files_And_Directories p ON f.parent_id = p.id;"""
-        self.cursor.execute(query)
-        return [
-            FileEntry(id=row[0], name=row[1], type=FileType(row[2]), abs_path=row[3], parent_id=row[4], size=row[5], parent_path=row[6],abs_path_hash=row[7])
-            for row in self.cursor.fetchall()
-        ]
-
-    def search_with_keywords(self, keyword_string):
-        keywords = keyword_string.split()[:3]
-        if not keywords:
+        return self.cache.get_or_compute(("listing", None, False), lambda: self._fetch_columns(None, False), len)
+
+    def search_with_keywords(self, keyword_string, match_all: bool = False):
+        """ Entries matching the keywords through the ngram FULLTEXT index, best matches first.
+        Any keyword may match unless match_all is set """
+        if self._search_clause(keyword_string, match_all) is None:
             return self.fetch_all_files()
+        return self.cache.get_or_compute(("listing", keyword_string, match_all),
+                                         lambda: self._fetch_columns(keyword_string, match_all), len)
+
+    def _fetch_columns(self, filter, match_all: bool):
+        columns = FileEntryColumns()
+        for rows in self._stream_rows(*self._listing_query(filter, match_all)):
+            columns.extend(rows)
+        return columns
+
+    def iter_files(self, filter: str = None, match_all: bool = False, batch_size: int = None, limit: int = None):
+        """ Streams entries while the rows arrive, matches of filter best first.
+        Yields FileEntry objects, or lists of up to batch_size of them, and stops after limit entries """
+        query, params = self._listing_query(filter, match_all, limit)
+        for rows in self._stream_rows(query, params, batch_size or self.STREAM_BATCH):
+            entries = [self._entry_from_row(row) for row in rows]
+            if batch_size:
+                yield entries
+            else:
+                yield from entries
+
+    STREAM_BATCH = 1000
+    STREAMING_CURSOR = None  # cursor class reading rows as they are fetched, when the driver needs one
+
+    def _listing_query(self, filter, match_all: bool, limit: int = None):
+        """ Query and params listing every entry, or the matches of filter ordered by relevance """
+        search = self._search_clause(filter, match_all)
+        where, order, params = "", "", []
+        if search is not None:
+            where = f"WHERE {search['condition']}"
+            order = f"ORDER BY {search['relevance']} DESC, f.id DESC"
+            params = search["params"] + search["relevance_params"]
+        query = f"""SELECT {self.ENTRY_COLUMNS}
+                    FROM Files_And_Directories f
+                    LEFT JOIN Files_And_Directories p ON f.parent_id = p.id
+                    {where}
+                    {order}"""
+        if limit is not None:
+            query += " LIMIT %s"
+            params = params + [limit]
+        return query, params
+
+    def _stream_rows(self, query: str, params: list, batch_size: int = STREAM_BATCH):
+        """ Lists of raw rows read from an unbuffered cursor, so only one batch is held in memory at a time """
+        connection = self.pool.acquire()
+        finished = False
+        try:
+            with self._attached(connection):
+                cursor = connection.cursor(self.STREAMING_CURSOR)
+                cursor.execute(query, params)
+                while rows := cursor.fetchmany(batch_size):
+                    yield rows
+                cursor.close()
+            finished = True
+        finally:
+            # A consumer that stopped early leaves unread rows on the connection, it is not worth draining them
+            if finished:
+                self.pool.release(connection)
+            else:
+                self.pool.discard(connection)
 
-        search_conditions = " OR ".join(["f.name LIKE %s OR f.absolute_path LIKE %s"] * len(keywords))
-        query = f"""
-        SELECT f.id, f.name, f.type, f.absolute_path, f.parent_id, f.size, p.absolute_path AS parent_path
-        FROM Files_And_Directories f
-        LEFT JOIN Files_And_Directories p ON f.parent_id = p.id
-        WHERE {search_conditions};
-        """
-        params = [f"%{kw}%" for kw in keywords for _ in range(2)]
-        self.cursor.execute(query, params)
-        return [
-            FileEntry(id=row[0], name=row[1], type=FileType(row[2]), abs_path=row[3], parent_id=row[4], size=row[5], parent_path=row[6])
-            for row in self.cursor.fetchall()
-        ]
+    @staticmethod
+    def _entry_from_row(row):
+        return FileEntry(id=row[0], name=row[1], type=FileType(row[2]), abs_path=row[3], parent_id=row[4],
+                         size=row[5], parent_path=row[6], abs_path_hash=row[7], total_size=row[8], file_count=row[9])
+
+    @abstractmethod
+    def _search_clause(self, keyword_string, match_all: bool = False):
+        """ WHERE condition and relevance expression of a keyword search, None when there is nothing to search.
+        Returns {"condition", "params", "relevance", "relevance_params"}, a higher relevance is a better match """
+
+    SORT_COLUMNS = {"id": "f.id", "name": "f.name", "size": "f.size", "total_size": "f.total_size"}
+
+    def fetch_page(self, after_key=None, limit: int = 500, sort: str = "id", filter: str = None,
+                   match_all: bool = False):
+        """ One page of entries using keyset pagination.
+        sort is a key of SORT_COLUMNS or "relevance" for searches, prefixed with "-" for descending order.
+        after_key is the next_key returned with the previous page, None for the first one.
+        Returns (entries, next_key), next_key is None on the last page """
+        key = ("page", after_key, limit, sort, filter, match_all)
+        entries, next_key = self.cache.get_or_compute(
+            key, lambda: self._fetch_page(after_key, limit, sort, filter, match_all), lambda page: len(page[0])
+        )
+        return list(entries), next_key
+
+    def _fetch_page(self, after_key, limit: int, sort: str, filter: str, match_all: bool):
+        descending = sort.startswith("-")
+        search = self._search_clause(filter, match_all)
+
+        if sort.lstrip("-") == "relevance":
+            # Without anything to search every entry is equally relevant
+            column, column_params = (search["relevance"], search["relevance_params"]) if search else ("f.id", [])
+        else:
+            column, column_params = self.SORT_COLUMNS[sort.lstrip("-")], []
+
+        conditions, params = [], []
+        if search is not None:
+            conditions.append(search["condition"])
+            params += search["params"]
+        if after_key is not None:
+            keyset_condition, keyset_params = self._keyset_condition(column, column_params, descending, after_key)
+            conditions.append(keyset_condition)
+            params += keyset_params
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = "DESC" if descending else "ASC"
+        # Plain columns are ordered by name so the optimizer can walk their (column, id) index
+        order_column = "sort_value" if column_params else column
+        order = f"f.id {direction}" if column == "f.id" else f"{order_column} {direction}, f.id {direction}"
+        query = f"""SELECT {self.ENTRY_COLUMNS}, {column} AS sort_value
+                    FROM Files_And_Directories f
+                    LEFT JOIN Files_And_Directories p ON f.parent_id = p.id
+                    {where}
+                    ORDER BY {order}
+                    LIMIT %s"""
+        with self._cursor() as cursor:
+            cursor.execute(query, column_params + params + [limit + 1])
+            rows = cursor.fetchall()
+
+        next_key = (rows[limit - 1][-1], rows[limit - 1][0]) if len(rows) > limit else None
+        return [self._entry_from_row(row) for row in rows[:limit]], next_key
+
+    @staticmethod
+    def _keyset_condition(column: str, column_params: list, descending: bool, after_key):
+        """ Rows after (value, id) in the page order. NULLs sort first ascending and last descending """
+        value, last_id = after_key
+        if column == "f.id":
+            return ("f.id < %s" if descending else "f.id > %s"), [last_id]
+        if value is None:
+            if descending:
+                return f"({column} IS NULL AND f.id < %s)", column_params + [last_id]
+            return f"({column} IS NOT NULL OR f.id > %s)", column_params + [last_id]
+        if descending:
+            return (f"({column} < %s OR ({column} = %s AND f.id < %s) OR {column} IS NULL)",
+                    column_params + [value] + column_params + [value, last_id] + column_params)
+        return (f"({column} > %s OR ({column} = %s AND f.id > %s))",
+                column_params + [value] + column_params + [value, last_id])
+
+    COUNT_CAP = 100000
+
+    def approximate_count(self, filter: str = None, match_all: bool = False):
+        """ Counts entries up to COUNT_CAP, returns (count, capped) """
+        return self.cache.get_or_compute(("count", filter, match_all),
+                                         lambda: self._approximate_count(filter, match_all))
+
+    def _approximate_count(self, filter: str, match_all: bool):
+        search = self._search_clause(filter, match_all)
+        where, params = (f"WHERE {search['condition']}", search["params"]) if search else ("", [])
+        with self._cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM Files_And_Directories f {where} LIMIT %s) capped",
+                params + [self.COUNT_CAP]
+            )
+            count = cursor.fetchone()[0]
+        return count, count >= self.COUNT_CAP
 
     def insert(self, entry: FileEntry):
         """ Inserts a file/directory entry into the database, ignoring duplicates """
-        query = """INSERT IGNORE INTO Files_And_Directories (name, type, parent_id, absolute_path, size, absolute_path_hash) 
-                    VALUES (%s, %s, %s, %s, %s, %s)"""
-        self.cursor.execute(query, (
-            entry.name, entry.type.value, entry.parent_id, entry.abs_path, entry.size, entry.abs_path_hash
+        with self._cursor() as cursor:
+            return self._insert_entry(cursor, entry, rollup=True)
+
+    def _insert_entry(self, cursor, entry: FileEntry, rollup: bool = False):
+        """ With rollup, a file moves the rollups of the directories above it in the same transaction """
+        is_file = entry.type == FileType.FILE
+        total_size, file_count = (entry.size or 0, 1) if is_file else (0, 0)
+        extension = self.file_extension(entry.name) if is_file else None
+        root_id = self._root_ids(cursor, [entry.parent_id]).get(entry.parent_id) if entry.parent_id else None
+        cursor.execute(self.INSERT_ROWS_QUERY, (
+            entry.name, entry.type.value, entry.parent_id, entry.abs_path, entry.size, self.path_key(entry.abs_path),
+            entry.mtime, entry.inode, total_size, file_count, extension, root_id
         ))
-        self.connection.commit()
-        return self.cursor.lastrowid if self.cursor.rowcount > 0 else None  # Return ID only if inserted
+        if cursor.rowcount <= 0:
+            cursor.connection.commit()
+            return None
+        inserted_id = cursor.lastrowid
+        if entry.parent_id is None:
+            root_id = inserted_id
+            cursor.execute("UPDATE Files_And_Directories SET root_id = id WHERE id = %s", (inserted_id,))
+        if is_file:
+            self._adjust_stats(cursor, [(root_id, extension, entry.size)])
+            if rollup and entry.parent_id is not None:
+                self._adjust_ancestors(cursor, entry.parent_id, entry.size or 0, 1)
+        cursor.connection.commit()
+        self.cache.invalidate()
+        return inserted_id  # Return ID only if inserted
 
-    async def insert_directory_to_db(self, directory_path: str, parent_id: int = None):
-        await asyncio.to_thread(self._insert_directory_to_db, directory_path, parent_id)
+    async def insert_directory_to_db(self, directory_path: str, parent_id: int = None,
+                                     batch_size: int = BULK_BATCH_SIZE, scan_workers: int = SCAN_WORKERS,
+                                     write_workers: int = WRITE_WORKERS, queue_depth: int = SCAN_QUEUE_DEPTH):
+        return await asyncio.to_thread(
+            self._insert_directory_to_db, directory_path, parent_id, batch_size, scan_workers, write_workers,
+            queue_depth
+        )
 
-    def _insert_directory_to_db(self, directory_path: str, parent_id: int = None):
-        self.ensure_connection()
+    def _insert_directory_to_db(self, directory_path: str, parent_id: int = None, batch_size: int = None,
+                                scan_workers: int = 0, write_workers: int = WRITE_WORKERS,
+                                queue_depth: int = SCAN_QUEUE_DEPTH, job: ImportJob = None):
+        """ Row by row import, the batched bulk import when batch_size is given,
+        or the parallel scanner/writer pipeline when scan_workers is given as well.
+        The batched imports of a job start from its frontier and checkpoint every batch """
+        if batch_size and scan_workers:
+            return self._parallel_insert_directory_to_db(
+                directory_path, parent_id, batch_size, scan_workers, write_workers, queue_depth, job
+            )
+        if batch_size:
+            return self._bulk_insert_directory_to_db(directory_path, parent_id, batch_size, job)
+        with self._cursor() as cursor:
+            self._insert_directory_row_by_row(cursor, directory_path, parent_id)
+            cursor.execute("SELECT id FROM Files_And_Directories WHERE path_key = %s", (self.path_key(directory_path),))
+            self._rollup_subtree(cursor, cursor.fetchone()[0])
 
-        dir_hash = self.hash_path(directory_path)
-        self.cursor.execute("SELECT id FROM Files_And_Directories WHERE absolute_path_hash = %s", (dir_hash,))
-        existing = self.cursor.fetchone()
+    def _insert_directory_row_by_row(self, cursor, directory_path: str, parent_id: int = None):
+        cursor.execute("SELECT id FROM Files_And_Directories WHERE path_key = %s", (self.path_key(directory_path),))
+        existing = cursor.fetchone()
 
         if existing:
             new_parent_id = existing[0]  # ✅ Use existing ID if directory exists
@@ -169,18 +625,15 @@ class DatabaseManager:
                 abs_path=directory_path,
                 type=FileType.DIRECTORY,
                 parent_id=parent_id,
-                size=None,
-                abs_path_hash=dir_hash
+                size=None
             )
-            new_parent_id = self.insert(file_entry)  # Insert and get new ID
+            new_parent_id = self._insert_entry(cursor, file_entry)  # Insert and get new ID
 
         for entry in os.scandir(directory_path):
             entry_type = FileType.DIRECTORY if entry.is_dir() else FileType.FILE
             entry_size = os.path.getsize(entry.path) if entry.is_file() else None
-            entry_hash = self.hash_path(entry.path)
-
-            self.cursor.execute("SELECT id FROM Files_And_Directories WHERE absolute_path_hash = %s", (entry_hash,))
-            if self.cursor.fetchone():
+            cursor.execute("SELECT id FROM Files_And_Directories WHERE path_key = %s", (self.path_key(entry.path),))
+            if cursor.fetchone():
                 continue
 
             file_entry = FileEntry(
@@ -188,40 +641,1354 @@ class DatabaseManager:
                 abs_path=entry.path,
                 type=entry_type,
                 parent_id=new_parent_id,
-                size=entry_size,
-                abs_path_hash=entry_hash
+                size=entry_size
             )
-            child_id = self.insert(file_entry)
+            child_id = self._insert_entry(cursor, file_entry)
 
             if entry.is_dir():
-                self._insert_directory_to_db(entry.path, child_id)
+                self._insert_directory_row_by_row(cursor, entry.path, child_id)
+
+    def _bulk_insert_directory_to_db(self, directory_path: str, parent_id: int, batch_size: int,
+                                     job: ImportJob = None):
+        """ Walks the tree breadth-first and writes every batch_size entries in one transaction """
+        started = time.perf_counter()
+        with self._cursor() as cursor:
+            root_id = self._get_or_insert_directory(cursor, directory_path, parent_id)
+            index = self._load_hash_index(cursor, root_id)
+
+            pending = deque(self._job_frontier(cursor, job) if job else [(directory_path, root_id)])
+            batch = []
+            inserted = 0
+            while pending or batch:
+                stopping = job is not None and job.cancelled
+                if not pending or stopping:
+                    # Children of the remaining directories are only known once the batch is written
+                    written, new_dirs = self._write_batch(cursor, batch, index, job)
+                    inserted += written
+                    batch = []
+                    if stopping:
+                        break
+                    pending.extend(new_dirs)
+                    continue
+
+                path, dir_id = pending.popleft()
+                for entry in self._scan_directory(path):
+                    batch.append(self._scan_row(entry, dir_id))
+                    if len(batch) >= batch_size:
+                        written, new_dirs = self._write_batch(cursor, batch, index, job)
+                        inserted += written
+                        pending.extend(new_dirs)
+                        batch = []
+                if job is not None:
+                    job._finish_directory(dir_id)  # its last entries are in the next batch written
+            self._rollup_subtree(cursor, root_id)
+
+        seconds = time.perf_counter() - started
+        return {"rows": inserted, "seconds": seconds, "rows_per_sec": inserted / seconds if seconds else 0.0,
+                "hash_index": index.describe()}
+
+    def _parallel_insert_directory_to_db(self, directory_path: str, parent_id: int, batch_size: int,
+                                         scan_workers: int, write_workers: int, queue_depth: int,
+                                         job: ImportJob = None):
+        started = time.perf_counter()
+        with self._cursor() as cursor:
+            root_id = self._get_or_insert_directory(cursor, directory_path, parent_id)
+            index = self._load_hash_index(cursor, root_id)
+            directories = self._job_frontier(cursor, job) if job else [(directory_path, root_id)]
+
+        pipeline = _ImportPipeline(self, batch_size, scan_workers, max(1, write_workers), queue_depth, index, job)
+        inserted = pipeline.run(directories)
+        with self._cursor() as cursor:
+            self._rollup_subtree(cursor, root_id)
+
+        seconds = time.perf_counter() - started
+        return {"rows": inserted, "seconds": seconds, "rows_per_sec": inserted / seconds if seconds else 0.0,
+                "hash_index": index.describe()}
+
+    def create_import_job(self, directory_path: str, parent_id: int = None):
+        """ Catalogs the root directory and records a job whose frontier is that root """
+        now = time.time()
+        with self._cursor() as cursor:
+            root_id = self._get_or_insert_directory(cursor, directory_path, parent_id)
+            cursor.execute(
+                """INSERT INTO Import_Jobs (root_path, parent_id, root_id, status, started, updated)
+                   VALUES (%s, %s, %s, %s, %s, %s)""",
+                (directory_path, parent_id, root_id, JobStatus.RUNNING.value, now, now)
+            )
+            job_id = cursor.lastrowid
+            cursor.execute("INSERT INTO Import_Frontier (job_id, directory_id, absolute_path) VALUES (%s, %s, %s)",
+                           (job_id, root_id, directory_path))
+            cursor.connection.commit()
+        return ImportJob(job_id, directory_path, parent_id, root_id)
+
+    def import_jobs(self, unfinished: bool = True):
+        """ Recorded jobs, newest first. Unfinished ones were cancelled, failed or stopped with the app """
+        query = """SELECT id, root_path, parent_id, root_id, status, rows_inserted, completed_dirs, error
+                   FROM Import_Jobs"""
+        params = []
+        if unfinished:
+            query += " WHERE status <> %s"
+            params.append(JobStatus.DONE.value)
+        with self._cursor() as cursor:
+            cursor.execute(query + " ORDER BY id DESC", params)
+            return [ImportJob(row[0], row[1], row[2], row[3], JobStatus(row[4]), row[5], row[6], row[7])
+                    for row in cursor.fetchall()]
+
+    def open_import_job(self, directory_path: str):
+        """ The unfinished job importing directory_path, a new one when it is not catalogued yet, otherwise None """
+        for job in self.import_jobs():
+            if job.root_path == directory_path:
+                return job
+        if self.find_id(directory_path) is not None:
+            return None
+        return self.create_import_job(directory_path)
+
+    async def run_import_job(self, job: ImportJob, batch_size: int = BULK_BATCH_SIZE,
+                             scan_workers: int = SCAN_WORKERS, write_workers: int = WRITE_WORKERS,
+                             queue_depth: int = SCAN_QUEUE_DEPTH):
+        return await asyncio.to_thread(self._run_import_job, job, batch_size, scan_workers, write_workers,
+                                       queue_depth)
+
+    def _run_import_job(self, job: ImportJob, batch_size: int = BULK_BATCH_SIZE, scan_workers: int = SCAN_WORKERS,
+                        write_workers: int = WRITE_WORKERS, queue_depth: int = SCAN_QUEUE_DEPTH,
+                        retries: int = IMPORT_RETRIES):
+        """ Runs or resumes a job until its frontier is empty or it is cancelled.
+        A lost connection resumes it from the last checkpoint once the database answers again """
+        job.status = JobStatus.RUNNING
+        self._reseed_import_job(job)
+        attempt = 0
+        while True:
+            job._forget_finished()  # whatever a failed attempt finished was rolled back with it or is listed again
+            try:
+                if attempt:
+                    self.ensure_connection()
+                stats = self._insert_directory_to_db(job.root_path, job.parent_id, batch_size, scan_workers,
+                                                     write_workers, queue_depth, job)
+                break
+            except self.CONNECTION_ERRORS as e:
+                if attempt >= retries:
+                    self._end_import_job(job, JobStatus.FAILED, e)
+                    raise
+                attempt += 1
+                print(f"⚠️ Import of {job.root_path} lost its connection ({e}), resuming from the last checkpoint")
+                time.sleep(self.IMPORT_RETRY_DELAY * attempt)
+            except Exception as e:
+                self._end_import_job(job, JobStatus.FAILED, e)
+                raise
+        self._end_import_job(job, JobStatus.CANCELLED if job.cancelled else JobStatus.DONE)
+        return stats
+
+    def _reseed_import_job(self, job: ImportJob):
+        """ A job whose root was deleted from the catalog since starts over from the root, catalogued again """
+        with self._cursor() as cursor:
+            cursor.execute("SELECT id FROM Files_And_Directories WHERE id = %s", (job.root_id,))
+            if cursor.fetchone() is not None:
+                return
+            job.root_id = self._get_or_insert_directory(cursor, job.root_path, job.parent_id)
+            cursor.execute("DELETE FROM Import_Frontier WHERE job_id = %s", (job.id,))
+            cursor.execute("INSERT INTO Import_Frontier (job_id, directory_id, absolute_path) VALUES (%s, %s, %s)",
+                           (job.id, job.root_id, job.root_path))
+            cursor.execute("UPDATE Import_Jobs SET root_id = %s, error = NULL, updated = %s WHERE id = %s",
+                           (job.root_id, time.time(), job.id))
+            cursor.connection.commit()
+
+    def _end_import_job(self, job: ImportJob, status: JobStatus, error: Exception = None):
+        job.status = status
+        job.error = repr(error) if error is not None else None
+        try:
+            with self._cursor() as cursor:
+                if status == JobStatus.DONE:
+                    cursor.execute("DELETE FROM Import_Frontier WHERE job_id = %s", (job.id,))
+                elif status == JobStatus.CANCELLED:
+                    job._checkpoint(cursor, [], 0)  # directories finished since the last batch leave the frontier
+                cursor.execute("UPDATE Import_Jobs SET status = %s, error = %s, updated = %s WHERE id = %s",
+                               (status.value, job.error, time.time(), job.id))
+                cursor.connection.commit()
+        except Exception as e:
+            print(f"⚠️ Could not record the end of import job {job.id}: {e}")
+
+    def _job_frontier(self, cursor, job: ImportJob):
+        """ (path, id) of the directories a job still has to list, skipping those deleted from the catalog since """
+        cursor.execute(
+            """SELECT j.absolute_path, j.directory_id FROM Import_Frontier j
+               JOIN Files_And_Directories f ON f.id = j.directory_id
+               WHERE j.job_id = %s ORDER BY j.directory_id""",
+            (job.id,)
+        )
+        return [tuple(row) for row in cursor.fetchall()]
+
+    async def rescan_directory(self, directory_path: str, full: bool = False):
+        return await asyncio.to_thread(self._rescan_directory, directory_path, full)
+
+    def _rescan_directory(self, directory_path: str, full: bool = False, batch_size: int = BULK_BATCH_SIZE):
+        """ Applies only the differences between the disk and the catalog under directory_path.
+        A directory whose mtime and inode did not move keeps its listing, only its subdirectories are visited.
+        Size changes of files in such a directory are picked up with full=True. """
+        started = time.perf_counter()
+        with self._cursor() as cursor:
+            cursor.execute("SELECT id, mtime, inode FROM Files_And_Directories WHERE path_key = %s",
+                           (self.path_key(directory_path),))
+            root = cursor.fetchone()
+        if root is None:
+            stats = self._insert_directory_to_db(directory_path, batch_size=batch_size, scan_workers=self.SCAN_WORKERS)
+            return {"added": stats["rows"], "removed": 0, "updated": 0, "scanned_dirs": 0, "skipped_dirs": 0,
+                    "seconds": time.perf_counter() - started}
+
+        counts = {"added": 0, "removed": 0, "updated": 0, "scanned_dirs": 0, "skipped_dirs": 0}
+        pending = [(directory_path, *root)]
+        # Only the directories whose listing changed are rolled up again, and every new subtree once from its top
+        changed_dirs, new_roots, new_dirs = [], [], set()
+        with self._cursor() as cursor:
+            while pending:
+                path, dir_id, old_mtime, old_inode = pending.pop()
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    counts["removed"] += self._delete_subtree(cursor, dir_id)
+                    continue
+
+                if not full and stat.st_mtime == old_mtime and stat.st_ino == old_inode:
+                    counts["skipped_dirs"] += 1
+                    cursor.execute(
+                        "SELECT absolute_path, id, mtime, inode FROM Files_And_Directories WHERE parent_id = %s AND type = %s",
+                        (dir_id, FileType.DIRECTORY.value)
+                    )
+                    pending.extend(cursor.fetchall())
+                    continue
+
+                counts["scanned_dirs"] += 1
+                changes = counts["added"] + counts["removed"] + counts["updated"]
+                added_dirs = self._rescan_listing(cursor, path, dir_id, pending, counts, batch_size)
+                cursor.execute("UPDATE Files_And_Directories SET mtime = %s, inode = %s WHERE id = %s",
+                               (stat.st_mtime, stat.st_ino, dir_id))
+                cursor.connection.commit()
+                if dir_id not in new_dirs:
+                    new_roots.extend(added_dirs)
+                    if counts["added"] + counts["removed"] + counts["updated"] != changes:
+                        changed_dirs.append(dir_id)
+                new_dirs.update(added_dirs)
+            for new_id in new_roots:
+                self._rollup_subtree(cursor, new_id)
+            for dir_id in changed_dirs:
+                self._rollup_directory(cursor, dir_id)
+
+        counts["seconds"] = time.perf_counter() - started
+        return counts
+
+    def _sync_directories(self, directory_paths, batch_size: int = BULK_BATCH_SIZE):
+        """ Applies the listing changes of the given directories only, as reported by a filesystem watcher.
+        Directories that are new to the catalog are walked completely, catalogued subdirectories are not visited """
+        started = time.perf_counter()
+        counts = {"added": 0, "removed": 0, "updated": 0, "scanned_dirs": 0, "skipped_dirs": 0}
+        with self._cursor() as cursor:
+            for path in directory_paths:
+                cursor.execute("SELECT id FROM Files_And_Directories WHERE path_key = %s", (self.path_key(path),))
+                row = cursor.fetchone()
+                if row is None:  # not catalogued, the listing of its parent adds it
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    counts["removed"] += self._delete_subtree(cursor, row[0])
+                    continue
+
+                children = []
+                self._sync_listing(cursor, path, row[0], stat, children, counts, batch_size)
+                for new_path, new_id, mtime, _ in children:
+                    if mtime is not None:
+                        continue
+                    walk = [(new_path, new_id)]
+                    while walk:
+                        walk_path, walk_id = walk.pop()
+                        try:
+                            walk_stat = os.stat(walk_path)
+                        except FileNotFoundError:
+                            continue
+                        found = []
+                        self._sync_listing(cursor, walk_path, walk_id, walk_stat, found, counts, batch_size)
+                        walk.extend((found_path, found_id) for found_path, found_id, _, _ in found)
+                    self._rollup_subtree(cursor, new_id)
+                self._rollup_directory(cursor, row[0])
+
+        counts["seconds"] = time.perf_counter() - started
+        return counts
+
+    def _sync_listing(self, cursor, path: str, dir_id: int, stat, pending: list, counts: dict, batch_size: int):
+        counts["scanned_dirs"] += 1
+        self._rescan_listing(cursor, path, dir_id, pending, counts, batch_size)
+        cursor.execute("UPDATE Files_And_Directories SET mtime = %s, inode = %s WHERE id = %s",
+                       (stat.st_mtime, stat.st_ino, dir_id))
+        cursor.connection.commit()
+
+    def root_directories(self):
+        """ Paths of the directories imported as roots of the catalog """
+        with self._cursor() as cursor:
+            cursor.execute("SELECT absolute_path FROM Files_And_Directories WHERE parent_id IS NULL AND type = %s",
+                           (FileType.DIRECTORY.value,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def _rescan_listing(self, cursor, path: str, dir_id: int, pending: list, counts: dict, batch_size: int):
+        cursor.execute(
+            """SELECT absolute_path, id, type, size, mtime, inode, extension FROM Files_And_Directories
+               WHERE parent_id = %s""",
+            (dir_id,)
+        )
+        catalogued = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        new_rows, changed, resized, removed_ids = [], [], [], []
+        for entry in self._scan_directory(path):
+            row = self._scan_row(entry, dir_id)
+            child = catalogued.pop(entry.path, None)
+            if child is None:
+                new_rows.append(row)
+                continue
+            child_id, child_type, size, mtime, inode, extension = child
+            if child_type != row[1]:  # replaced by an entry of the other type
+                removed_ids.append(child_id)
+                new_rows.append(row)
+            elif child_type == FileType.DIRECTORY.value:
+                pending.append((entry.path, child_id, mtime, inode))
+            elif (size, mtime) != (row[4], row[6]):
+                changed.append((row[4], row[8], row[6], row[7], child_id))
+                resized.append((extension, size, row[4]))
+        removed_ids.extend(child[0] for child in catalogued.values())
+
+        for removed_id in removed_ids:
+            counts["removed"] += self._delete_subtree(cursor, removed_id)
+
+        if changed:
+            cursor.executemany(
+                """UPDATE Files_And_Directories SET size = %s, total_size = %s, mtime = %s, inode = %s, content_hash = NULL
+                   WHERE id = %s""",
+                changed
+            )
+            root_id = self._root_ids(cursor, [dir_id]).get(dir_id)
+            self._adjust_stats(cursor, [(root_id, extension, old) for extension, old, _ in resized], -1)
+            self._adjust_stats(cursor, [(root_id, extension, new) for extension, _, new in resized])
+            cursor.connection.commit()
+            self.cache.invalidate()
+            counts["updated"] += len(changed)
+
+        added_dirs = []
+        for start in range(0, len(new_rows), batch_size):
+            written, new_dirs = self._write_batch(cursor, new_rows[start:start + batch_size])
+            counts["added"] += written
+            # New directories have nothing catalogued below them, so their rescan is a plain import
+            pending.extend((new_path, new_id, None, None) for new_path, new_id in new_dirs)
+            added_dirs.extend(new_id for _, new_id in new_dirs)
+        return added_dirs
+
+    def _get_or_insert_directory(self, cursor, directory_path: str, parent_id: int = None):
+        cursor.execute("SELECT id FROM Files_And_Directories WHERE path_key = %s", (self.path_key(directory_path),))
+        existing = cursor.fetchone()
+        if existing:
+            return existing[0]
+        stat = os.stat(directory_path)
+        return self._insert_entry(cursor, FileEntry(
+            name=os.path.basename(directory_path),
+            abs_path=directory_path,
+            type=FileType.DIRECTORY,
+            parent_id=parent_id,
+            size=None,
+            mtime=stat.st_mtime,
+            inode=stat.st_ino
+        ))
+
+    @staticmethod
+    def _scan_directory(path: str):
+        try:
+            with os.scandir(path) as entries:
+                if not metrics.enabled:
+                    yield from entries
+                    return
+                metrics.count("scandir_directories_total")
+                while True:  # timed in batches, so the clock is read once per SCANDIR_BATCH entries
+                    started = time.perf_counter()
+                    batch = list(islice(entries, CatalogStorage.SCANDIR_BATCH))
+                    metrics.observe("scandir_batch_seconds", time.perf_counter() - started)
+                    if not batch:
+                        return
+                    metrics.count("scandir_entries_total", value=len(batch))
+                    yield from batch
+        except (PermissionError, FileNotFoundError) as e:
+            print(f"⚠️ Skipping unreadable directory {path}: {e}")
+
+    def _scan_row(self, entry: os.DirEntry, parent_id: int):
+        """ Row tuple in the column order of INSERT_ROWS_QUERY, _write_batch adds the root_id """
+        is_dir = entry.is_dir()
+        try:
+            stat = entry.stat()
+        except OSError:  # dangling symlink
+            stat = None
+        size = stat.st_size if stat is not None and not is_dir and entry.is_file() else None
+        mtime, inode = (stat.st_mtime, stat.st_ino) if stat is not None else (None, None)
+        entry_type = FileType.DIRECTORY if is_dir else FileType.FILE
+        total_size, file_count = (0, 0) if is_dir else (size or 0, 1)
+        return (entry.name, entry_type.value, parent_id, entry.path, size, self.path_key(entry.path), mtime, inode,
+                total_size, file_count, None if is_dir else self.file_extension(entry.name))
+
+    def _write_batch(self, cursor, rows: list, index=None, job: ImportJob = None):
+        """ Inserts the rows that are not catalogued yet and returns (inserted, [(path, id)] of new directories).
+        The checkpoint of job is part of the same transaction """
+        if not rows and job is None:
+            return 0, []
+        keys = [row[5] for row in rows]
+        existing = index.existing(cursor, keys) if index is not None else self._existing_keys(cursor, keys)
+        new_rows = [row for row in rows if row[5] not in existing]
+        inserted = 0
+        if new_rows:
+            roots = self._root_ids(cursor, {row[2] for row in new_rows})
+            new_rows = [row + (roots.get(row[2]),) for row in new_rows]
+            cursor.executemany(self.INSERT_ROWS_QUERY, new_rows)
+            if max(cursor.rowcount, 0) < len(new_rows):
+                # Another writer catalogued some of the keys meanwhile. The batch is sent again a row at a time,
+                # so that the summaries and the directories to list follow only the rows inserted here
+                cursor.connection.rollback()
+                inserted_rows = []
+                for row in new_rows:
+                    cursor.execute(self.INSERT_ROWS_QUERY, row)
+                    if cursor.rowcount > 0:
+                        inserted_rows.append(row)
+                new_rows = inserted_rows
+            inserted = len(new_rows)
+            self._adjust_stats(cursor, [(row[11], row[10], row[4]) for row in new_rows
+                                        if row[1] == FileType.FILE.value])
+
+        new_dirs = [(row[3], row[5]) for row in new_rows if row[1] == FileType.DIRECTORY.value]
+        dir_ids = self._ids_for_keys(cursor, [dir_key for _, dir_key in new_dirs])
+        new_dirs = [(path, dir_ids[dir_key]) for path, dir_key in new_dirs if dir_key in dir_ids]
+        if job is not None:
+            job._checkpoint(cursor, new_dirs, inserted)
+        cursor.connection.commit()
+        if inserted:
+            self.cache.invalidate()
+        return inserted, new_dirs
+
+    @classmethod
+    def _existing_keys(cls, cursor, keys: list):
+        existing = set()
+        for start in range(0, len(keys), cls.IN_QUERY_CHUNK):
+            chunk = keys[start:start + cls.IN_QUERY_CHUNK]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT path_key FROM Files_And_Directories WHERE path_key IN ({placeholders})", chunk)
+            existing.update(row[0] for row in cursor.fetchall())
+        return existing
+
+    SUBTREE_QUERY = """WITH RECURSIVE subtree (id, depth, path_key) AS (
+                           SELECT id, 0, path_key FROM Files_And_Directories WHERE id = %s
+                           UNION ALL
+                           SELECT f.id, s.depth + 1, f.path_key FROM Files_And_Directories f
+                           JOIN subtree s ON f.parent_id = s.id
+                       )"""
+
+    def _load_hash_index(self, cursor, root_id: int):
+        """ Prefetches the path keys already catalogued under root_id for the duplicate checks of an import.
+        Roots imported on their own below root_id are not linked to it, their subtrees are prefetched as well """
+        subtrees = [root_id] + self._nested_roots(cursor, root_id)
+        expected = 0
+        for subtree_id in subtrees:
+            cursor.execute(f"{self.SUBTREE_QUERY} SELECT COUNT(*) FROM subtree", (subtree_id,))
+            expected += cursor.fetchone()[0]
+        index = PathHashIndex(expected, self.HASH_INDEX_MEMORY_CAP)
+        if index.mode == PathHashIndex.QUERY:
+            return index
+
+        stream = cursor.connection.cursor(self.STREAMING_CURSOR)
+        try:
+            for subtree_id in subtrees:
+                stream.execute(f"{self.SUBTREE_QUERY} SELECT path_key FROM subtree", (subtree_id,))
+                while rows := stream.fetchmany(10000):
+                    index.add(row[0] for row in rows)
+        finally:
+            stream.close()
+        return index
+
+    def _nested_roots(self, cursor, root_id: int):
+        """ Ids of the other roots of the catalog whose path lies below the path of root_id """
+        cursor.execute("SELECT absolute_path FROM Files_And_Directories WHERE id = %s", (root_id,))
+        prefix = cursor.fetchone()[0].rstrip(os.sep) + os.sep
+        cursor.execute("SELECT id, absolute_path FROM Files_And_Directories WHERE parent_id IS NULL AND id <> %s",
+                       (root_id,))
+        return [row[0] for row in cursor.fetchall() if row[1].startswith(prefix)]
+
+    @staticmethod
+    def _ids_for_keys(cursor, keys: list):
+        if not keys:
+            return {}
+        placeholders = ", ".join(["%s"] * len(keys))
+        cursor.execute(f"SELECT path_key, id FROM Files_And_Directories WHERE path_key IN ({placeholders})", keys)
+        return {row[0]: row[1] for row in cursor.fetchall()}
 
     async def delete_directory(self, parent_id):
-       await asyncio.to_thread(self._delete_directory, parent_id)
+        return await asyncio.to_thread(self._delete_directory, parent_id)
+
+    DELETE_CHUNK = 1000
 
     def _delete_directory(self, parent_id):
+        """ Deletes an entry and everything below it in one transaction and returns {"rows", "seconds"} """
+        started = time.perf_counter()
         if not parent_id:
+            return {"rows": 0, "seconds": 0.0}
+        with self._cursor() as cursor:
+            deleted = self._delete_subtree(cursor, parent_id)
+        return {"rows": deleted, "seconds": time.perf_counter() - started}
+
+    def _delete_subtree(self, cursor, parent_id: int):
+        """ Levels are deleted deepest first in chunks of DELETE_CHUNK, so no row is deleted before its children """
+        cursor.execute("SELECT parent_id, total_size, file_count FROM Files_And_Directories WHERE id = %s",
+                       (parent_id,))
+        root = cursor.fetchone()
+        cursor.execute(
+            f"""{self.SUBTREE_QUERY} SELECT s.id, s.depth, f.type, f.root_id, f.extension, f.size FROM subtree s
+                JOIN Files_And_Directories f ON f.id = s.id""",
+            (parent_id,)
+        )
+        levels, files, directories = {}, [], set()
+        for entry_id, depth, entry_type, *file in cursor.fetchall():
+            levels.setdefault(depth, []).append(entry_id)
+            if entry_type == FileType.FILE.value:
+                files.append(file)
+            else:
+                directories.add(entry_id)
+
+        deleted = 0
+        try:
+            for depth in sorted(levels, reverse=True):
+                ids = levels[depth]
+                for start in range(0, len(ids), self.DELETE_CHUNK):
+                    chunk = ids[start:start + self.DELETE_CHUNK]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    cursor.execute(f"DELETE FROM Files_And_Directories WHERE id IN ({placeholders})", chunk)
+                    deleted += cursor.rowcount
+            if root is not None and root[0] is not None:
+                self._adjust_ancestors(cursor, root[0], -(root[1] or 0), -(root[2] or 0))
+            self._adjust_stats(cursor, files, -1)
+            self._end_deleted_jobs(cursor, directories)
+            cursor.connection.commit()
+        except Exception:
+            cursor.connection.rollback()
+            raise
+        if deleted:
+            self.cache.invalidate()
+        return deleted
+
+    def _end_deleted_jobs(self, cursor, directory_ids: set):
+        """ Takes deleted directories off the frontier of the unfinished jobs and ends the jobs whose root was
+        deleted, so that importing the path again starts a new job. The caller commits """
+        cursor.execute("SELECT id, root_id FROM Import_Jobs WHERE status <> %s", (JobStatus.DONE.value,))
+        jobs = cursor.fetchall()
+        if not jobs:
+            return
+        ids = sorted(directory_ids)
+        for start in range(0, len(ids), self.IN_QUERY_CHUNK):
+            chunk = ids[start:start + self.IN_QUERY_CHUNK]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"DELETE FROM Import_Frontier WHERE directory_id IN ({placeholders})", chunk)
+        ended = [job_id for job_id, root_id in jobs if root_id in directory_ids]
+        if ended:
+            placeholders = ", ".join(["%s"] * len(ended))
+            cursor.execute(
+                f"UPDATE Import_Jobs SET status = %s, error = %s, updated = %s WHERE id IN ({placeholders})",
+                [JobStatus.DONE.value, "root deleted from the catalog", time.time(), *ended]
+            )
+
+    # Columns of a catalog dump, what bulk_load needs to rebuild the entries on another machine
+    DUMP_FIELDS = ("path", "type", "size", "mtime", "inode", "content_hash")
+    LOAD_BATCH = 100000  # rows staged per round trip, and per committed step of the set-based statements
+    # Inserts the staged rows of one depth and seq range that are not catalogued yet, with the id of their parent
+    STAGED_INSERT_QUERY = None
+    STAGED_PARENTS_QUERY = None  # links catalogued roots to the loaded entry of their parent path, load_id per %s
+
+    def dump_rows(self, root_path: str = None, batch_size: int = STREAM_BATCH):
+        """ Streams lists of rows in the order of DUMP_FIELDS, of the whole catalog or the subtree of root_path.
+        Parents come before their children """
+        columns = "f.absolute_path, f.type, f.size, f.mtime, f.inode, f.content_hash"
+        if root_path is None:
+            yield from self._stream_rows(f"SELECT {columns} FROM Files_And_Directories f ORDER BY f.id", [],
+                                         batch_size)
+            return
+        root_id = self.find_id(root_path)
+        if root_id is None:
+            return
+        # The recursive CTE produces the subtree a level at a time, so parents are listed first without a sort
+        yield from self._stream_rows(
+            f"{self.SUBTREE_QUERY} SELECT {columns} FROM subtree s JOIN Files_And_Directories f ON f.id = s.id",
+            [root_id], batch_size
+        )
+
+    def bulk_load(self, records, batch_size: int = LOAD_BATCH, progress=None):
+        """ Catalogs the entries of records, tuples in the order of DUMP_FIELDS with absolute paths in any order.
+        They are staged with the fastest bulk path of the backend, then inserted a directory level at a time with
+        set-based statements that look up the id of each parent, which the level before inserted.
+        Paths already catalogued are skipped. progress(step, rows) is called as it goes.
+        Returns {"rows", "staged", "seconds", "rows_per_sec"} """
+        started = time.perf_counter()
+        load_id = time.time_ns()
+        records = iter(records)
+        progress = progress or (lambda step, rows: None)
+        levels = {}  # depth -> [first seq, last seq] staged at that depth
+        with self._load_cursor() as cursor:
+            try:
+                staged = 0
+                for batch in iter(lambda: list(islice(records, batch_size)), []):
+                    rows = [self._staging_row(load_id, staged + i, record) for i, record in enumerate(batch)]
+                    for row in rows:
+                        level = levels.setdefault(row[2], [row[1], row[1]])
+                        level[1] = row[1]
+                    self._stage_rows(cursor, rows)
+                    cursor.connection.commit()
+                    staged += len(rows)
+                    progress("staged", staged)
+
+                inserted = 0
+                for depth in sorted(levels):
+                    first, last = levels[depth]
+                    for start in range(first, last + 1, batch_size):
+                        cursor.execute(self.STAGED_INSERT_QUERY, (load_id, depth, start, start + batch_size))
+                        inserted += max(cursor.rowcount, 0)
+                        cursor.connection.commit()
+                        progress("inserted", inserted)
+                    # Entries whose parent is not catalogued are roots, the next level takes root_id from them
+                    cursor.execute(
+                        "UPDATE Files_And_Directories SET root_id = id WHERE parent_id IS NULL AND root_id IS NULL"
+                    )
+                    cursor.connection.commit()
+                cursor.execute(self.STAGED_PARENTS_QUERY, (load_id,) * self.STAGED_PARENTS_QUERY.count("%s"))
+                relinked = cursor.rowcount > 0
+                cursor.connection.commit()
+                self._rollup_loaded(cursor, load_id, relinked)
+            finally:
+                cursor.connection.rollback()
+                cursor.execute("DELETE FROM Load_Staging WHERE load_id = %s", (load_id,))
+                cursor.connection.commit()
+        self.cache.invalidate()
+        seconds = time.perf_counter() - started
+        return {"rows": inserted, "staged": staged, "seconds": seconds,
+                "rows_per_sec": inserted / seconds if seconds else 0.0}
+
+    def _staging_row(self, load_id: int, seq: int, record):
+        """ Row of Load_Staging for a record in the order of DUMP_FIELDS """
+        path, entry_type, size, mtime, inode, content_hash = record
+        if not os.path.isabs(path):
+            raise ValueError(f"{path} is not an absolute path, a catalog is loaded from absolute paths only")
+        path = path.rstrip(os.sep) or os.sep
+        parent = os.path.dirname(path)
+        # find -printf %y writes d for a directory, everything else is catalogued as a file like the scanner does
+        is_dir = entry_type in (FileType.DIRECTORY.value, "d")
+        depth = path.count(os.sep) if parent != path else 0
+        name = os.path.basename(path) or path
+        return (load_id, seq, depth, name, FileType.DIRECTORY.value if is_dir else FileType.FILE.value, path,
+                self.path_key(path), self.path_key(parent) if parent != path else None, None if is_dir else size,
+                mtime, inode, content_hash, None if is_dir else self.file_extension(name))
+
+    def _stage_rows(self, cursor, rows: list):
+        cursor.executemany(
+            """INSERT INTO Load_Staging (load_id, seq, depth, name, type, absolute_path, path_key, parent_key, size,
+                   mtime, inode, content_hash, extension)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+            rows
+        )
+
+    def _rollup_loaded(self, cursor, load_id: int, relinked: bool = False):
+        """ Rollups of the loaded subtrees, then of the catalogued directories the loaded entries were added to.
+        The summaries of the roots they were loaded under are rebuilt in one pass each rather than row by row.
+        When catalogued roots were relinked below a loaded directory, their subtrees move to its root """
+        cursor.execute(
+            """SELECT f.id, f.type, f.parent_id, f.root_id FROM Load_Staging s
+               JOIN Files_And_Directories f ON f.path_key = s.path_key
+               WHERE s.load_id = %s AND NOT EXISTS (
+                   SELECT 1 FROM Load_Staging t WHERE t.load_id = s.load_id AND t.path_key = s.parent_key)""",
+            (load_id,)
+        )
+        tops = cursor.fetchall()
+        roots = {row[3] for row in tops if row[3] is not None}
+        for entry_id, entry_type, _, root_id in tops:
+            if entry_type == FileType.DIRECTORY.value:
+                self._rollup_subtree(cursor, entry_id)
+                if relinked:
+                    roots |= self._assign_root(cursor, entry_id, root_id)
+        for parent_id in sorted({row[2] for row in tops if row[2] is not None}):
+            self._rollup_directory(cursor, parent_id)
+        self._rebuild_stats(cursor, sorted(roots))
+
+    async def find_duplicates(self, min_size: int = 1, workers: int = HASH_WORKERS):
+        return await asyncio.to_thread(self._find_duplicates, min_size, workers)
+
+    DUPLICATE_CANDIDATES_QUERY = """SELECT f.id, f.absolute_path, f.size, f.content_hash
+                                    FROM Files_And_Directories f
+                                    JOIN (SELECT size FROM Files_And_Directories WHERE type = %s AND size >= %s
+                                          GROUP BY size HAVING COUNT(*) > 1) collisions ON f.size = collisions.size
+                                    WHERE f.type = %s
+                                    ORDER BY f.size"""
+
+    def _find_duplicates(self, min_size: int = 1, workers: int = HASH_WORKERS):
+        """ Stores the content hash of every file that could be a duplicate.
+        Only files sharing their size with another file are read, and of those only the ones whose head and
+        tail sample matches another file's are hashed in full. Hashing runs on workers processes, inline for 0 """
+        started = time.perf_counter()
+        stats = {"candidates": 0, "sampled": 0, "hashed": 0, "unreadable": 0}
+        executor = ProcessPoolExecutor(workers) if workers else None
+        try:
+            groups, pending = [], 0
+            params = (FileType.FILE.value, min_size, FileType.FILE.value)
+            for rows in self._stream_rows(self.DUPLICATE_CANDIDATES_QUERY, params):
+                for row in rows:
+                    if not groups or groups[-1][0][2] != row[2]:
+                        if pending >= self.HASH_BATCH:
+                            self._hash_size_groups(groups, executor, stats)
+                            groups, pending = [], 0
+                        groups.append([])
+                    groups[-1].append(row)
+                    pending += 1
+                    stats["candidates"] += 1
+            self._hash_size_groups(groups, executor, stats)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        stats.update(self.duplicate_summary())
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    def _hash_size_groups(self, groups: list, executor, stats: dict):
+        """ groups are lists of (id, path, size, content_hash) rows of one size each """
+        run = partial(executor.map, chunksize=64) if executor is not None else map
+        unhashed = [row for group in groups for row in group if row[3] is None]
+        samples = dict(zip(
+            (row[0] for row in unhashed),
+            run(_sample_digest, [(row[1], row[2], self.HASH_SAMPLE_BYTES) for row in unhashed])
+        ))
+        stats["sampled"] += len(unhashed)
+
+        updates, full = [], []
+        for group in groups:
+            hashed_before = any(row[3] is not None for row in group)
+            seen = {}
+            for row in group:
+                sample = samples.get(row[0])
+                if sample is not None and not sample[0]:
+                    seen[sample[1]] = seen.get(sample[1], 0) + 1
+            for row in group:
+                sample = samples.get(row[0])
+                if sample is None:
+                    continue
+                complete, digest = sample
+                if digest is None:
+                    stats["unreadable"] += 1
+                elif complete:  # the sample covered the whole file
+                    updates.append((digest, row[0]))
+                elif hashed_before or seen[digest] > 1:
+                    full.append(row)
+
+        for row, digest in zip(full, run(_content_digest, [row[1] for row in full])):
+            if digest is None:
+                stats["unreadable"] += 1
+            else:
+                updates.append((digest, row[0]))
+        stats["hashed"] += len(full)
+
+        if updates:
+            with self._cursor() as cursor:
+                cursor.executemany("UPDATE Files_And_Directories SET content_hash = %s WHERE id = %s", updates)
+                cursor.connection.commit()
+
+    DUPLICATE_GROUPS_QUERY = """SELECT content_hash, MIN(size) AS size, COUNT(*) AS copies FROM Files_And_Directories
+                                WHERE content_hash IS NOT NULL AND type = %s
+                                GROUP BY content_hash HAVING COUNT(*) > 1"""
+
+    def duplicate_summary(self):
+        """ Number of duplicate groups and the bytes deleting all but one copy of each would free """
+        with self._cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*), SUM((copies - 1) * size) FROM ({self.DUPLICATE_GROUPS_QUERY}) AS groups_found",
+                (FileType.FILE.value,)
+            )
+            groups, reclaimable = cursor.fetchone()
+        return {"groups": groups, "reclaimable": int(reclaimable or 0)}
+
+    def duplicate_groups(self, limit: int = 100):
+        """ The groups of identical files found by find_duplicates, the most reclaimable bytes first.
+        Returns dicts of content_hash, size, reclaimable and entries """
+        with self._cursor() as cursor:
+            cursor.execute(f"{self.DUPLICATE_GROUPS_QUERY} ORDER BY (COUNT(*) - 1) * MIN(size) DESC LIMIT %s",
+                           (FileType.FILE.value, limit))
+            groups = {row[0]: {"content_hash": row[0], "size": row[1], "reclaimable": (row[2] - 1) * row[1],
+                               "entries": []} for row in cursor.fetchall()}
+            if groups:
+                placeholders = ", ".join(["%s"] * len(groups))
+                cursor.execute(
+                    f"""SELECT {self.ENTRY_COLUMNS}, f.content_hash
+                        FROM Files_And_Directories f
+                        LEFT JOIN Files_And_Directories p ON f.parent_id = p.id
+                        WHERE f.content_hash IN ({placeholders}) AND f.type = %s
+                        ORDER BY f.id""",
+                    list(groups) + [FileType.FILE.value]
+                )
+                for row in cursor.fetchall():
+                    groups[row[-1]]["entries"].append(self._entry_from_row(row))
+        return list(groups.values())
+
+    ANCESTORS_QUERY = """WITH RECURSIVE ancestors (id, parent_id) AS (
+                             SELECT id, parent_id FROM Files_And_Directories WHERE id = %s
+                             UNION ALL
+                             SELECT f.id, f.parent_id FROM Files_And_Directories f
+                             JOIN ancestors a ON f.id = a.parent_id
+                         )
+                         SELECT id FROM ancestors"""
+
+    def _adjust_ancestors(self, cursor, directory_id: int, size_delta: int, count_delta: int):
+        """ Moves the rollups of directory_id and every directory above it, the caller commits """
+        if not size_delta and not count_delta:
+            return
+        cursor.execute(self.ANCESTORS_QUERY, (directory_id,))
+        ids = [row[0] for row in cursor.fetchall()]
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor.execute(
+            f"""UPDATE Files_And_Directories SET total_size = total_size + %s, file_count = file_count + %s
+                WHERE id IN ({placeholders})""",
+            [size_delta, count_delta] + ids
+        )
+
+    def _rollup_subtree(self, cursor, root_id: int):
+        """ Recomputes total_size and file_count of every directory under root_id bottom-up in one pass,
+        then moves the directories above root_id by the change of its totals """
+        cursor.execute("SELECT parent_id, type, total_size, file_count FROM Files_And_Directories WHERE id = %s",
+                       (root_id,))
+        root = cursor.fetchone()
+        if root is None or root[1] != FileType.DIRECTORY.value:
+            return
+
+        cursor.execute(
+            f"""{self.SUBTREE_QUERY} SELECT f.id, f.parent_id, s.depth, f.total_size, f.file_count FROM subtree s
+                JOIN Files_And_Directories f ON f.id = s.id WHERE f.type = %s""",
+            (root_id, FileType.DIRECTORY.value)
+        )
+        directories = sorted(cursor.fetchall(), key=lambda row: row[2], reverse=True)
+        totals = {row[0]: [0, 0] for row in directories}
+        stored = {row[0]: (row[3], row[4]) for row in directories}
+        cursor.execute(
+            f"""{self.SUBTREE_QUERY} SELECT f.parent_id, SUM(COALESCE(f.size, 0)), COUNT(*) FROM subtree s
+                JOIN Files_And_Directories f ON f.id = s.id WHERE f.type = %s GROUP BY f.parent_id""",
+            (root_id, FileType.FILE.value)
+        )
+        for directory_id, size, count in cursor.fetchall():
+            totals[directory_id][0] += int(size)
+            totals[directory_id][1] += count
+        for directory_id, parent_id, *_ in directories:  # deepest first, children are complete before their parent
+            if directory_id != root_id:
+                totals[parent_id][0] += totals[directory_id][0]
+                totals[parent_id][1] += totals[directory_id][1]
+
+        moved = [(size, count, directory_id) for directory_id, (size, count) in totals.items()
+                 if stored[directory_id] != (size, count)]
+        if not moved:
+            return
+        cursor.executemany("UPDATE Files_And_Directories SET total_size = %s, file_count = %s WHERE id = %s", moved)
+        if root[0] is not None:
+            self._adjust_ancestors(cursor, root[0], totals[root_id][0] - (root[2] or 0),
+                                   totals[root_id][1] - (root[3] or 0))
+        cursor.connection.commit()
+        self.cache.invalidate("listing", "page")  # the rollups change no count
+
+    def _rollup_directory(self, cursor, directory_id: int):
+        """ Recomputes the rollups of one directory from its children, which must be up to date """
+        cursor.execute("SELECT parent_id, total_size, file_count FROM Files_And_Directories WHERE id = %s",
+                       (directory_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return
+        cursor.execute("SELECT SUM(total_size), SUM(file_count) FROM Files_And_Directories WHERE parent_id = %s",
+                       (directory_id,))
+        size, count = cursor.fetchone()
+        size, count = int(size or 0), int(count or 0)
+        if (size, count) == (row[1], row[2]):
+            return
+        cursor.execute("UPDATE Files_And_Directories SET total_size = %s, file_count = %s WHERE id = %s",
+                       (size, count, directory_id))
+        if row[0] is not None:
+            self._adjust_ancestors(cursor, row[0], size - (row[1] or 0), count - (row[2] or 0))
+        cursor.connection.commit()
+        self.cache.invalidate("listing", "page")
+
+    def _rebuild_rollups(self, cursor):
+        """ Fills the rollups of a catalog created before they existed """
+        cursor.execute(
+            "UPDATE Files_And_Directories SET total_size = COALESCE(size, 0), file_count = 1 WHERE type = %s",
+            (FileType.FILE.value,)
+        )
+        cursor.execute("SELECT id FROM Files_And_Directories WHERE parent_id IS NULL AND type = %s",
+                       (FileType.DIRECTORY.value,))
+        for (root_id,) in cursor.fetchall():
+            self._rollup_subtree(cursor, root_id)
+        cursor.connection.commit()
+
+    # Lower bounds in bytes of the buckets of size_histogram, bucket 0 holds the empty files
+    SIZE_BUCKETS = (1, 4 * 1024, 64 * 1024, 1024 ** 2, 16 * 1024 ** 2, 256 * 1024 ** 2, 1024 ** 3, 16 * 1024 ** 3)
+    EXTENSION_LENGTH = 32
+    # Adds files and bytes to a row of Root_Extension_Stats or Root_Size_Stats, {key} is extension or bucket
+    STATS_UPSERT_QUERY = None
+    ROOT_FILL_QUERY = None  # gives the entries below an entry with a root_id that root_id, a level per run
+
+    @classmethod
+    def file_extension(cls, name: str):
+        """ Lower case extension of a file name without the dot, "" when it has none """
+        return os.path.splitext(name)[1][1:].lower()[:cls.EXTENSION_LENGTH]
+
+    @classmethod
+    def size_bucket(cls, size: int):
+        return bisect_right(cls.SIZE_BUCKETS, size or 0)
+
+    @classmethod
+    def _size_bucket_sql(cls):
+        """ size_bucket of the size column as an SQL expression """
+        cases = " ".join(f"WHEN COALESCE(size, 0) < {bound} THEN {i}" for i, bound in enumerate(cls.SIZE_BUCKETS))
+        return f"CASE {cases} ELSE {len(cls.SIZE_BUCKETS)} END"
+
+    @classmethod
+    def _root_ids(cls, cursor, entry_ids):
+        """ root_id of each of entry_ids """
+        ids = [entry_id for entry_id in entry_ids if entry_id is not None]
+        roots = {}
+        for start in range(0, len(ids), cls.IN_QUERY_CHUNK):
+            chunk = ids[start:start + cls.IN_QUERY_CHUNK]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT id, root_id FROM Files_And_Directories WHERE id IN ({placeholders})", chunk)
+            roots.update(cursor.fetchall())
+        return roots
+
+    def _adjust_stats(self, cursor, files, sign: int = 1):
+        """ Adds files, (root_id, extension, size) rows, to the summaries of their roots, or removes them for sign -1.
+        The rows are folded into one upsert per root and extension or bucket. The caller commits """
+        totals = {"Root_Extension_Stats": {}, "Root_Size_Stats": {}}
+        for root_id, extension, size in files:
+            if root_id is None:
+                continue
+            size = size or 0
+            for table, key in (("Root_Extension_Stats", extension or ""), ("Root_Size_Stats", self.size_bucket(size))):
+                counts = totals[table].setdefault((root_id, key), [0, 0])
+                counts[0] += sign
+                counts[1] += sign * size
+        for table, counts in totals.items():
+            if not counts:
+                continue
+            key = "extension" if table == "Root_Extension_Stats" else "bucket"
+            # Sorted, so that concurrent import writers lock the rows in the same order
+            cursor.executemany(self.STATS_UPSERT_QUERY.format(table=table, key=key),
+                               [(root_id, value, files, size)
+                                for (root_id, value), (files, size) in sorted(counts.items())])
+            if sign < 0:
+                cursor.executemany(f"DELETE FROM {table} WHERE root_id = %s AND files <= 0",
+                                   [(root_id,) for root_id in {root_id for root_id, _ in counts}])
+
+    def _rebuild_stats(self, cursor, root_ids: list = None):
+        """ Recomputes the summaries of root_ids, of every root when None, from the catalog """
+        if root_ids is not None and len(root_ids) > self.IN_QUERY_CHUNK:
+            for start in range(0, len(root_ids), self.IN_QUERY_CHUNK):
+                self._rebuild_stats(cursor, root_ids[start:start + self.IN_QUERY_CHUNK])
+            return
+        if root_ids is not None and not root_ids:
             return
-        self.cursor.execute("SELECT id FROM Files_And_Directories WHERE parent_id = %s", (parent_id,))
-        child_ids = [row[0] for row in self.cursor.fetchall()]
-        for child_id in child_ids:
-             self._delete_directory(child_id)
-        self.cursor.execute("DELETE FROM Files_And_Directories WHERE id = %s", (parent_id,))
-        self.connection.commit()
+        in_roots, roots, params = "", "", [FileType.FILE.value]
+        if root_ids is not None:
+            in_roots = f"root_id IN ({', '.join(['%s'] * len(root_ids))})"
+            roots, params = f"AND {in_roots}", params + list(root_ids)
+        for table in ("Root_Extension_Stats", "Root_Size_Stats"):
+            cursor.execute(f"DELETE FROM {table} WHERE {in_roots}" if in_roots else f"DELETE FROM {table}", params[1:])
+        cursor.execute(
+            f"""INSERT INTO Root_Extension_Stats (root_id, extension, files, bytes)
+                SELECT root_id, COALESCE(extension, ''), COUNT(*), SUM(COALESCE(size, 0)) FROM Files_And_Directories
+                WHERE type = %s AND root_id IS NOT NULL {roots} GROUP BY root_id, COALESCE(extension, '')""",
+            params
+        )
+        bucket = self._size_bucket_sql()
+        cursor.execute(
+            f"""INSERT INTO Root_Size_Stats (root_id, bucket, files, bytes)
+                SELECT root_id, {bucket}, COUNT(*), SUM(COALESCE(size, 0)) FROM Files_And_Directories
+                WHERE type = %s AND root_id IS NOT NULL {roots} GROUP BY root_id, {bucket}""",
+            params
+        )
+        cursor.connection.commit()
+
+    def _assign_root(self, cursor, entry_id: int, root_id: int):
+        """ Gives the subtree of entry_id root_id and returns the roots it was under before """
+        cursor.execute(
+            f"""{self.SUBTREE_QUERY} SELECT f.id, f.root_id FROM subtree s JOIN Files_And_Directories f ON f.id = s.id
+                WHERE f.root_id IS NULL OR f.root_id <> %s""",
+            (entry_id, root_id)
+        )
+        rows = cursor.fetchall()
+        for start in range(0, len(rows), self.IN_QUERY_CHUNK):
+            chunk = [row[0] for row in rows[start:start + self.IN_QUERY_CHUNK]]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"UPDATE Files_And_Directories SET root_id = %s WHERE id IN ({placeholders})",
+                           [root_id] + chunk)
+        cursor.connection.commit()
+        return {row[1] for row in rows if row[1] is not None}
+
+    def _fill_stats(self, cursor, chunk: int = PATH_KEY_CHUNK):
+        """ Fills extension and root_id of a catalog created before the summaries existed, then builds them """
+        cursor.execute("SELECT MIN(id), MAX(id) FROM Files_And_Directories")
+        low, high = cursor.fetchone()
+        for start in range(low or 0, (high or -1) + 1, chunk):
+            cursor.execute(
+                "SELECT id, name FROM Files_And_Directories WHERE id >= %s AND id < %s AND type = %s",
+                (start, start + chunk, FileType.FILE.value)
+            )
+            rows = [(row_id, self.file_extension(name)) for row_id, name in cursor.fetchall()]
+            for part in range(0, len(rows), self.IN_QUERY_CHUNK):
+                self._set_by_id(cursor, "extension", rows[part:part + self.IN_QUERY_CHUNK])
+            cursor.connection.commit()
+        cursor.execute("UPDATE Files_And_Directories SET root_id = id WHERE parent_id IS NULL")
+        cursor.connection.commit()
+        while True:  # one level of the trees per run
+            cursor.execute(self.ROOT_FILL_QUERY)
+            filled = cursor.rowcount
+            cursor.connection.commit()
+            if filled <= 0:
+                break
+        self._rebuild_stats(cursor)
+
+    def root_stats(self):
+        """ (id, path, total_size, file_count) of the roots of the catalog, the largest first """
+        with self._cursor() as cursor:
+            cursor.execute(
+                """SELECT id, absolute_path, total_size, file_count FROM Files_And_Directories
+                   WHERE parent_id IS NULL AND type = %s ORDER BY total_size DESC""",
+                (FileType.DIRECTORY.value,)
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def extension_stats(self, root_id: int = None, limit: int = 20):
+        """ (extension, files, bytes) of the extensions taking the most bytes under root_id, or in the whole
+        catalog. Files without an extension are counted under "" """
+        with self._cursor() as cursor:
+            if root_id is None:
+                cursor.execute(
+                    """SELECT extension, SUM(files), SUM(bytes) FROM Root_Extension_Stats
+                       GROUP BY extension ORDER BY SUM(bytes) DESC LIMIT %s""",
+                    (limit,)
+                )
+            else:
+                cursor.execute(
+                    """SELECT extension, files, bytes FROM Root_Extension_Stats WHERE root_id = %s
+                       ORDER BY bytes DESC LIMIT %s""",
+                    (root_id, limit)
+                )
+            return [(extension, int(files), int(size)) for extension, files, size in cursor.fetchall()]
+
+    def size_histogram(self, root_id: int = None):
+        """ (smallest size, files, bytes) of every bucket of SIZE_BUCKETS under root_id, or in the whole catalog,
+        the smallest sizes first """
+        with self._cursor() as cursor:
+            if root_id is None:
+                cursor.execute("SELECT bucket, SUM(files), SUM(bytes) FROM Root_Size_Stats GROUP BY bucket")
+            else:
+                cursor.execute("SELECT bucket, files, bytes FROM Root_Size_Stats WHERE root_id = %s", (root_id,))
+            counts = {bucket: (int(files), int(size)) for bucket, files, size in cursor.fetchall()}
+        return [(bound,) + counts.get(bucket, (0, 0)) for bucket, bound in enumerate((0,) + self.SIZE_BUCKETS)]
+
+    def largest_files(self, root_id: int = None, limit: int = 20, extension: str = None):
+        """ The largest files under root_id, or in the whole catalog, of one extension when given.
+        Read in order from the (root_id, extension, size) and (root_id, size) indexes, so they stop after limit rows """
+        conditions, params = ["f.type = %s"], [FileType.FILE.value]
+        if root_id is not None:
+            conditions.append("f.root_id = %s")
+            params.append(root_id)
+        if extension is not None:
+            conditions.append("f.extension = %s")
+            params.append(extension.lstrip(".").lower())
+        with self._cursor() as cursor:
+            cursor.execute(
+                f"""SELECT {self.ENTRY_COLUMNS} FROM Files_And_Directories f
+                    LEFT JOIN Files_And_Directories p ON f.parent_id = p.id
+                    WHERE {" AND ".join(conditions)} ORDER BY f.size DESC LIMIT %s""",
+                params + [limit]
+            )
+            return [self._entry_from_row(row) for row in cursor.fetchall()]
 
     def update(self, entry: FileEntry):
-        query = """UPDATE Files_And_Directories SET name = %s WHERE id = %s"""
-        self.cursor.execute(query, (entry.name, entry.id))
-        self.connection.commit()
+        query = """UPDATE Files_And_Directories SET name = %s, extension = %s WHERE id = %s"""
+        with self._cursor() as cursor:
+            cursor.execute("SELECT type, root_id, extension, size FROM Files_And_Directories WHERE id = %s",
+                           (entry.id,))
+            row = cursor.fetchone()
+            is_file = row is not None and row[0] == FileType.FILE.value
+            extension = self.file_extension(entry.name) if is_file else None
+            cursor.execute(query, (entry.name, extension, entry.id))
+            if is_file and extension != row[2]:  # a rename moves the file to the summary of its new extension
+                self._adjust_stats(cursor, [row[1:]], -1)
+                self._adjust_stats(cursor, [(row[1], extension, row[3])])
+            cursor.connection.commit()
+        self.cache.invalidate()
 
     def delete(self, entry: FileEntry):
         query = """DELETE FROM Files_And_Directories WHERE id = %s"""
-        self.cursor.execute(query, (entry.id,))
-        self.connection.commit()
+        with self._cursor() as cursor:
+            cursor.execute(
+                """SELECT parent_id, total_size, file_count, type, root_id, extension, size FROM Files_And_Directories
+                   WHERE id = %s""",
+                (entry.id,)
+            )
+            row = cursor.fetchone()
+            cursor.execute(query, (entry.id,))
+            if row is not None and row[0] is not None:
+                self._adjust_ancestors(cursor, row[0], -(row[1] or 0), -(row[2] or 0))
+            if row is not None and row[3] == FileType.FILE.value:
+                self._adjust_stats(cursor, [row[4:]], -1)
+            cursor.connection.commit()
+        if row is not None:
+            self.cache.invalidate()
 
     def close(self):
-        self.cursor.close()
-        self.connection.close()
+        self.pool.close()
+
+    def hash_path(self,path):
+        return hashlib.sha256(path.encode()).hexdigest()
+
+    @staticmethod
+    def path_key(path: str):
+        """ BLAKE2b digest of PATH_KEY_SIZE bytes, the unique key of an entry in the catalog.
+        surrogateescape keys undecodable file names too, at a third of the cost of os.fsencode """
+        key = hashlib.blake2b(path.encode("utf-8", "surrogateescape"), digest_size=CatalogStorage.PATH_KEY_SIZE)
+        return key.digest()
+
+    @classmethod
+    def migrate_path_keys(cls, cursor, chunk: int = PATH_KEY_CHUNK, pause: float = 0.0, finalize: bool = True,
+                          progress=None):
+        """ Moves a catalog keyed by the hex absolute_path_hash to path_key. The new column is filled in committed
+        chunks of ids, so other connections keep reading and writing the table meanwhile; finalize then makes it the
+        unique key and drops the old column. Returns the rows filled, None when there is nothing to migrate """
+        columns = cls._table_columns(cursor)
+        if "absolute_path_hash" not in columns:
+            return None
+        if "path_key" not in columns:
+            cursor.execute(f"ALTER TABLE Files_And_Directories ADD COLUMN path_key {cls.PATH_KEY_TYPE} DEFAULT NULL")
+            cursor.connection.commit()
+
+        filled = 0
+        while True:  # until nothing is left, an older version may still insert rows without a key meanwhile
+            cursor.execute("SELECT MIN(id), MAX(id) FROM Files_And_Directories WHERE path_key IS NULL")
+            low, high = cursor.fetchone()
+            if low is None:
+                break
+            for start in range(low, high + 1, chunk):
+                cursor.execute(
+                    """SELECT id, absolute_path FROM Files_And_Directories
+                       WHERE id >= %s AND id < %s AND path_key IS NULL""",
+                    (start, start + chunk)
+                )
+                rows = cursor.fetchall()
+                for part in range(0, len(rows), cls.IN_QUERY_CHUNK):
+                    cls._fill_path_keys(cursor, rows[part:part + cls.IN_QUERY_CHUNK])
+                cursor.connection.commit()
+                filled += len(rows)
+                if progress is not None:
+                    progress(filled, min(start + chunk - 1, high), high)
+                if pause:
+                    time.sleep(pause)  # leaves the server room for the regular load
+
+        if finalize:
+            cls._finalize_path_keys(cursor)
+        return filled
+
+    @classmethod
+    def _fill_path_keys(cls, cursor, rows: list):
+        """ One UPDATE for a chunk of (id, path) rows """
+        cls._set_by_id(cursor, "path_key", [(row_id, cls.path_key(path)) for row_id, path in rows])
+
+    @staticmethod
+    def _set_by_id(cursor, column: str, rows: list):
+        """ Sets column of a chunk of (id, value) rows in one UPDATE """
+        if not rows:
+            return
+        cases = " ".join(["WHEN %s THEN %s"] * len(rows))
+        placeholders = ", ".join(["%s"] * len(rows))
+        params = [value for row in rows for value in row]
+        cursor.execute(
+            f"UPDATE Files_And_Directories SET {column} = CASE id {cases} END WHERE id IN ({placeholders})",
+            params + [row_id for row_id, _ in rows]
+        )
+
+    @classmethod
+    @abstractmethod
+    def _table_columns(cls, cursor):
+        """ Lower case column names of Files_And_Directories """
+
+    @classmethod
+    @abstractmethod
+    def _finalize_path_keys(cls, cursor):
+        """ Makes the filled path_key the unique key and drops absolute_path_hash """
+
+    @abstractmethod
+    def _connect(self):
+        """ New DB-API connection for the pool """
+
+    def ensure_connection(self):
+        """ Raises when the database cannot be reached. Pooled connections are health checked on checkout """
+        if self.error_code != Errors.EVERYTHING_IS_FINE:
+            raise ConnectionError(f"Database unavailable: {self.error_code.value}")
+        with self.pool.connection():
+            pass
+
+
+@instrument_methods
+class DatabaseManager(CatalogStorage):
+    """ Catalog stored on a MySQL server """
+    INSERT_ROWS_QUERY = """INSERT IGNORE INTO Files_And_Directories (name, type, parent_id, absolute_path, size, path_key, mtime, inode, total_size, file_count, extension, root_id) 
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+    STREAMING_CURSOR = pymysql.cursors.SSCursor
+    PATH_KEY_TYPE = f"BINARY({CatalogStorage.PATH_KEY_SIZE})"
+    CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+    JOB_SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS Import_Jobs (
+            id INT PRIMARY KEY AUTO_INCREMENT,
+            root_path TEXT NOT NULL,
+            parent_id INT NULL,
+            root_id INT NULL,
+            status VARCHAR(16) NOT NULL,
+            rows_inserted BIGINT NOT NULL DEFAULT 0,
+            completed_dirs BIGINT NOT NULL DEFAULT 0,
+            started DOUBLE NOT NULL,
+            updated DOUBLE NOT NULL,
+            error TEXT NULL,
+            INDEX idx_status (status)
+        );""",
+        """CREATE TABLE IF NOT EXISTS Import_Frontier (
+            job_id INT NOT NULL,
+            directory_id INT NOT NULL,
+            absolute_path TEXT NOT NULL,
+            PRIMARY KEY (job_id, directory_id),
+            FOREIGN KEY (job_id) REFERENCES Import_Jobs(id) ON DELETE CASCADE
+        );""",
+    ]
+    # Files and bytes per root by extension and by size bucket, kept in step with every insert and delete
+    STATS_SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS Root_Extension_Stats (
+            root_id INT NOT NULL,
+            extension VARCHAR(32) NOT NULL,
+            files BIGINT NOT NULL,
+            bytes BIGINT NOT NULL,
+            PRIMARY KEY (root_id, extension)
+        );""",
+        """CREATE TABLE IF NOT EXISTS Root_Size_Stats (
+            root_id INT NOT NULL,
+            bucket INT NOT NULL,
+            files BIGINT NOT NULL,
+            bytes BIGINT NOT NULL,
+            PRIMARY KEY (root_id, bucket)
+        );""",
+    ]
+    STATS_UPSERT_QUERY = """INSERT INTO {table} (root_id, {key}, files, bytes) VALUES (%s, %s, %s, %s)
+                            ON DUPLICATE KEY UPDATE files = files + VALUES(files), bytes = bytes + VALUES(bytes)"""
+    ROOT_FILL_QUERY = """UPDATE Files_And_Directories f JOIN Files_And_Directories p ON p.id = f.parent_id
+                         SET f.root_id = p.root_id WHERE f.root_id IS NULL AND p.root_id IS NOT NULL"""
+    # Rows of a bulk_load on their way into the catalog, parent_key is the path_key of the parent path
+    STAGING_SCHEMA = f"""CREATE TABLE IF NOT EXISTS Load_Staging (
+            load_id BIGINT NOT NULL,
+            seq BIGINT NOT NULL,
+            depth INT NOT NULL,
+            name VARCHAR(255) NOT NULL,
+            type ENUM('file', 'directory') NOT NULL,
+            absolute_path TEXT NOT NULL,
+            path_key {PATH_KEY_TYPE} NOT NULL,
+            parent_key {PATH_KEY_TYPE} NULL,
+            size BIGINT NULL,
+            mtime DOUBLE NULL,
+            inode BIGINT UNSIGNED NULL,
+            content_hash CHAR(64) NULL,
+            extension VARCHAR(32) NULL,
+            PRIMARY KEY (load_id, seq),
+            INDEX idx_load_depth (load_id, depth, seq),
+            INDEX idx_load_path_key (load_id, path_key)
+        );"""
+    LOAD_STAGING_QUERY = """LOAD DATA LOCAL INFILE %s INTO TABLE Load_Staging CHARACTER SET utf8mb4
+                            (load_id, seq, depth, name, type, absolute_path, @path_key, @parent_key, size, mtime,
+                             inode, content_hash, extension)
+                            SET path_key = UNHEX(@path_key), parent_key = UNHEX(@parent_key)"""
+    LOCAL_INFILE_ERRORS = (1148, 2068, 3948)  # LOAD DATA LOCAL turned off on the server or the client
+    STAGED_INSERT_QUERY = """INSERT IGNORE INTO Files_And_Directories (name, type, parent_id, absolute_path, path_key, size, mtime, inode, content_hash, total_size, file_count, extension, root_id)
+                             SELECT s.name, s.type, p.id, s.absolute_path, s.path_key, s.size, s.mtime, s.inode,
+                                    s.content_hash, IF(s.type = 'file', COALESCE(s.size, 0), 0), IF(s.type = 'file', 1, 0),
+                                    s.extension, p.root_id
+                             FROM Load_Staging s LEFT JOIN Files_And_Directories p ON p.path_key = s.parent_key
+                             WHERE s.load_id = %s AND s.depth = %s AND s.seq >= %s AND s.seq < %s ORDER BY s.seq"""
+    # STRAIGHT_JOIN starts from the few roots rather than from every staged row
+    STAGED_PARENTS_QUERY = """UPDATE Files_And_Directories f
+                              STRAIGHT_JOIN Load_Staging s ON s.load_id = %s AND s.path_key = f.path_key
+                              STRAIGHT_JOIN Files_And_Directories p ON p.path_key = s.parent_key
+                              SET f.parent_id = p.id
+                              WHERE f.parent_id IS NULL"""
+    SCHEMA_INDEXES = {
+        "ft_name_path": "FULLTEXT INDEX ft_name_path (name, absolute_path) WITH PARSER ngram",
+        # Keyset pages sorted by name or size read these indexes in order and stop after one page
+        "idx_name_id": "INDEX idx_name_id (name, id)",
+        "idx_size_id": "INDEX idx_size_id (size, id)",
+        "idx_content_hash": "INDEX idx_content_hash (content_hash)",
+        "idx_total_size_id": "INDEX idx_total_size_id (total_size, id)",
+        # largest_files reads these backwards and stops after one page, _rebuild_stats scans them per root
+        "idx_root_size": "INDEX idx_root_size (root_id, size)",
+        "idx_root_extension_size": "INDEX idx_root_extension_size (root_id, extension, size)",
+    }
+
+    def __init__(self, host: str, port: int, user: str, passwd: str, database: str):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd =passwd
+        self.database = database
+        self.local_infile = True  # until the server refuses LOAD DATA LOCAL INFILE
+        super().__init__()
+
+        try:
+            self.selfcheck(host, port, user, passwd, database)
+            with self.pool.connection():
+                pass
+        except pymysql.err.OperationalError as e:
+            if e.args[0] == 1045:
+                self.error_code = Errors.AUTH_ERROR
+
+            elif e.args[0] == 2003:
+                self.error_code = Errors.CONNECTION_ERROR
+
+            else:
+                self.error_code = Errors.SOMETHING_WENT_WRONG
+        except Exception as e:
+            if e.args[0] == 1045:
+                self.error_code = Errors.AUTH_ERROR
+            else:
+                self.error_code = Errors.SOMETHING_WENT_WRONG
+
+    NGRAM_TOKEN_SIZE = 2
+    FULLTEXT_COLUMNS = "f.name, f.absolute_path"
+
+    def _search_clause(self, keyword_string, match_all: bool = False):
+        """ WHERE condition and relevance expression of a keyword search, None when there is nothing to search.
+        The ngram index matches keywords anywhere inside names and paths, so prefixes match as well """
+        terms = []
+        for keyword in (keyword_string or "").split():
+            keyword = keyword.replace('"', "")
+            if len(keyword) >= self.NGRAM_TOKEN_SIZE:
+                term = f'"{keyword}"'
+            elif keyword.isalnum():
+                term = f"{keyword}*"  # shorter than a token, matches the tokens starting with it
+            else:
+                continue
+            terms.append(f"+{term}" if match_all else term)
+        if not terms:
+            return None
+
+        boolean_query = " ".join(terms)
+        relevance = f"MATCH({self.FULLTEXT_COLUMNS}) AGAINST (%s IN BOOLEAN MODE)"
+        return {"condition": relevance, "params": [boolean_query],
+                "relevance": relevance, "relevance_params": [boolean_query]}
+
+    def _interrupt(self, connection):
+        thread_id = connection.thread_id()
+        try:
+            with self._cursor() as cursor:
+                cursor.execute("KILL QUERY %s", (thread_id,))
+        except pymysql.err.MySQLError as e:
+            print(f"⚠️ Could not interrupt query {thread_id}: {e}")
 
     def selfcheck(self, host: str, port: int, user: str, passwd: str, database: str):
         test = pymysql.connect(host=host, port=port, user=user, passwd=passwd)
@@ -230,36 +1997,885 @@ class DatabaseManager:
         test.commit()
         test_cursor.execute(f"USE {database};")
         test_cursor.execute(
-            """CREATE TABLE IF NOT EXISTS Files_And_Directories (
+            f"""CREATE TABLE IF NOT EXISTS Files_And_Directories (
                 id INT PRIMARY KEY AUTO_INCREMENT,
                 name VARCHAR(255) NOT NULL,
                 type ENUM('file', 'directory') NOT NULL,
                 parent_id INT NULL,
                 absolute_path TEXT NOT NULL,
                 size BIGINT DEFAULT NULL,
-                absolute_path_hash VARCHAR(64) NOT NULL UNIQUE,
+                path_key {self.PATH_KEY_TYPE} NOT NULL UNIQUE,
                 FOREIGN KEY (parent_id) REFERENCES Files_And_Directories(id),
                 INDEX idx_parent_id (parent_id)
             );"""
         )
+        for statement in self.JOB_SCHEMA + self.STATS_SCHEMA:
+            test_cursor.execute(statement)
+        test_cursor.execute(self.STAGING_SCHEMA)
+        test.commit()
+        self._migrate_schema(test_cursor, database)
         test.commit()
         test_cursor.close()
         test.close()
 
-    def hash_path(self,path):
-        return hashlib.sha256(path.encode()).hexdigest()
+    def _migrate_schema(self, cursor, database: str):
+        existing = self._table_columns(cursor)
+        added = [column for column in self.SCHEMA_COLUMNS if column not in existing]
+        for column in added:
+            cursor.execute(f"ALTER TABLE Files_And_Directories ADD COLUMN {column} {self.SCHEMA_COLUMNS[column]}")
+        cursor.connection.commit()
+        if "absolute_path_hash" in existing:
+            print("⚠️ Moving the catalog to binary path keys, see migrate_path_keys.py to do this ahead of time")
+            self.migrate_path_keys(cursor)
 
-    def ensure_connection(self):
+        cursor.execute(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+            (database, "Files_And_Directories")
+        )
+        existing = {row[0].lower() for row in cursor.fetchall()}
+        for index, definition in self.SCHEMA_INDEXES.items():
+            if index not in existing:
+                if "FULLTEXT" in definition:
+                    # The default stopword list would drop every ngram containing words like "a" or "to"
+                    cursor.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+                cursor.execute(f"ALTER TABLE Files_And_Directories ADD {definition}")
+        if "total_size" in added:
+            self._rebuild_rollups(cursor)
+        if "root_id" in added:
+            # Staged rows carry the extension since, the rows of an interrupted older load are of no use anyway
+            cursor.execute("DROP TABLE IF EXISTS Load_Staging")
+            cursor.execute(self.STAGING_SCHEMA)
+            self._fill_stats(cursor)
+
+    @classmethod
+    def _table_columns(cls, cursor):
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            ("Files_And_Directories",)
+        )
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    @classmethod
+    def _finalize_path_keys(cls, cursor):
+        # One in-place rebuild under the weakest lock the server allows: writes go on unless the FULLTEXT index
+        # asks for a shared lock. Rows an older version inserts meanwhile would fail NOT NULL, so stop those first
+        cursor.execute(
+            f"""ALTER TABLE Files_And_Directories MODIFY path_key {cls.PATH_KEY_TYPE} NOT NULL, ADD UNIQUE (path_key),
+                   DROP COLUMN absolute_path_hash, ALGORITHM=INPLACE"""
+        )
+        cursor.connection.commit()
+
+    def _stage_rows(self, cursor, rows: list):
+        """ Stages rows through a tab separated file and LOAD DATA LOCAL INFILE, which parses them on the server
+        many times faster than INSERT statements. Falls back to INSERT when the server does not allow it """
+        if not self.local_infile:
+            return super()._stage_rows(cursor, rows)
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", delete=False) as staging_file:
+            for row in rows:
+                staging_file.write("\t".join(self._infile_field(value) for value in row) + "\n")
         try:
-            self.connection.ping(reconnect=True)
-        except pymysql.err.OperationalError:
-            print("🔄 Reconnecting to the database...")
-            self.connection = pymysql.connect(
-                host=self.host, port=self.port, user=self.user, passwd=self.passwd, db=self.database
-            )
-            self.cursor = self.connection.cursor()
+            cursor.execute(self.LOAD_STAGING_QUERY, (staging_file.name,))
+        except pymysql.err.MySQLError as e:
+            if e.args[0] not in self.LOCAL_INFILE_ERRORS:
+                raise
+            print(f"⚠️ LOAD DATA LOCAL INFILE is not allowed ({e.args[1]}), staging rows with INSERT instead. "
+                  "SET GLOBAL local_infile = 1 on the server makes loading faster")
+            self.local_infile = False
+            super()._stage_rows(cursor, rows)
+        finally:
+            os.remove(staging_file.name)
+
+    @staticmethod
+    def _infile_field(value):
+        """ Field of a LOAD DATA file with the default escaping, binary keys as hex for UNHEX """
+        if value is None:
+            return "\\N"
+        if isinstance(value, bytes):
+            return value.hex()
+        if isinstance(value, str):
+            return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+        return repr(value)
+
+    @contextmanager
+    def _load_cursor(self):
+        """ LOAD DATA LOCAL INFILE lets the server ask for any file the client can read,
+        so it is allowed on a connection of its own that is closed after the load rather than on the pool """
+        connection = self._open_connection(local_infile=True)
+        try:
+            with self._attached(connection):
+                cursor = connection.cursor()
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+        finally:
+            connection.close()
+
+    def _connect(self, local_infile: bool = False):
+        return pymysql.connect(host=self.host, port=self.port, user=self.user, passwd=self.passwd, db=self.database,
+                               local_infile=local_infile)
+
+
+@instrument_methods
+class SQLiteDatabaseManager(CatalogStorage):
+    """ Catalog stored in a local SQLite file, for single workstation installs without a server.
+    Same table and indexes as the MySQL catalog, keyword search through an FTS5 trigram index """
+    INSERT_ROWS_QUERY = """INSERT OR IGNORE INTO Files_And_Directories (name, type, parent_id, absolute_path, size, path_key, mtime, inode, total_size, file_count, extension, root_id) 
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS Files_And_Directories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL CHECK (type IN ('file', 'directory')),
+            parent_id INTEGER NULL REFERENCES Files_And_Directories(id),
+            absolute_path TEXT NOT NULL,
+            size INTEGER DEFAULT NULL,
+            path_key BLOB NOT NULL UNIQUE
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_parent_id ON Files_And_Directories (parent_id)",
+        # External content index, kept in step with the table by the triggers below
+        """CREATE VIRTUAL TABLE IF NOT EXISTS ft_name_path USING fts5(
+            name, absolute_path, content='Files_And_Directories', content_rowid='id', tokenize='trigram'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS ft_name_path_insert AFTER INSERT ON Files_And_Directories BEGIN
+            INSERT INTO ft_name_path (rowid, name, absolute_path) VALUES (new.id, new.name, new.absolute_path);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS ft_name_path_delete AFTER DELETE ON Files_And_Directories BEGIN
+            INSERT INTO ft_name_path (ft_name_path, rowid, name, absolute_path)
+            VALUES ('delete', old.id, old.name, old.absolute_path);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS ft_name_path_update AFTER UPDATE OF name, absolute_path ON Files_And_Directories
+        BEGIN
+            INSERT INTO ft_name_path (ft_name_path, rowid, name, absolute_path)
+            VALUES ('delete', old.id, old.name, old.absolute_path);
+            INSERT INTO ft_name_path (rowid, name, absolute_path) VALUES (new.id, new.name, new.absolute_path);
+        END""",
+        """CREATE TABLE IF NOT EXISTS Import_Jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            root_path TEXT NOT NULL,
+            parent_id INTEGER NULL,
+            root_id INTEGER NULL,
+            status TEXT NOT NULL,
+            rows_inserted INTEGER NOT NULL DEFAULT 0,
+            completed_dirs INTEGER NOT NULL DEFAULT 0,
+            started REAL NOT NULL,
+            updated REAL NOT NULL,
+            error TEXT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS Import_Frontier (
+            job_id INTEGER NOT NULL REFERENCES Import_Jobs(id) ON DELETE CASCADE,
+            directory_id INTEGER NOT NULL,
+            absolute_path TEXT NOT NULL,
+            PRIMARY KEY (job_id, directory_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS Load_Staging (
+            load_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            absolute_path TEXT NOT NULL,
+            path_key BLOB NOT NULL,
+            parent_key BLOB NULL,
+            size INTEGER NULL,
+            mtime REAL NULL,
+            inode INTEGER NULL,
+            content_hash TEXT NULL,
+            extension TEXT NULL,
+            PRIMARY KEY (load_id, seq)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_load_depth ON Load_Staging (load_id, depth, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_load_path_key ON Load_Staging (load_id, path_key)",
+        """CREATE TABLE IF NOT EXISTS Root_Extension_Stats (
+            root_id INTEGER NOT NULL,
+            extension TEXT NOT NULL,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            PRIMARY KEY (root_id, extension)
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS Root_Size_Stats (
+            root_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            PRIMARY KEY (root_id, bucket)
+        ) WITHOUT ROWID""",
+    ]
+    # Created after the SCHEMA_COLUMNS they cover
+    SCHEMA_INDEXES = {
+        "idx_name_id": "CREATE INDEX IF NOT EXISTS idx_name_id ON Files_And_Directories (name, id)",
+        "idx_size_id": "CREATE INDEX IF NOT EXISTS idx_size_id ON Files_And_Directories (size, id)",
+        "idx_content_hash": "CREATE INDEX IF NOT EXISTS idx_content_hash ON Files_And_Directories (content_hash)",
+        "idx_total_size_id": "CREATE INDEX IF NOT EXISTS idx_total_size_id ON Files_And_Directories (total_size, id)",
+        "idx_root_size": "CREATE INDEX IF NOT EXISTS idx_root_size ON Files_And_Directories (root_id, size)",
+        "idx_root_extension_size":
+            "CREATE INDEX IF NOT EXISTS idx_root_extension_size ON Files_And_Directories (root_id, extension, size)",
+    }
+    TRIGRAM_SIZE = 3
+    PATH_KEY_TYPE = "BLOB"
+    STAGED_INSERT_QUERY = """INSERT OR IGNORE INTO Files_And_Directories (name, type, parent_id, absolute_path, path_key, size, mtime, inode, content_hash, total_size, file_count, extension, root_id)
+                             SELECT s.name, s.type, p.id, s.absolute_path, s.path_key, s.size, s.mtime, s.inode,
+                                    s.content_hash, CASE WHEN s.type = 'file' THEN COALESCE(s.size, 0) ELSE 0 END,
+                                    CASE WHEN s.type = 'file' THEN 1 ELSE 0 END, s.extension, p.root_id
+                             FROM Load_Staging s LEFT JOIN Files_And_Directories p ON p.path_key = s.parent_key
+                             WHERE s.load_id = %s AND s.depth = %s AND s.seq >= %s AND s.seq < %s ORDER BY s.seq"""
+    # Correlated, so that SQLite starts from the few roots rather than from every staged row
+    STAGED_PARENTS_QUERY = """UPDATE Files_And_Directories SET parent_id = (
+                                  SELECT p.id FROM Load_Staging s JOIN Files_And_Directories p ON p.path_key = s.parent_key
+                                  WHERE s.load_id = %s AND s.path_key = Files_And_Directories.path_key)
+                              WHERE parent_id IS NULL AND EXISTS (
+                                  SELECT 1 FROM Load_Staging s JOIN Files_And_Directories p ON p.path_key = s.parent_key
+                                  WHERE s.load_id = %s AND s.path_key = Files_And_Directories.path_key)"""
+    STATS_UPSERT_QUERY = """INSERT INTO {table} (root_id, {key}, files, bytes) VALUES (%s, %s, %s, %s)
+                            ON CONFLICT (root_id, {key}) DO UPDATE SET files = files + excluded.files,
+                                                                      bytes = bytes + excluded.bytes"""
+    ROOT_FILL_QUERY = """UPDATE Files_And_Directories AS f SET root_id = p.root_id FROM Files_And_Directories AS p
+                         WHERE p.id = f.parent_id AND f.root_id IS NULL AND p.root_id IS NOT NULL"""
+
+    def __init__(self, path: str):
+        self.path = path
+        super().__init__()
+        try:
+            self.selfcheck()
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not open the catalog {path}: {e}")
+            self.error_code = Errors.SOMETHING_WENT_WRONG
+
+    def selfcheck(self):
+        """ Creates the schema on a pooled connection, there is no server to prepare """
+        with self._cursor() as cursor:
+            for statement in self.SCHEMA:
+                cursor.execute(statement)
+            existing = self._table_columns(cursor)
+            added = [column for column in self.SCHEMA_COLUMNS if column not in existing]
+            for column in added:
+                cursor.execute(f"ALTER TABLE Files_And_Directories ADD COLUMN {column} {self.SCHEMA_COLUMNS[column]}")
+            cursor.connection.commit()
+            if "absolute_path_hash" in existing:
+                self.migrate_path_keys(cursor)
+                for statement in self.SCHEMA:  # the triggers and indexes went with the old table
+                    cursor.execute(statement)
+            for statement in self.SCHEMA_INDEXES.values():
+                cursor.execute(statement)
+            cursor.connection.commit()
+            if "total_size" in added:
+                self._rebuild_rollups(cursor)
+            if "root_id" in added:
+                # Staged rows carry the extension since, the rows of an interrupted older load are of no use anyway
+                cursor.execute("DROP TABLE IF EXISTS Load_Staging")
+                for statement in self.SCHEMA:
+                    if "Load_Staging" in statement:
+                        cursor.execute(statement)
+                self._fill_stats(cursor)
+
+    def _search_clause(self, keyword_string, match_all: bool = False):
+        """ Keywords of at least TRIGRAM_SIZE characters are looked up in the trigram index, shorter ones with LIKE.
+        Relevance counts the keywords found in the name twice and in the path once """
+        phrases, conditions, params, relevance_params = [], [], [], []
+        keywords = [keyword.replace('"', "") for keyword in (keyword_string or "").split()]
+        keywords = [keyword for keyword in keywords if keyword]
+        if not keywords:
+            return None
+
+        for keyword in keywords:
+            if len(keyword) >= self.TRIGRAM_SIZE:
+                phrases.append(f'"{keyword}"')
+            else:
+                pattern = "%" + keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                conditions.append("(f.name LIKE %s ESCAPE '\\' OR f.absolute_path LIKE %s ESCAPE '\\')")
+                params += [pattern, pattern]
+            relevance_params += [keyword.lower(), keyword.lower()]
+        if phrases:
+            conditions.insert(0, "f.id IN (SELECT rowid FROM ft_name_path WHERE ft_name_path MATCH %s)")
+            params.insert(0, (" AND " if match_all else " OR ").join(phrases))
+
+        relevance = " + ".join(
+            ["(instr(lower(f.name), %s) > 0) * 2 + (instr(lower(f.absolute_path), %s) > 0)"] * len(keywords)
+        )
+        return {"condition": f"({(' AND ' if match_all else ' OR ').join(conditions)})", "params": params,
+                "relevance": f"({relevance})", "relevance_params": relevance_params}
+
+    def _interrupt(self, connection):
+        connection.interrupt()
+
+    @classmethod
+    def _table_columns(cls, cursor):
+        cursor.execute("PRAGMA table_info(Files_And_Directories)")
+        return {row[1].lower() for row in cursor.fetchall()}
+
+    @classmethod
+    def _finalize_path_keys(cls, cursor):
+        """ SQLite drops no UNIQUE column, so the table is copied into one keyed by path_key in one transaction.
+        Ids are kept, which keeps the rows of the external content FTS index valid """
+        existing = cls._table_columns(cursor)
+        added = [column for column in cls.SCHEMA_COLUMNS if column in existing]  # selfcheck adds the others
+        columns = ["id", "name", "type", "parent_id", "absolute_path", "size", "path_key", *added]
+        cursor.connection.commit()
+        cursor.execute("PRAGMA foreign_keys = OFF")  # the copy still points at the old table until the rename
+        try:
+            cursor.execute("BEGIN")
+            for trigger in ("ft_name_path_insert", "ft_name_path_delete", "ft_name_path_update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute(cls.SCHEMA[0].replace("IF NOT EXISTS Files_And_Directories", "Files_And_Directories_keyed", 1))
+            for column in added:
+                cursor.execute(f"ALTER TABLE Files_And_Directories_keyed ADD COLUMN {column} {cls.SCHEMA_COLUMNS[column]}")
+            cursor.execute(f"INSERT INTO Files_And_Directories_keyed ({', '.join(columns)}) "
+                           f"SELECT {', '.join(columns)} FROM Files_And_Directories")
+            cursor.execute("DROP TABLE Files_And_Directories")
+            cursor.execute("ALTER TABLE Files_And_Directories_keyed RENAME TO Files_And_Directories")
+            cursor.connection.commit()
+        except BaseException:
+            cursor.connection.rollback()
+            raise
+        finally:
+            cursor.execute("PRAGMA foreign_keys = ON")
+
+    def _connect(self):
+        return _SQLiteConnection(self.path)
+
+
+@lru_cache(maxsize=512)
+def _sqlite_query(query: str):
+    return query.replace("%s", "?")
+
+
+class _SQLiteConnection:
+    """ sqlite3 connection answering the pymysql calls made by CatalogStorage """
+
+    def __init__(self, path: str):
+        # sqlite3 keeps the compiled statements of a connection, repeated queries are prepared once
+        self.raw = sqlite3.connect(path, timeout=30, check_same_thread=False, cached_statements=256)
+        self.raw.execute("PRAGMA journal_mode = WAL")
+        self.raw.execute("PRAGMA synchronous = NORMAL")
+        self.raw.execute("PRAGMA foreign_keys = ON")
+
+    def cursor(self, cursor_class=None):
+        return _SQLiteCursor(self)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self, reconnect: bool = False):
+        self.raw.execute("SELECT 1")
+
+    def interrupt(self):
+        self.raw.interrupt()
+
+    def close(self):
+        self.raw.close()
+
+
+class _SQLiteCursor:
+    def __init__(self, connection: _SQLiteConnection):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+
+    def execute(self, query: str, params=()):
+        self._cursor.execute(_sqlite_query(query), tuple(params or ()))
+
+    def executemany(self, query: str, rows):
+        self._cursor.executemany(_sqlite_query(query), rows)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size: int):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConnectionPool:
+    """ Bounded pool of connections checked out per operation.
+    A connection idle for longer than health_check_after is pinged before it is handed out,
+    one idle for longer than idle_timeout is closed instead """
+
+    def __init__(self, connect, max_size: int = 8, health_check_after: float = 30.0, idle_timeout: float = 300.0,
+                 checkout_timeout: float = 60.0):
+        self._connect = connect
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []  # (connection, last released), most recently used last
+        self._lock = threading.Lock()
+        self.health_check_after = health_check_after
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise TimeoutError("No free database connection in the pool")
+        try:
+            while True:
+                with self._lock:
+                    self._evict_idle()
+                    connection, released = self._idle.pop() if self._idle else (None, None)
+                if connection is None:
+                    return self._connect()
+                if time.monotonic() - released < self.health_check_after or self._is_alive(connection):
+                    return connection
+                self._close(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection):
+        """ Ends the transaction the connection was left in, even after reads, so the next checkout sees the rows
+        committed meanwhile and holds no locks. A connection that cannot roll back is discarded """
+        try:
+            connection.rollback()
+        except Exception:
+            self.discard(connection)
+            return
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+        self._slots.release()
+
+    def discard(self, connection):
+        """ Gives the slot back without keeping a connection whose state is unknown """
+        self._close(connection)
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        expired = [item for item in self._idle if now - item[1] > self.idle_timeout]
+        if expired:
+            self._idle = [item for item in self._idle if now - item[1] <= self.idle_timeout]
+            for connection, _ in expired:
+                self._close(connection)
+
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+class QueryCache:
+    """ LRU cache of query results bounded by the number of rows held and by age.
+    Writers bump the generation, of every kind of result or of the kinds they change only.
+    Results computed under an older generation are never served again. The kind of a tuple key is its first item """
+
+    def __init__(self, max_rows: int, ttl: float):
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, rows, generation, stored at), most recently used last
+        self._kind_generations = {}
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _kind(key):
+        return key[0] if isinstance(key, tuple) else key
+
+    def _generation(self, key):
+        return self.generation, self._kind_generations.get(self._kind(key), 0)
+
+    def get_or_compute(self, key, compute, cost=None):
+        """ Cached value of key, or the result of compute() which is stored unless a write happened meanwhile.
+        cost(value) is the number of rows a value holds, 1 when not given. Values are shared, callers must not
+        modify them """
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                value, rows, generation, stored_at = cached
+                if generation == self._generation(key) and time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            generation = self._generation(key)  # read before the query, a write during it makes the result stale
+
+        value = compute()
+        rows = cost(value) if cost else 1
+        with self._lock:
+            if generation == self._generation(key) and rows <= self.max_rows:
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = (value, rows, generation, time.monotonic())
+                self._rows += rows
+                while self._rows > self.max_rows:
+                    self._remove(next(iter(self._entries)))
+        return value
+
+    def invalidate(self, *kinds):
+        """ Called after every committed write that changed rows, drops the cached results of the given kinds,
+        all of them when no kind is given """
+        with self._lock:
+            if not kinds:
+                self.generation += 1
+                self._entries.clear()
+                self._rows = 0
+                return
+            for kind in kinds:
+                self._kind_generations[kind] = self._kind_generations.get(kind, 0) + 1
+            for key in [key for key in self._entries if self._kind(key) in kinds]:
+                self._remove(key)
+
+    def _remove(self, key):
+        self._rows -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "rows": self._rows,
+                    "generation": self.generation}
+
+
+class PathHashIndex:
+    """ In-process answer to "is this path key catalogued?" during an import.
+    Small subtrees are kept in an exact set, huge ones in a Bloom filter whose hits are confirmed in the database,
+    and when even the filter would exceed the memory cap every check becomes a chunked IN query """
+    EXACT = "exact"
+    BLOOM = "bloom"
+    QUERY = "query"
+    EXACT_ENTRY_BYTES = 100  # 16 byte key object plus its share of the set table
+    BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+    def __init__(self, expected_entries: int, memory_cap: int):
+        self.entries = 0
+        self._keys = None
+        self._bits = None
+        self._bit_count = 0
+        self._hash_count = 0
+
+        if expected_entries * self.EXACT_ENTRY_BYTES <= memory_cap:
+            self.mode = self.EXACT
+            self._keys = set()
+            return
+
+        bit_count = math.ceil(-expected_entries * math.log(self.BLOOM_FALSE_POSITIVE_RATE) / math.log(2) ** 2)
+        if bit_count // 8 <= memory_cap:
+            self.mode = self.BLOOM
+            self._bit_count = bit_count
+            self._hash_count = max(1, round(bit_count / expected_entries * math.log(2)))
+            self._bits = bytearray(bit_count // 8 + 1)
+        else:
+            self.mode = self.QUERY
+
+    def _positions(self, key: bytes):
+        # The two halves of the key combined into as many probes as needed (Kirsch-Mitzenmacher)
+        first, second = int.from_bytes(key[:8], "little"), int.from_bytes(key[8:16], "little") | 1
+        for i in range(self._hash_count):
+            yield (first + i * second) % self._bit_count
+
+    def add(self, keys):
+        for key in keys:
+            self.entries += 1
+            if self.mode == self.EXACT:
+                self._keys.add(key)
+            elif self.mode == self.BLOOM:
+                for position in self._positions(key):
+                    self._bits[position >> 3] |= 1 << (position & 7)
+
+    def _might_contain(self, key: bytes):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def existing(self, cursor, keys: list):
+        if self.mode == self.EXACT:
+            return {key for key in keys if key in self._keys}
+        if self.mode == self.BLOOM:
+            keys = [key for key in keys if self._might_contain(key)]
+        return CatalogStorage._existing_keys(cursor, keys)
+
+    @property
+    def memory_bytes(self):
+        if self.mode == self.EXACT:
+            key_size = sys.getsizeof(bytes(CatalogStorage.PATH_KEY_SIZE))
+            return sys.getsizeof(self._keys) + self.entries * key_size
+        if self.mode == self.BLOOM:
+            return sys.getsizeof(self._bits)
+        return 0
+
+    def describe(self):
+        return {"mode": self.mode, "entries": self.entries, "memory_bytes": self.memory_bytes}
+
+
+class _ImportPipeline:
+    """ Scanner threads list directories into a bounded queue of batches, writer threads drain it into the
+    database over their own connections and hand the new directories back to the scanners """
+
+    def __init__(self, db: CatalogStorage, batch_size: int, scan_workers: int, write_workers: int, queue_depth: int,
+                 index=None, job: ImportJob = None):
+        self.db = db
+        self.index = index
+        self.job = job
+        self.batch_size = batch_size
+        self.scan_workers = scan_workers
+        self.write_workers = write_workers
+        # LIFO walks depth-first, so the frontier holds a path per level instead of a whole level of a wide tree
+        self.directories = queue.LifoQueue()
+        self.batches = queue.Queue(maxsize=queue_depth)
+        self.outstanding = 0  # directories queued or being scanned + batches not written yet
+        self.finished = threading.Condition()
+        self.inserted = 0
+        self.error = None
+        # directory -> [scan and batches not written yet, nothing of it was skipped], finished at no work left
+        self.open_directories = {}
+
+    def run(self, directories: list):
+        self._add_work(len(directories))
+        for directory in directories:
+            self.directories.put(directory)
+
+        threads = [threading.Thread(target=self._scan_loop, daemon=True) for _ in range(self.scan_workers)]
+        threads += [threading.Thread(target=self._write_loop, daemon=True) for _ in range(self.write_workers)]
+        for thread in threads:
+            thread.start()
+
+        with self.finished:
+            self.finished.wait_for(lambda: self.outstanding == 0)
+        for _ in range(self.scan_workers):
+            self.directories.put(None)
+        for _ in range(self.write_workers):
+            self.batches.put(None)
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+        return self.inserted
+
+    def _add_work(self, count: int):
+        with self.finished:
+            self.outstanding += count
+
+    def _work_done(self):
+        with self.finished:
+            self.outstanding -= 1
+            if self.outstanding == 0:
+                self.finished.notify_all()
+
+    def _stopping(self):
+        return self.error is not None or (self.job is not None and self.job.cancelled)
+
+    def _hold(self, dir_id: int):
+        with self.finished:
+            self.open_directories.setdefault(dir_id, [0, True])[0] += 1
+
+    def _release(self, dir_id: int, completed: bool):
+        """ A directory is finished for the job once its scan and every batch of its listing are committed """
+        with self.finished:
+            state = self.open_directories[dir_id]
+            state[0] -= 1
+            state[1] = state[1] and completed
+            if state[0]:
+                return
+            del self.open_directories[dir_id]
+        if state[1] and self.job is not None:
+            self.job._finish_directory(dir_id)
+
+    def _put_batch(self, dir_id: int, batch: list):
+        self._add_work(1)
+        self._hold(dir_id)
+        self.batches.put((dir_id, batch))  # blocks while the writers are behind, which keeps memory bounded
+
+    def _scan_loop(self):
+        while True:
+            item = self.directories.get()
+            if item is None:
+                return
+            path, dir_id = item
+            self._hold(dir_id)
+            scanned = False
+            try:
+                if not self._stopping():
+                    batch = []
+                    for entry in self.db._scan_directory(path):
+                        batch.append(self.db._scan_row(entry, dir_id))
+                        if len(batch) >= self.batch_size:
+                            self._put_batch(dir_id, batch)
+                            batch = []
+                    if batch:
+                        self._put_batch(dir_id, batch)
+                    scanned = True
+            except Exception as e:
+                self.error = self.error or e
+            finally:
+                self._release(dir_id, scanned)
+                self._work_done()
+
+    def _write_loop(self):
+        connection, cursor = None, None
+        failed = False
+        try:
+            connection = self.db.pool.acquire()
+            cursor = connection.cursor()
+        except Exception as e:
+            self.error = self.error or e
+            failed = True
+
+        try:
+            while True:
+                item = self.batches.get()
+                if item is None:
+                    return
+                dir_id, batch = item
+                written_batch = False
+                try:
+                    # After a failure or a cancel the queue is still drained so that blocked scanners can finish
+                    if not self._stopping():
+                        written, new_dirs = self.db._write_batch(cursor, batch, self.index, self.job)
+                        written_batch = True
+                        self._add_work(len(new_dirs))
+                        with self.finished:
+                            self.inserted += written
+                        for new_dir in new_dirs:
+                            self.directories.put(new_dir)
+                except Exception as e:
+                    self.error = self.error or e
+                    failed = True
+                finally:
+                    self._release(dir_id, written_batch)
+                    self._work_done()
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if connection is not None:
+                # A connection that failed mid-transaction or could not open a cursor is not handed to anyone else
+                if failed:
+                    self.db.pool.discard(connection)
+                else:
+                    self.db.pool.release(connection)
+
+
+def _sample_digest(job):
+    """ (complete, digest) of the first and last sample_bytes of a file, complete when that is all of it.
+    The digest of a complete sample is the content hash. (False, None) when the file cannot be read """
+    path, size, sample_bytes = job
+    try:
+        with open(path, "rb") as f:
+            if size <= 2 * sample_bytes:
+                return True, hashlib.blake2b(f.read(), digest_size=CatalogStorage.CONTENT_HASH_SIZE).hexdigest()
+            digest = hashlib.blake2b(f.read(sample_bytes), digest_size=CatalogStorage.CONTENT_HASH_SIZE)
+            f.seek(-sample_bytes, os.SEEK_END)
+            digest.update(f.read(sample_bytes))
+            return False, digest.hexdigest()
+    except OSError:
+        return False, None
+
+
+def _content_digest(path: str, chunk_size: int = 1024 * 1024):
+    """ BLAKE2b of the whole file read in large chunks, None when it cannot be read """
+    digest = hashlib.blake2b(digest_size=CatalogStorage.CONTENT_HASH_SIZE)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    try:
+        with open(path, "rb", buffering=0) as f:
+            while read := f.readinto(buffer):
+                digest.update(view[:read])
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def get_db_credentials(filepath="configuration.json"):
+    try:
+        absolute_path = os.path.join(os.path.dirname(__file__), filepath)
+        with open(absolute_path, "r") as f:
+            configuration = json.load(f)
+            host = configuration.get("host")
+            port = configuration.get("port")
+            user = configuration.get("user")
+            password = configuration.get("password")
+            database = configuration.get("database")
+            return host, port, user, password, database
+    except FileNotFoundError:
+        return None, None, None, None, None
+    except json.JSONDecodeError:
+        return None, None, None, None, None
+    except TypeError:  # added type error handling
+        return None, None, None, None, None
+
+
+def get_metrics_settings(filepath="configuration.json"):
+    """ The "metrics" object of the configuration, None when metrics are off.
+    Keys: slow_query_ms, slow_query_log, export_path, export_interval (seconds), port and host of the /metrics endpoint.
+    Relative file paths are resolved next to the configuration file """
+    try:
+        absolute_path = os.path.join(os.path.dirname(__file__), filepath)
+        with open(absolute_path, "r") as f:
+            settings = json.load(f).get("metrics")
+    except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(settings, dict) or not settings.get("enabled", True):
+        return None
+    for key in ("slow_query_log", "export_path"):
+        if settings.get(key):
+            settings[key] = os.path.join(os.path.dirname(absolute_path), settings[key])
+    return settings
+
+
+def get_db_backend(filepath="configuration.json"):
+    """ ("mysql", None), or ("sqlite", path of the catalog file) when "backend" is "sqlite".
+    A relative "sqlite_path" is resolved next to the configuration file """
+    try:
+        absolute_path = os.path.join(os.path.dirname(__file__), filepath)
+        with open(absolute_path, "r") as f:
+            configuration = json.load(f)
+        backend = configuration.get("backend", "mysql")
+        sqlite_path = configuration.get("sqlite_path", "catalog.sqlite3")
+    except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+        return "mysql", None
+    if backend != "sqlite":
+        return "mysql", None
+    return "sqlite", os.path.join(os.path.dirname(absolute_path), sqlite_path)
 
 
+def open_catalog(password: str = None, filepath="configuration.json"):
+    """ The catalog configured in filepath, for scripts running without the UI.
+    Raises ConnectionError when it cannot be opened """
+    backend, sqlite_path = get_db_backend(filepath)
+    if backend == "sqlite":
+        db = SQLiteDatabaseManager(sqlite_path)
+    else:
+        host, port, user, configured_password, database = get_db_credentials(filepath)
+        if host is None or port is None or user is None or database is None:
+            raise ConnectionError("configuration.json needs host, port, user and database")
+        db = DatabaseManager(host=host, port=port, user=user, passwd=password or configured_password,
+                             database=database)
+    if db.error_code != Errors.EVERYTHING_IS_FINE:
+        raise ConnectionError(f"Could not open the catalog: {db.error_code.value}")
+    return db
 
 
 def encode_animation(file_path):
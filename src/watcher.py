@@ -0,0 +1,199 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+from units import CatalogStorage
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+              | IN_DONT_FOLLOW)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, length of the name that follows
+
+
+class WatchLimitReached(Exception):
+    """ The kernel refused another watch, see /proc/sys/fs/inotify/max_user_watches """
+
+
+class Inotify:
+    """ Thin ctypes binding of the Linux inotify calls """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def read_events(self):
+        """ (wd, mask, cookie, name) of the queued events, empty when there are none """
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].split(b"\0", 1)[0]
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+    def _raise(self, path: str = None):
+        error = ctypes.get_errno()
+        if error == errno.ENOSPC:
+            raise WatchLimitReached(path)
+        raise OSError(error, os.strerror(error), path)
+
+
+class CatalogWatcher:
+    """ Keeps imported roots current from inotify events.
+    Events are collected for window seconds after the first one and applied as one batch of listing diffs.
+    When inotify is unavailable or the watch limit is reached, every root is rescanned each rescan_interval """
+    WINDOW = 1.0
+    RESCAN_INTERVAL = 300.0
+
+    def __init__(self, db: CatalogStorage, roots: list, on_change=None, window: float = WINDOW,
+                 rescan_interval: float = RESCAN_INTERVAL):
+        self.db = db
+        self.roots = list(roots)
+        self.on_change = on_change  # called from the watcher thread with the counts of every applied batch
+        self.window = window
+        self.rescan_interval = rescan_interval
+        self.inotify = None
+        self.paths = {}  # watch descriptor -> directory
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def polling(self):
+        return self.inotify is None
+
+    def start(self):
+        try:
+            self.inotify = Inotify()
+            for root in self.roots:
+                self._watch_tree(root)
+        except (OSError, AttributeError, WatchLimitReached) as e:  # AttributeError: no inotify in this libc
+            self._fall_back(e)
+        self._thread = threading.Thread(target=self._run, name="catalog-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def add_root(self, root: str):
+        """ Watches a directory imported after the watcher started """
+        self.roots.append(root)
+        if not self.polling:
+            try:
+                self._watch_tree(root)
+            except WatchLimitReached as e:
+                self._fall_back(e)
+
+    def _watch_tree(self, root: str):
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            try:
+                self.paths[self.inotify.add_watch(directory)] = directory
+                with os.scandir(directory) as entries:
+                    pending.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+    def _fall_back(self, reason):
+        print(f"⚠️ Watching with inotify is not possible ({reason!r}), "
+              f"rescanning every {self.rescan_interval:.0f} seconds instead")
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        self.paths = {}
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.polling:
+                if self._stop.wait(self.rescan_interval):
+                    return
+                self._apply(lambda: [self.db._rescan_directory(root) for root in self.roots])
+                continue
+
+            if not select.select([self.inotify.fd], [], [], 0.5)[0]:
+                continue
+            dirty, overflow = self._collect()
+            if overflow:
+                # Events were dropped, the mtime based rescan finds what they said
+                self._apply(lambda: [self.db._rescan_directory(root) for root in self.roots])
+            elif dirty:
+                self._apply(lambda: [self.db._sync_directories(sorted(dirty))])
+
+    def _collect(self):
+        """ Directories whose listing changed during the window, and whether the kernel queue overflowed """
+        dirty, overflow = set(), False
+        deadline = time.monotonic() + self.window
+        while True:
+            for wd, mask, _, name in self.inotify.read_events():
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                directory = self.paths.get(wd)
+                if mask & IN_IGNORED:
+                    self.paths.pop(wd, None)
+                if directory is None or mask & (IN_IGNORED | IN_DELETE_SELF):
+                    continue  # the event in the parent directory covers it
+                dirty.add(directory)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watched before its listing is read, so nothing created inside it meanwhile is missed
+                    try:
+                        self._watch_tree(os.path.join(directory, name))
+                    except WatchLimitReached as e:
+                        self._fall_back(e)
+                        return dirty, True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return dirty, overflow
+            select.select([self.inotify.fd], [], [], remaining)
+
+    def _apply(self, sync):
+        try:
+            results = sync()
+        except Exception as e:
+            print(f"⚠️ Could not apply filesystem changes: {e}")
+            return
+        if self.on_change is not None:
+            totals = {}
+            for counts in results:
+                for key, value in counts.items():
+                    totals[key] = totals.get(key, 0) + value
+            self.on_change(totals)